@@ -0,0 +1,105 @@
+# Decode and resample throughput per container and resampling quality. Synthetic 44.1 kHz stereo tracks
+# (what most ripped libraries hold) are written as WAV, FLAC, OGG and MP3, then decoded to the analysis
+# rate the way the analyser used to (librosa.load(sr=22050)) and through the decode layer at every soxr
+# quality. The mean tempo/energy next to each run show what the faster qualities cost in accuracy.
+#
+#   python benchmarks/decode_benchmark.py --tracks 4 --duration 120
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.analyser import SAMPLE_RATE, _features_from_signal
+from music_lib.decode import RESAMPLE_QUALITIES, DecodeConfig, decode_audio
+from synthetic import random_tracks, render
+
+NATIVE_SR = 44100
+FORMATS = {
+    "wav": {},
+    "flac": {},
+    "ogg": {"format": "OGG", "subtype": "VORBIS"},
+    "mp3": {"format": "MP3", "subtype": "MPEG_LAYER_III"},
+}
+
+
+def write_tracks(workdir: str, tracks, formats) -> dict:
+    import soundfile
+    files = {fmt: [] for fmt in formats}
+    for i, track in enumerate(tracks):
+        y = render(track, NATIVE_SR)
+        stereo = np.ascontiguousarray(np.stack([y, 0.8 * np.roll(y, 40)], axis=1))
+        for fmt in formats:
+            path = os.path.join(workdir, f"track{i}.{fmt}")
+            # Written in small blocks, a single large Vorbis write crashes some libsndfile builds
+            with soundfile.SoundFile(path, 'w', NATIVE_SR, 2, **FORMATS[fmt]) as f:
+                for start in range(0, len(stereo), 4096):
+                    f.write(stereo[start:start + 4096])
+            files[fmt].append(path)
+    return files
+
+
+def legacy_decode(path):
+    import librosa
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return librosa.load(path, sr=SAMPLE_RATE)
+
+
+def measure(paths, decode) -> dict:
+    start = time.perf_counter()
+    signals = [decode(path) for path in paths]
+    seconds = time.perf_counter() - start
+    features = [_features_from_signal(y, sr) for y, sr in signals]
+    return {
+        "seconds": seconds,
+        "realtime": sum(len(y) / sr for y, sr in signals) / seconds,
+        "tempo": float(np.mean([f.tempo for f in features])),
+        "energy": float(np.mean([f.energy for f in features])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode throughput per format and resampling quality.")
+    parser.add_argument("--tracks", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=120.0)
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        files = write_tracks(workdir, random_tracks(args.tracks, duration=args.duration), args.formats)
+        # Warm-up, so imports and numba compilation aren't timed
+        first = files[args.formats[0]][0]
+        legacy_decode(first)
+        _features_from_signal(*decode_audio(first, SAMPLE_RATE))
+
+        for fmt, paths in files.items():
+            results[fmt] = {"librosa.load": measure(paths, legacy_decode)}
+            for quality in RESAMPLE_QUALITIES:
+                config = DecodeConfig(resample_quality=quality)
+                results[fmt][quality] = measure(paths, lambda path: decode_audio(path, SAMPLE_RATE, config=config))
+
+    print(f"{args.tracks} tracks x {args.duration:.0f}s, {NATIVE_SR} Hz stereo decoded to {SAMPLE_RATE} Hz mono:")
+    for fmt, rows in results.items():
+        baseline = rows["librosa.load"]["seconds"]
+        for name, r in rows.items():
+            print(f"  {fmt:<5} {name:<13} {r['realtime']:6.0f}x realtime  {baseline / r['seconds']:5.2f}x  "
+                  f"tempo {r['tempo']:7.2f}  energy {r['energy']:.4f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Library charts on a synthetic library: the way they used to be drawn (Python lists from every Song,
+# plt.hist on them, one pyplot figure per chart) against the histograms saved with the feature store
+# (built once from the columns) drawn into a single figure. matplotlib is imported before timing starts.
+#
+#   python benchmarks/histogram_benchmark.py --songs 500000
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from music_lib.histograms import build_histograms, load_or_build_histograms, render_histograms
+from music_lib.scanner import Song
+from music_lib.store import open_store, write_store
+from memory_benchmark import build
+
+
+def legacy_histograms(songs, output_dir):
+    tempos = [float(s.tempo) for s in songs if s.tempo is not None]
+    energies = [float(s.energy) for s in songs if s.energy is not None]
+    moods = Counter(s.mood for s in songs if s.mood is not None)
+    for name, values in (("tempo", tempos), ("energy", energies)):
+        plt.figure(figsize=(8, 5))
+        plt.hist(values, bins=10, edgecolor='black')
+        plt.savefig(os.path.join(output_dir, f"{name}_histogram.png"))
+        plt.close()
+    plt.figure(figsize=(6, 4))
+    plt.bar(list(moods.keys()), list(moods.values()), edgecolor='black')
+    plt.savefig(os.path.join(output_dir, "mood_histogram.png"))
+    plt.close()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to draw the library charts.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    args = parser.parse_args()
+
+    songs = build(Song, args.songs)
+    with tempfile.TemporaryDirectory() as workdir:
+        store_dir = os.path.join(workdir, "store")
+        write_store(songs, store_dir)
+        table = open_store(store_dir)
+
+        _, legacy = timed(lambda: legacy_histograms(songs, workdir))
+        _, built = timed(lambda: build_histograms(table))
+        load_or_build_histograms(table, store_dir)
+        histograms, loaded = timed(lambda: load_or_build_histograms(table, store_dir))
+        _, rendered = timed(lambda: render_histograms(histograms, os.path.join(workdir, "library.png")))
+
+    print(f"{args.songs} songs:")
+    print(f"  before: lists + 3 pyplot figures   {legacy:6.2f}s")
+    print(f"  build histograms from the store    {built:6.3f}s  (once, when the store is written)")
+    print(f"  load saved histograms              {loaded:6.3f}s")
+    print(f"  render one multi-panel image       {rendered:6.3f}s")
+    print(f"  after (load + render): {loaded + rendered:.3f}s, {legacy / (loaded + rendered):.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Title lookups on a large synthetic feature store: the old linear case-insensitive scan
+# (LibraryTable.find) against the lookup index, for exact titles, "Artist - Title", typos and
+# titles shared by many artists. Titles are made of common words, so popular trigrams have long
+# posting lists (more so than in a real library). Fails if the median of an exact lookup goes over
+# --budget or that of a near match over --fuzzy-budget.
+#
+#   python benchmarks/lookup_benchmark.py --songs 500000 --budget 0.01 --fuzzy-budget 0.05
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from music_lib.lookup import LOOKUP_FILE, TrackLookup, describe, load_or_build_lookup
+from music_lib.scanner import Song
+from music_lib.store import open_store, write_store
+
+WORDS = ("love", "night", "heart", "baby", "time", "dance", "fire", "rain", "dream", "light", "home", "blue",
+         "summer", "road", "girl", "world", "money", "river", "moon", "stars", "forever", "tonight", "gold",
+         "electric", "wild", "golden", "midnight", "city", "angel", "shadow", "ocean", "paradise", "sweet",
+         "broken", "runaway", "thunder", "silver", "velvet", "highway", "yesterday", "tomorrow", "kingdom")
+
+
+def build(count: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    # Zipf-like word choice: a few words are in a large share of the titles
+    weights = 1.0 / np.arange(1, len(WORDS) + 1)
+    words = rng.choice(len(WORDS), size=(count, 3), p=weights / weights.sum())
+    lengths = rng.integers(1, 4, size=count)
+    songs = []
+    for i in range(count):
+        artist = f"Artist {i // 25:05d}"
+        album = f"Album {i // 10:06d}"
+        title = " ".join(WORDS[w] for w in words[i, :lengths[i]]).title() + f" {i:x}"
+        if i % 1000 == 0:
+            title = "Yesterday"  # one title shared by 1 in 1000 songs, across many artists
+        songs.append(Song(f"/music/{artist}/{album}/{i % 10 + 1:02d}.flac", artist, album, i % 10 + 1, title, "Rock"))
+    return songs
+
+
+def timed(fn, runs: int):
+    fn()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure title lookups on a large feature store.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=0.01, help="Median latency budget for exact lookups in seconds.")
+    parser.add_argument("--fuzzy-budget", type=float, default=0.05, help="Median latency budget for near matches in seconds.")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        store_dir = os.path.join(workdir, "songs_store")
+        write_store(build(args.songs), store_dir)
+        table = open_store(store_dir)
+
+        start = time.perf_counter()
+        lookup = load_or_build_lookup(table, store_dir)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        lookup = TrackLookup.load(os.path.join(store_dir, LOOKUP_FILE), table)
+        load_seconds = time.perf_counter() - start
+        size = os.path.getsize(os.path.join(store_dir, LOOKUP_FILE))
+        print(f"Tracks: {len(table)}, index built in {build_seconds:.2f}s, {size / 1e6:.1f} MB, loaded in {load_seconds * 1000:.1f} ms")
+
+        target = args.songs * 3 // 4 + 1
+        title, artist = table.string("title", target), table.category("artist", target)
+        # (name, query, exact)
+        queries = [
+            ("exact title", title, True),
+            ("different case and punctuation", f"  {title.upper()}!", True),
+            ("Artist - Title", f"{artist} - {title}", True),
+            ("title shared by many artists", "yesterday", True),
+            ("shared title, Artist - Title", f"{table.category('artist', 1000)} - Yesterday", True),
+            ("typo", title[:2] + title[3:], False),
+            ("typo, Artist - Title", f"{artist} - {title[:-1]}", False),
+        ]
+
+        legacy, _ = timed(lambda: table.find("title", title, ignore_case=True), max(1, args.runs // 10))
+        print(f"{legacy * 1000:9.2f} ms  linear scan (LibraryTable.find, ignore_case)")
+        for name, query, exact in queries:
+            median, (row, candidates) = timed(lambda: lookup.resolve(query), args.runs)
+            result = describe(table, row) if row is not None else f"{len(candidates)} candidates"
+            print(f"{median * 1000:9.2f} ms  {name:<32} {query!r} -> {result}")
+            if median > (args.budget if exact else args.fuzzy_budget):
+                ok = False
+
+    if not ok:
+        print(f"FAIL: a lookup is over its budget ({args.budget * 1000:.0f} ms exact, {args.fuzzy_budget * 1000:.0f} ms near)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Memory and pickle size of the in-memory library: Song objects built the way scan_library builds them
+# (artist and album from the directory names, genre from the tags) with analysis results filled in, compared
+# with the layout Song had before (a __dict__ per song and a separate copy of every repeated string).
+#
+#   python benchmarks/memory_benchmark.py --songs 500000
+import argparse
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from music_lib.scanner import Song
+
+GENRES = ("Rock", "Pop", "Jazz", "Classical", "Electronic", "Hip-Hop", "Alternative", "Metal")
+MOODS = ("Energetic", "Happy", "Neutral", "Calm", "Sad")
+
+
+class LegacySong:
+    def __init__(self, path, artist, album, track_no, title, genre=None):
+        self.path = path
+        self.artist = artist
+        self.album = album
+        self.track_no = track_no
+        self.title = title
+        self.genre = genre
+        self.size = None
+        self.mtime = None
+        self.tempo = None
+        self.energy = None
+        self.mood = None
+        self.score = None
+        self.chroma = None
+        self.centroid = None
+        self.tier = None
+
+
+def build(cls, count: int) -> list:
+    songs = []
+    for i in range(count):
+        # Like the scanner: every album directory yields its own artist/album strings,
+        # and every tag read returns a new genre string
+        artist = f"Artist {i // 30:05d}"
+        album = f"Album {i // 10:06d}"
+        genre = "".join(GENRES[(i // 10) % len(GENRES)])
+        title = f"Track {i:07d}"
+        song = cls(f"/music/{artist}/{album}/{i % 10 + 1:02d} - {title}.flac", artist, album, i % 10 + 1, title, genre)
+        song.size = 4_000_000 + i
+        song.mtime = 1_700_000_000_000_000_000 + i
+        song.tempo = 60.0 + (i * 7919 % 12000) / 100
+        song.energy = (i * 104729 % 1000) / 1000
+        song.mood = MOODS[i % len(MOODS)]
+        song.score = (i * 15485863 % 1000) / 1000
+        song.chroma = (i * 32452843 % 1000) / 1000
+        song.centroid = 500.0 + (i * 49979687 % 400000) / 100
+        song.tier = "full"
+        songs.append(song)
+    return songs
+
+
+def measure(cls, count: int) -> dict:
+    tracemalloc.start()
+    songs = build(cls, count)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    data = pickle.dumps(songs, protocol=pickle.HIGHEST_PROTOCOL)
+    dump_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    pickle.loads(data)
+    load_seconds = time.perf_counter() - start
+    return {
+        "memory_mb": memory / 1e6,
+        "bytes_per_song": memory / count,
+        "pickle_mb": len(data) / 1e6,
+        "pickle_dump_s": dump_seconds,
+        "pickle_load_s": load_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory use and pickle size of the Song list.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    args = parser.parse_args()
+
+    results = {"before": measure(LegacySong, args.songs), "after": measure(Song, args.songs)}
+    print(f"{args.songs} songs:")
+    for name, r in results.items():
+        print(f"  {name:<7} {r['memory_mb']:8.1f} MB ({r['bytes_per_song']:5.0f} B/song)  "
+              f"pickle {r['pickle_mb']:7.1f} MB  dump {r['pickle_dump_s']:5.2f}s  load {r['pickle_load_s']:5.2f}s")
+    before, after = results["before"], results["after"]
+    print(f"  memory {after['memory_mb'] / before['memory_mb']:.2f}x, pickle {after['pickle_mb'] / before['pickle_mb']:.2f}x of before")
+
+
+if __name__ == "__main__":
+    main()
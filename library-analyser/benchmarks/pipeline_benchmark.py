@@ -0,0 +1,206 @@
+# Times every stage of the pipeline (scan, decode, feature extraction, analysis, cache, store and
+# each playlist mode) on synthetic libraries of several sizes and writes the results as JSON,
+# so runs from two commits can be compared. Everything is generated locally, nothing is downloaded.
+#
+#   python benchmarks/pipeline_benchmark.py --sizes 20 100 --output before.json
+#   python benchmarks/pipeline_benchmark.py --sizes 20 100 --output after.json --compare before.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.analyser import _features_from_signal, _load_audio, analyze_songs
+from music_lib.cache import apply_cache, load_cache, save_cache
+from music_lib.playlist import (create_genre_playlist, create_mood_transition_playlist,
+                                create_scenario_playlist, create_similarity_playlist)
+from music_lib.scanner import scan_library
+from music_lib.similarity import SimilarityIndex
+from music_lib.store import open_store, write_store
+from synthetic import SyntheticTrack, write_library, write_track
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _versions() -> dict:
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    for name in ("librosa", "soundfile", "scipy", "mutagen"):
+        try:
+            versions[name] = __import__(name).__version__
+        except Exception:
+            versions[name] = None
+    return versions
+
+
+# Runs fn `repeat` times with its output silenced and returns (last result, fastest time)
+def timed(fn, repeat: int = 1):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def run_size(workdir: str, size: int, args) -> list:
+    library = os.path.join(workdir, "library")
+    index_file = os.path.join(workdir, "scan_index.json")
+    cache_file = os.path.join(workdir, "songs_cache.pkl")
+    store_dir = os.path.join(workdir, "songs_store")
+    results = []
+
+    def record(stage, seconds, items=size):
+        results.append({
+            "songs": size,
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            "per_song_ms": round(seconds * 1000 / items, 4) if items else None,
+        })
+        print(f"  {stage:<24} {seconds * 1000:10.1f} ms")
+
+    _, seconds = timed(lambda: write_library(library, size, duration=args.duration, ext=args.ext))
+    record("generate", seconds)
+
+    # The first scan has no index and reads every tag, the second one only stats directories and files
+    songs, seconds = timed(lambda: scan_library(library, index_file=index_file))
+    record("scan_cold", seconds)
+    _, seconds = timed(lambda: scan_library(library, index_file=index_file), args.repeat)
+    record("scan_indexed", seconds)
+    _, seconds = timed(lambda: scan_library(library), args.repeat)
+    record("scan_full", seconds)
+
+    # Decode and feature extraction on one core, to separate the two costs. Timed once, the decoded
+    # signals are the feature step's input.
+    start = time.perf_counter()
+    decoded = [_load_audio(song.path) for song in songs]
+    record("decode", time.perf_counter() - start)
+    start = time.perf_counter()
+    for y, sr in decoded:
+        _features_from_signal(y, sr)
+    record("features", time.perf_counter() - start)
+    decoded.clear()
+
+    _, seconds = timed(lambda: analyze_songs(songs, jobs=args.jobs))
+    record(f"analyze_jobs{args.jobs}", seconds)
+
+    _, seconds = timed(lambda: save_cache(songs, cache_file), args.repeat)
+    record("cache_save", seconds)
+
+    def load_and_apply():
+        fresh = scan_library(library, index_file=index_file)
+        return apply_cache(fresh, load_cache(cache_file))
+    (stale, _, _), seconds = timed(load_and_apply, args.repeat)
+    if stale:
+        raise RuntimeError(f"{len(stale)} songs missed the cache")
+    record("cache_load", seconds)
+
+    _, seconds = timed(lambda: write_store(songs, store_dir), args.repeat)
+    record("store_write", seconds)
+    table, seconds = timed(lambda: open_store(store_dir), args.repeat)
+    record("store_open", seconds)
+    index, seconds = timed(lambda: SimilarityIndex.build(table), args.repeat)
+    record("similarity_index", seconds)
+
+    first, last = table.song(0), table.song(len(table) - 1)
+    output = os.path.join(workdir, "playlist.m3u")
+    playlists = {
+        "playlist_genre": lambda: create_genre_playlist(table, "Rock", output),
+        "playlist_mood_transition": lambda: create_mood_transition_playlist(
+            table, first, last, output, max_songs=args.max_songs, index=index),
+        "playlist_scenario": lambda: create_scenario_playlist(table, "gym", output, max_songs=args.max_songs),
+        "playlist_similarity": lambda: create_similarity_playlist(
+            table, first, output, max_songs=args.max_songs, index=index),
+    }
+    for stage, fn in playlists.items():
+        path, seconds = timed(fn, args.repeat)
+        if path is None:
+            raise RuntimeError(f"{stage} produced no playlist")
+        record(stage, seconds)
+
+    return results
+
+
+# librosa's import and numba compilation would otherwise be charged to the first library size
+def warm_up(workdir: str):
+    path = os.path.join(workdir, "warm_up.flac")
+    write_track(SyntheticTrack(bpm=120, duration=5.0, loudness=0.2, brightness=0.5, tone_hz=440.0, seed=0), path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _features_from_signal(*_load_audio(path))
+
+
+def compare(results: list, baseline_file: str):
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    before = {(r["songs"], r["stage"]): r["seconds"] for r in baseline["results"]}
+
+    print(f"\nCompared with {baseline_file} ({baseline['meta'].get('commit')}):")
+    for r in results:
+        old = before.get((r["songs"], r["stage"]))
+        if old:
+            print(f"  {r['songs']:>6} {r['stage']:<24} {old * 1000:10.1f} -> {r['seconds'] * 1000:10.1f} ms"
+                  f"  ({r['seconds'] / old:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the pipeline on synthetic libraries.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--duration", type=float, default=30.0, help="Length of each synthetic track in seconds.")
+    parser.add_argument("--ext", choices=[".flac", ".ogg"], default=".flac")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-songs", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each cheap stage, the fastest one counts.")
+    parser.add_argument("--output", help="Write the results to this JSON file (default: print them).")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare with.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        warm_up(workdir)
+
+    results = []
+    for size in args.sizes:
+        print(f"{size} songs:")
+        with tempfile.TemporaryDirectory() as workdir:
+            results += run_size(workdir, size, args)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "versions": _versions(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
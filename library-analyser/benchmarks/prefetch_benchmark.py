@@ -0,0 +1,109 @@
+# How well the staged analysis pipeline hides slow storage. Generates a synthetic library and analyzes
+# it with every file read costing an extra --latency-ms (like a network share or a spinning disk seeking),
+# once with prefetching off (each worker reads its own files, as before the pipeline) and once per
+# prefetch setting. The latency is simulated with a sleep on whichever side opens the file, which
+# needs the workers to be forked (the default on Linux) so they see the patched function.
+#
+#   python benchmarks/prefetch_benchmark.py --tracks 24 --latency-ms 300 --jobs 2
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib import analyser
+from music_lib.pipeline import PipelineConfig
+from music_lib.scanner import scan_library
+from synthetic import write_library
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+@contextlib.contextmanager
+def slow_storage(latency: float):
+    read_track, extract_features = analyser._read_track, analyser.extract_features
+
+    def slow_read(song, preview, max_bytes):
+        time.sleep(latency)
+        return read_track(song, preview, max_bytes)
+
+    def slow_extract(filepath, stream=None, preview=None, decode=None):
+        time.sleep(latency)
+        return extract_features(filepath, stream, preview, decode)
+
+    analyser._read_track, analyser.extract_features = slow_read, slow_extract
+    try:
+        yield
+    finally:
+        analyser._read_track, analyser.extract_features = read_track, extract_features
+
+
+def run(songs, jobs: int, config: PipelineConfig, latency: float) -> dict:
+    songs = copy.deepcopy(songs)
+    output = io.StringIO()
+    with slow_storage(latency), contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        analyser.analyze_songs(songs, jobs=jobs, pipeline=config)
+        elapsed = time.perf_counter() - start
+    pipeline_line = next((line for line in output.getvalue().splitlines() if line.startswith("Pipeline:")), "")
+    return {
+        "io_threads": config.io_threads,
+        "decode_threads": config.decode_threads,
+        "prefetch": config.prefetch,
+        "seconds": elapsed,
+        "tracks_per_sec": len(songs) / elapsed,
+        "analyzed": sum(1 for s in songs if s.tempo is not None),
+        "pipeline": pipeline_line,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis throughput on simulated slow storage.")
+    parser.add_argument("--tracks", type=int, default=24)
+    parser.add_argument("--duration", type=float, default=30.0, help="Length of each synthetic track in seconds.")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Extra time every file read takes.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--io-threads", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--prefetch", type=int, default=8)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    configs = [PipelineConfig(prefetch=0)] + [
+        PipelineConfig(io_threads=n, prefetch=args.prefetch) for n in args.io_threads
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write_library(workdir, args.tracks, duration=args.duration)
+        songs = scan_library(workdir)
+        # Warm-up: librosa's import (in the workers and, for the decode stage, in this process) and numba
+        # compilation shouldn't count against the first configuration
+        run(songs[:args.jobs], args.jobs, PipelineConfig(), 0.0)
+
+        for config in configs:
+            result = run(songs, args.jobs, config, latency)
+            results.append(result)
+            name = "no prefetch" if config.prefetch == 0 else f"{config.io_threads} io threads"
+            print(f"{name:<16} {result['seconds']:7.2f}s  {result['tracks_per_sec']:6.2f} tracks/sec  {result['pipeline']}")
+
+    baseline = results[0]["seconds"]
+    for result in results[1:]:
+        print(f"io_threads={result['io_threads']}: {baseline / result['seconds']:.2f}x faster than no prefetch")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
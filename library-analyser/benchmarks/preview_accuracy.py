@@ -0,0 +1,95 @@
+# Accuracy and speed of the preview analysis tier compared with full analysis.
+# Generates a synthetic corpus with known tempos, analyzes it with the full tier and with each preview
+# configuration, and reports tempo error against the true tempo, energy error and mood agreement
+# against full analysis, and throughput.
+#
+#   python benchmarks/preview_accuracy.py --tracks 40 --sample-rates 22050,11025 --json results.json
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.analyser import PreviewConfig, extract_features
+from synthetic import random_tracks, write_track
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+
+# A tempo counts as correct within 4% of the truth, octave errors (half/double tempo) count as misses
+def tempo_hit(estimate: float, truth: float) -> bool:
+    return abs(estimate - truth) <= 0.04 * truth
+
+
+def run_tier(paths, preview):
+    start = time.perf_counter()
+    results = [extract_features(path, stream=False, preview=preview) for path in paths]
+    return results, time.perf_counter() - start
+
+
+def summarize(name, results, elapsed, tracks, full_results):
+    pairs = [(r, t, f) for r, t, f in zip(results, tracks, full_results) if r is not None and f is not None]
+    return {
+        "tier": name,
+        "tracks": len(pairs),
+        "tracks_per_sec": len(results) / elapsed if elapsed else 0.0,
+        "tempo_accuracy": float(np.mean([tempo_hit(r.tempo, t.bpm) for r, t, _ in pairs])),
+        "tempo_mae_bpm": float(np.mean([abs(r.tempo - t.bpm) for r, t, _ in pairs])),
+        "tempo_agreement_with_full": float(np.mean([abs(r.tempo - f.tempo) <= 0.04 * f.tempo for r, _, f in pairs])),
+        "energy_mae_vs_full": float(np.mean([abs(r.energy - f.energy) for r, _, f in pairs])),
+        "rms_mae_vs_full": float(np.mean([abs(r.rms_mean - f.rms_mean) for r, _, f in pairs])),
+        "mood_agreement_with_full": float(np.mean([r.mood == f.mood for r, _, f in pairs])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare preview-tier analysis with full analysis.")
+    parser.add_argument("--tracks", type=int, default=40)
+    parser.add_argument("--duration", type=float, default=150.0, help="Length of each synthetic track in seconds.")
+    parser.add_argument("--windows", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--sample-rates", default="22050,11025", help="Comma separated preview sample rates.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file as JSON.")
+    args = parser.parse_args()
+
+    tracks = random_tracks(args.tracks, duration=args.duration, seed=args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for i, track in enumerate(tracks):
+            path = os.path.join(workdir, f"{i:04d}.flac")
+            write_track(track, path)
+            paths.append(path)
+
+        # Warm up numba so the first tier measured doesn't pay for compilation
+        extract_features(paths[0], stream=False)
+
+        full_results, full_elapsed = run_tier(paths, None)
+        rows = [summarize("full", full_results, full_elapsed, tracks, full_results)]
+        for sample_rate in [int(sr) for sr in args.sample_rates.split(",") if sr]:
+            config = PreviewConfig(windows=args.windows, window_seconds=args.seconds, sample_rate=sample_rate)
+            results, elapsed = run_tier(paths, config)
+            rows.append(summarize(f"preview {args.windows}x{args.seconds:g}s @ {sample_rate} Hz", results, elapsed, tracks, full_results))
+
+    full_rate = rows[0]["tracks_per_sec"]
+    print(f"{'tier':34} {'tracks/s':>9} {'speedup':>8} {'tempo ok':>9} {'tempo MAE':>10} {'=full tempo':>11} {'energy MAE':>11} {'=full mood':>11}")
+    for row in rows:
+        print(f"{row['tier']:34} {row['tracks_per_sec']:9.2f} {row['tracks_per_sec'] / full_rate:7.1f}x "
+              f"{row['tempo_accuracy']:9.0%} {row['tempo_mae_bpm']:10.1f} {row['tempo_agreement_with_full']:11.0%} "
+              f"{row['energy_mae_vs_full']:11.3f} {row['mood_agreement_with_full']:11.0%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Query latency on a large synthetic feature store. The store is written once (which builds the
+# sorted and inverted indexes), then every query runs against the memory-mapped store.
+# Fails if the median of any range-only query goes over the budget.
+#
+#   python benchmarks/query_benchmark.py --songs 500000 --budget 0.01
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.playlist import SCENARIO_QUERIES
+from music_lib.query import run_query
+from music_lib.store import open_store
+from startup_benchmark import build_store
+
+
+# (query, counts against the budget)
+QUERIES = [
+    ("tempo 110..140", True),
+    ("tempo 110..140 and energy > 0.5", True),
+    ("tempo 110..140 and energy > 0.5 and genre in (Rock, Pop)", True),
+    ("tempo 110..140 and energy > 0.5 and genre in (Rock, Pop) order by score desc limit 30", True),
+    ("genre ~ ro", False),
+    ("energy 0.2..0.7 order by tempo", False),
+] + [(f"{query} limit 30", False) for query in SCENARIO_QUERIES.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure query latency on a large feature store.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=0.01, help="Median latency budget for range queries in seconds.")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        build_store(workdir, args.songs)
+        table = open_store(os.path.join(workdir, "songs_store"))
+
+        print(f"Tracks: {len(table)}")
+        for query, budgeted in QUERIES:
+            run_query(table, query)  # first run pages the memory-mapped index in
+            times = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                rows = run_query(table, query)
+                times.append(time.perf_counter() - start)
+            median = statistics.median(times)
+            print(f"{median * 1000:8.2f} ms  {len(rows):>7} rows  {query}")
+            if budgeted and median > args.budget:
+                ok = False
+
+    if not ok:
+        print(f"FAIL: a range query is over the {args.budget * 1000:.0f} ms budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# Time and peak memory of the library report on a synthetic library, read from the feature store
+# (memory-mapped, the way --query-only runs see it) and from the in-memory Song list. Peak memory is
+# what the report itself allocates on top of the library, so it should stay flat as --songs grows.
+#
+#   python benchmarks/report_benchmark.py --songs 500000
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.report import write_report
+from music_lib.scanner import Song
+from music_lib.store import open_store, write_store
+from memory_benchmark import build
+
+
+# tracemalloc slows allocation down a lot, so the time and the peak come from separate runs
+def measure(library, output_file) -> dict:
+    start = time.perf_counter()
+    summary = write_report(library, output_file)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    write_report(library, output_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak / 1e6, "tracks": summary["tracks"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library report time and memory.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    args = parser.parse_args()
+
+    songs = build(Song, args.songs)
+    with tempfile.TemporaryDirectory() as workdir:
+        store_dir = os.path.join(workdir, "store")
+        write_store(songs, store_dir)
+        sources = {"store": open_store(store_dir), "songs": songs}
+        print(f"{args.songs} songs:")
+        for source, library in sources.items():
+            for output in (None, "report.jsonl", "report.csv"):
+                r = measure(library, None if output is None else os.path.join(workdir, output))
+                name = f"{source}, {output or 'statistics only'}"
+                print(f"  {name:<30} {r['seconds']:6.2f}s  {r['tracks'] / r['seconds']:10.0f} songs/sec  peak {r['peak_mb']:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
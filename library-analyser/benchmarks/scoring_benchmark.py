@@ -0,0 +1,103 @@
+# Per-track mood scoring and scenario filtering versus the batch paths the store rebuild and the
+# playlists use (the score column built by LibraryTable.from_songs, scenario queries run on the table),
+# on a large synthetic library. Both paths have to agree exactly, on every track.
+#
+#   python benchmarks/scoring_benchmark.py --songs 500000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from music_lib.analyser import MOOD_LABELS, get_mood_score, mood_scores, mood_values
+from music_lib.playlist import SCENARIO_DEFS, SCENARIO_QUERIES
+from music_lib.query import query_mask
+from music_lib.scanner import Song
+from music_lib.store import LibraryTable
+
+
+GENRES = ["Rock", "Pop", "Jazz", "Classical", "Alternative"]
+
+
+def synthetic_songs(count: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    tempo = rng.uniform(50, 200, count)
+    energy = rng.uniform(0, 1, count)
+    genres = rng.integers(-1, len(GENRES), count)
+    moods = rng.integers(-1, len(MOOD_LABELS), count)
+    songs = []
+    for i in range(count):
+        song = Song(f"/music/{i}.flac", "", "", 0, "", genre=GENRES[genres[i]] if genres[i] >= 0 else None)
+        if i % 100:  # one track in a hundred was never analyzed
+            song.tempo, song.energy = float(tempo[i]), float(energy[i])
+        song.mood = MOOD_LABELS[moods[i]] if moods[i] >= 0 else None
+        songs.append(song)
+    return songs
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-track and batch scoring.")
+    parser.add_argument("--songs", type=int, default=500_000)
+    args = parser.parse_args()
+
+    songs = synthetic_songs(args.songs)
+
+    def per_track_scores():
+        return [get_mood_score(song) for song in songs]
+
+    def feature_arrays():
+        tempo, energy = (np.array([np.nan if v is None else v for v in (getattr(s, name) for s in songs)])
+                         for name in ("tempo", "energy"))
+        codes = np.array([-1 if s.mood is None else MOOD_LABELS.index(s.mood) for s in songs])
+        return tempo, energy, codes
+
+    def per_track_scenarios():
+        matches = {}
+        for name, params in SCENARIO_DEFS.items():
+            matched = []
+            for s in songs:
+                if s.genre and any(s.genre.lower() == g.lower() for g in params["genres"]):
+                    matched.append(s)
+                elif (s.tempo is not None and s.energy is not None
+                      and params.get("min_tempo", 0) <= s.tempo <= params.get("max_tempo", float("inf"))
+                      and params.get("min_energy", 0) <= s.energy <= params.get("max_energy", float("inf"))):
+                    matched.append(s)
+            matches[name] = matched
+        return matches
+
+    scalar, scalar_score_s = timed(per_track_scores)
+    (tempo, energy, codes), gather_s = timed(feature_arrays)
+    batch, batch_score_s = timed(lambda: mood_scores(tempo, energy, mood_values(codes)))
+    if not np.array_equal(batch, np.array(scalar)):
+        raise AssertionError(f"{int((batch != np.array(scalar)).sum())} batch scores differ from get_mood_score")
+
+    table = LibraryTable.from_songs(songs)
+    if not np.array_equal(table.column("score"), np.array(scalar, dtype=np.float32)):
+        raise AssertionError("the store's score column differs from get_mood_score")
+
+    matches, scalar_filter_s = timed(per_track_scenarios)
+    masks, batch_filter_s = timed(lambda: {name: query_mask(table, SCENARIO_QUERIES[name]) for name in SCENARIO_DEFS})
+    for name, matched in matches.items():
+        if [s.path for s in table.songs(np.flatnonzero(masks[name]))] != [s.path for s in matched]:
+            raise AssertionError(f"scenario '{name}' matches different tracks in batch")
+
+    print(f"Tracks: {args.songs} (scores and scenario matches identical on every track)")
+    print(f"Mood score, per track:   {scalar_score_s * 1000:9.1f} ms")
+    print(f"Mood score, batch:       {batch_score_s * 1000:9.1f} ms  ({scalar_score_s / batch_score_s:.0f}x), "
+          f"plus {gather_s * 1000:.1f} ms to collect the features from the songs")
+    print(f"5 scenarios, per track:  {scalar_filter_s * 1000:9.1f} ms")
+    print(f"5 scenarios, batch:      {batch_filter_s * 1000:9.1f} ms  ({scalar_filter_s / batch_filter_s:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Build and query latency of the similarity index on a large synthetic library.
+#
+#   python benchmarks/similarity_benchmark.py --songs 100000 --queries 2000
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.similarity import INDEX_FILE, SimilarityIndex, load_or_build_index
+from music_lib.store import open_store
+from startup_benchmark import build_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure similarity index build and query latency.")
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        build_store(workdir, args.songs)
+        store_dir = os.path.join(workdir, "songs_store")
+        table = open_store(store_dir)
+
+        start = time.perf_counter()
+        index = SimilarityIndex.build(table)
+        build_s = time.perf_counter() - start
+        index.save(os.path.join(store_dir, INDEX_FILE))
+
+        start = time.perf_counter()
+        load_or_build_index(table, store_dir)
+        load_s = time.perf_counter() - start
+
+        rng = np.random.default_rng(0)
+        rows = rng.choice(index.rows, size=args.queries)
+        knn_times = []
+        for row in rows:
+            start = time.perf_counter()
+            index.knn(int(row), args.k)
+            knn_times.append(time.perf_counter() - start)
+        radius_times = []
+        for row in rows[:200]:
+            start = time.perf_counter()
+            index.within(int(row), 0.1)
+            radius_times.append(time.perf_counter() - start)
+
+    print(f"Tracks indexed:        {len(index)}")
+    print(f"Build:                 {build_s * 1000:.1f} ms")
+    print(f"Load from store:       {load_s * 1000:.1f} ms")
+    print(f"k-NN (k={args.k}) median:   {statistics.median(knn_times) * 1e6:.0f} us, p99 {np.percentile(knn_times, 99) * 1e6:.0f} us")
+    print(f"Radius (r=0.1) median: {statistics.median(radius_times) * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Startup benchmark for query-only runs.
+# Builds a feature store for a synthetic library, runs a cached --playlist-genre command a few times
+# under `python -X importtime` and fails if imports go over the budget or if any of the analysis
+# and plotting stacks get imported.
+#
+#   python benchmarks/startup_benchmark.py --songs 100000 --budget 0.5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from music_lib.scanner import Song
+from music_lib.store import write_store
+
+
+HEAVY_MODULES = {"librosa", "numba", "matplotlib", "scipy", "sklearn", "soundfile", "audioread"}
+GENRES = ["Rock", "Pop", "Jazz", "Classical", "Alternative"]
+MOODS = ["Energetic", "Happy", "Neutral", "Calm", "Sad"]
+
+
+def build_store(workdir: str, count: int):
+    songs = []
+    for i in range(count):
+        song = Song(
+            path=os.path.join(workdir, f"Artist {i % 500}", f"Album {i % 40}", f"{i % 12 + 1:02d} - Track {i}.mp3"),
+            artist=f"Artist {i % 500}",
+            album=f"Album {i % 40}",
+            track_no=i % 12 + 1,
+            title=f"Track {i}",
+            genre=GENRES[i % len(GENRES)]
+        )
+        song.size = 4_000_000 + i
+        song.mtime = 1_700_000_000_000_000_000 + i
+        song.tempo = 60.0 + (i * 7) % 120
+        song.energy = (i * 13) % 100 / 100
+        song.mood = MOODS[i % len(MOODS)]
+        song.score = (i * 17) % 100 / 100
+        song.chroma = (i * 19) % 100 / 100
+        song.centroid = 500.0 + (i * 23) % 4000
+        songs.append(song)
+    write_store(songs, os.path.join(workdir, "songs_store"))
+
+
+# Returns (wall seconds, import seconds, heavy modules that were imported)
+def run_once(workdir: str):
+    cmd = [
+        sys.executable, "-X", "importtime", os.path.join(ROOT, "cli.py"),
+        "-p", workdir, "--query-only", "--playlist-genre", "Rock",
+        "--output", os.path.join(workdir, "bench.m3u"),
+    ]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"cli.py exited with {proc.returncode}:\n{proc.stdout}\n{proc.stderr}")
+
+    import_us = 0
+    heavy = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Top level imports have no indentation, their cumulative times add up to the total
+        if not name.startswith("  "):
+            import_us += int(cumulative)
+        top = name.strip().split(".")[0]
+        if top in HEAVY_MODULES:
+            heavy.add(top)
+    return wall, import_us / 1e6, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import cost of a cached playlist command.")
+    parser.add_argument("--songs", type=int, default=100_000, help="Number of synthetic tracks in the store.")
+    parser.add_argument("--runs", type=int, default=5, help="How many times to run the command.")
+    parser.add_argument("--budget", type=float, default=0.5, help="Import time budget in seconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        build_store(workdir, args.songs)
+        results = [run_once(workdir) for _ in range(args.runs)]
+
+    walls = [r[0] for r in results]
+    imports = [r[1] for r in results]
+    heavy = set().union(*(r[2] for r in results))
+
+    print(f"Tracks in store:     {args.songs}")
+    print(f"Median wall time:    {statistics.median(walls):.3f}s")
+    print(f"Median import time:  {statistics.median(imports):.3f}s (budget {args.budget:.3f}s)")
+
+    ok = True
+    if heavy:
+        print(f"FAIL: heavy modules imported: {', '.join(sorted(heavy))}")
+        ok = False
+    if statistics.median(imports) > args.budget:
+        print("FAIL: import time is over budget")
+        ok = False
+    if ok:
+        print("OK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# Deterministic synthetic audio for the benchmarks, so everything runs offline without a real library.
+# Every track is a tone plus a noise bed with a click on every beat, so its true tempo is known.
+import os
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+
+@dataclass
+class SyntheticTrack:
+    bpm: float
+    duration: float
+    loudness: float  # peak amplitude of the tone/noise bed
+    brightness: float  # 0 = pure tone, 1 = mostly white noise
+    tone_hz: float
+    seed: int
+
+
+def random_tracks(count: int, duration: float = 150.0, seed: int = 0) -> List[SyntheticTrack]:
+    rng = np.random.default_rng(seed)
+    return [
+        SyntheticTrack(
+            bpm=float(rng.uniform(65, 175)),
+            duration=duration,
+            loudness=float(rng.uniform(0.02, 0.4)),
+            brightness=float(rng.uniform(0.0, 1.0)),
+            tone_hz=float(rng.choice([110.0, 220.0, 330.0, 440.0, 660.0, 880.0])),
+            seed=int(rng.integers(0, 2**31)),
+        )
+        for _ in range(count)
+    ]
+
+
+def render(track: SyntheticTrack, sr: int = 22050) -> np.ndarray:
+    rng = np.random.default_rng(track.seed)
+    n = int(track.duration * sr)
+    t = np.arange(n) / sr
+
+    bed = (1 - track.brightness) * np.sin(2 * np.pi * track.tone_hz * t)
+    bed += track.brightness * rng.uniform(-1, 1, n)
+
+    # Quieter intro and outro, like most real songs
+    envelope = np.ones(n)
+    edge = min(int(0.1 * n), int(10 * sr))
+    envelope[:edge] = np.linspace(0.3, 1.0, edge)
+    envelope[n - edge:] = np.linspace(1.0, 0.3, edge)
+    y = track.loudness * envelope * bed
+
+    click_len = int(0.01 * sr)
+    click = np.hanning(2 * click_len)[click_len:] * rng.uniform(-1, 1, click_len)
+    period = 60.0 / track.bpm
+    for beat in np.arange(0, track.duration, period):
+        start = int(beat * sr)
+        end = min(start + click_len, n)
+        y[start:end] += 0.8 * click[:end - start]
+
+    return np.clip(y, -1, 1).astype(np.float32)
+
+
+def write_track(track: SyntheticTrack, path: str, sr: int = 22050):
+    import soundfile
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    soundfile.write(path, render(track, sr), sr)
+
+
+GENRES = ["Rock", "Pop", "Jazz", "Classical", "Alternative"]
+
+
+# Writes a tagged library in the Artist/Album/NN - Title.ext layout scan_library expects and
+# returns (path, track) pairs. ext can be anything soundfile writes and mutagen tags with
+# Vorbis comments (.flac or .ogg).
+def write_library(root: str, count: int, duration: float = 30.0, seed: int = 0, ext: str = ".flac",
+                  tracks_per_album: int = 10, albums_per_artist: int = 3, sr: int = 22050):
+    from mutagen import File as MutagenFile
+
+    written = []
+    for i, track in enumerate(random_tracks(count, duration=duration, seed=seed)):
+        album_no, track_no = divmod(i, tracks_per_album)
+        artist = f"Artist {album_no // albums_per_artist:03d}"
+        album = f"Album {album_no:03d}"
+        title = f"Track {i:05d}"
+        path = os.path.join(root, artist, album, f"{track_no + 1:02d} - {title}{ext}")
+        write_track(track, path, sr)
+
+        tags = MutagenFile(path)
+        tags["artist"], tags["album"], tags["title"] = artist, album, title
+        tags["tracknumber"] = str(track_no + 1)
+        tags["genre"] = GENRES[i % len(GENRES)]
+        tags.save()
+        written.append((path, track))
+    return written
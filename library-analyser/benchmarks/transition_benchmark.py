@@ -0,0 +1,74 @@
+# Latency and smoothness of mood transition playlists on a large synthetic library.
+# Plans transitions between random pairs of songs from a feature store and fails if the
+# slowest planning run (row lookups + planning) goes over the budget.
+#
+#   python benchmarks/transition_benchmark.py --songs 100000 --pairs 50 --budget 0.25
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from music_lib.similarity import load_or_build_index, plan_transition
+from music_lib.store import open_store
+from startup_benchmark import build_store
+
+
+# Largest single step of a path and the direct distance between its ends, in standard deviations
+def step_sizes(index, rows):
+    vectors = np.vstack([index.vector(int(row)) for row in rows])
+    steps = np.linalg.norm(np.diff(vectors, axis=0), axis=1)
+    return float(steps.max()), float(np.linalg.norm(vectors[-1] - vectors[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure mood transition planning latency.")
+    parser.add_argument("--songs", type=int, default=100_000)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--max-songs", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--budget", type=float, default=0.25, help="Latency budget per playlist in seconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        build_store(workdir, args.songs)
+        store_dir = os.path.join(workdir, "songs_store")
+        table = open_store(store_dir)
+        index = load_or_build_index(table, store_dir)
+
+        rng = np.random.default_rng(0)
+        pairs = rng.choice(index.rows, size=(args.pairs, 2))
+        worst = 0.0
+        print(f"Tracks indexed: {len(index)}")
+        for max_songs in args.max_songs:
+            times, largest, direct = [], [], []
+            for start_row, end_row in pairs:
+                start_path, end_path = table.string("path", int(start_row)), table.string("path", int(end_row))
+                start = time.perf_counter()
+                first, last = table.find("path", start_path), table.find("path", end_path)
+                rows = plan_transition(index, first, last, max_songs - 2)
+                times.append(time.perf_counter() - start)
+                step, distance = step_sizes(index, [first, *rows.tolist(), last])
+                largest.append(step)
+                direct.append(distance)
+            worst = max(worst, max(times))
+            print(f"max_songs={max_songs:<4} median {statistics.median(times) * 1000:6.1f} ms, "
+                  f"max {max(times) * 1000:6.1f} ms, largest step {statistics.median(largest):.2f} "
+                  f"(start to end {statistics.median(direct):.2f})")
+
+    print(f"Slowest playlist: {worst:.3f}s (budget {args.budget:.3f}s)")
+    if worst > args.budget:
+        print("FAIL: transition planning is over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,44 +1,79 @@
 import argparse
+import atexit
+import json
 import os
+import sys
 from music_lib.scanner import scan_library, Song
 
 import warnings
-import pickle
-import numpy as np
 
 
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=FutureWarning)
 ##warning ignorings for some FUTURE ERRORS
 
-from music_lib.analyser import analyze_songs,get_mood,get_tempo,generate_analysis_histograms
+from music_lib.analyser import analyze_songs,PreviewConfig,PREVIEW_TIER,SAMPLE_RATE
+from music_lib.pipeline import PipelineConfig
+from music_lib.decode import BACKENDS, RESAMPLE_QUALITIES, DecodeConfig
 
-from music_lib.playlist import create_genre_playlist, create_mood_transition_playlist,create_scenario_playlist
+from music_lib.playlist import create_genre_playlist, create_mood_transition_playlist,create_scenario_playlist,create_similarity_playlist,create_query_playlist
+from music_lib.playlist import create_playlists, playlist_output, SCENARIO_DEFS
+
+from music_lib.cache import load_cache, apply_cache, CacheCheckpoint
+from music_lib.fingerprint import fingerprint_songs, print_duplicate_report
+from music_lib.shards import SHARD_DIR, find_shard_files, merge_shards, parse_shard, run_shard
+
+from music_lib.store import LibraryTable, open_store, write_store
+
+from music_lib.report import write_report, write_summary, print_summary
+
+from music_lib.similarity import load_or_build_index
+from music_lib.histograms import load_or_build_histograms, write_histograms
+from music_lib.lookup import find_row, load_or_build_lookup
+
+from music_lib import metrics
+
+from music_lib.daemon import DEFAULT_PORT, LibraryDaemon, request_playlist
 
 
 
 #CACHE FILE
 CACHE_FILE = "./songs_cache.pkl"
-
-#General functions written for cache usage
-def save_cache(songs: list):
+# Columnar copy of the analyzed library that query-only runs memory-map instead of unpickling
+STORE_DIR = "./songs_store"
+# Directory mtimes from the last scan, unchanged directories are not listed again and only their changed files are tag-read
+SCAN_INDEX_FILE = "./scan_index.json"
+# Songs listed on the terminal by the default report, --report exports all of them
+REPORT_PRINT_LIMIT = 50
+HISTOGRAMS_IMAGE = "./analysis_histograms/library_histograms.png"
+
+
+# Title lookups and similarity queries both run on a table; the lookup index and the similarity
+# index are loaded from the store when the library came from it, otherwise built in memory
+def library_indexes(library):
+    table = library if isinstance(library, LibraryTable) else LibraryTable.from_songs(library)
+    store_dir = STORE_DIR if isinstance(library, LibraryTable) else None
+    return table, load_or_build_lookup(table, store_dir), load_or_build_index(table, store_dir)
+
+
+# (song, row in the table), or (None, None) when nothing matches
+def find_song(table, lookup, title: str):
+    row = find_row(lookup, title)
+    return (None, None) if row is None else (table.song(row), row)
+
+# A batch manifest is JSON: {"playlists": [{"scenario": "gym", "max_songs": 30}, {"genre": "Rock", "output": "rock.m3u"}, ...]}
+def load_manifest(manifest_file: str):
     try:
-        with open(CACHE_FILE, 'wb') as f:
-            pickle.dump(songs, f)
-        print(f"Songs analysis cached in {CACHE_FILE}")
-    except Exception as e:
-        print(f"Could not save cache: {e}")
-
-def load_cache() -> list:
-    if os.path.exists(CACHE_FILE):
-        try:
-            with open(CACHE_FILE, 'rb') as f:
-                songs = pickle.load(f)
-            print(f"Loaded cached analysis from {CACHE_FILE}")
-            return songs
-        except Exception as e:
-            print(f"Could not load cache: {e}")
-    return []
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read batch manifest '{manifest_file}': {e}")
+        return None
+    specs = manifest.get("playlists") if isinstance(manifest, dict) else manifest
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        print(f"Batch manifest '{manifest_file}' should hold a list of playlists.")
+        return None
+    return specs
 
 #This prevents usage as part of an import
 if __name__ == '__main__':
@@ -52,12 +87,25 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '--playlist-genre',
-        help='Generate a playlist for the given genre (case-insensitive, partial match).'
+        action='append',
+        help='Generate a playlist for the given genre (case-insensitive, partial match). Repeat it for several genres.'
     )
     parser.add_argument('--mood-transition',
         nargs=2,
         metavar=('START_SONG', 'END_SONG'),
-        help='Create a mood transition playlist given two songs (provide exact titles).'
+        help='Create a mood transition playlist given two songs, by title or "Artist - Title". Case and punctuation are ignored and close misspellings are matched.'
+    )
+    parser.add_argument('--query',
+        metavar='QUERY',
+        help='Create a playlist from a filter query, e.g. "tempo 110..140 and genre in (Rock, Pop) order by score desc limit 30".'
+    )
+    parser.add_argument('--similar-to',
+        metavar='TITLE',
+        help='Create a playlist of the songs most similar to the given song, by title or "Artist - Title" (matched like --mood-transition).'
+    )
+    parser.add_argument('--similarity-radius',
+        type=float,
+        help='Only include songs within this distance (in standard deviations) of the --similar-to song.'
     )
     parser.add_argument(
         '--output',
@@ -69,19 +117,145 @@ if __name__ == '__main__':
         default=10, 
         help='Max number of songs in mood transition playlist.'
     )
+    parser.add_argument('--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Number of worker processes used for analysis (default: number of CPUs).'
+    )
+    parser.add_argument('--io-threads',
+        type=int,
+        default=2,
+        help='Threads reading files ahead of analysis (default: 2). Raise it for network shares or slow disks.'
+    )
+    parser.add_argument('--decode-threads',
+        type=int,
+        default=2,
+        help='Threads decoding prefetched files before they go to the workers (default: 2).'
+    )
+    parser.add_argument('--prefetch',
+        type=int,
+        default=8,
+        help='How many files are read ahead of the decoders (default: 8). 0 lets each worker read its own files.'
+    )
+    parser.add_argument('--decoder',
+        choices=list(BACKENDS),
+        default='auto',
+        help='auto reads FLAC/OGG/WAV/MP3 with libsndfile and everything else with librosa, librosa sends every file through librosa.load (default: auto).'
+    )
+    parser.add_argument('--resample-quality',
+        choices=list(RESAMPLE_QUALITIES),
+        default='HQ',
+        help='soxr quality used to resample to the analysis rate (default: HQ). MQ is slightly faster, LQ/QQ change the features.'
+    )
+    parser.add_argument('--analysis-tier',
+        choices=['full', 'preview'],
+        default='full',
+        help='full decodes whole tracks, preview only decodes a few windows per track (much faster, less exact).'
+    )
+    parser.add_argument('--preview-windows',
+        type=int,
+        default=3,
+        help='Number of windows decoded per track by the preview tier (default: 3).'
+    )
+    parser.add_argument('--preview-seconds',
+        type=float,
+        default=15.0,
+        help='Length of each preview window in seconds (default: 15).'
+    )
+    parser.add_argument('--preview-sample-rate',
+        type=int,
+        default=SAMPLE_RATE,
+        help=f'Sample rate the preview tier decodes at (default: {SAMPLE_RATE}).'
+    )
+    parser.add_argument('--upgrade-preview',
+        action='store_true',
+        help='Re-analyze tracks whose cached features came from the preview tier with full analysis.'
+    )
+    parser.add_argument('--scan-threads',
+        type=int,
+        default=None,
+        help='Number of threads used to read tags while scanning (default: chosen by Python).'
+    )
+    parser.add_argument('--full-scan',
+        action='store_true',
+        help='Ignore the scan index: list every directory and read every file\'s tags again.'
+    )
+    parser.add_argument('--query-only',
+        action='store_true',
+        help='Skip scanning and analysis and answer the playlist request from the feature store of the last run.'
+    )
     parser.add_argument("--force-refresh", 
         action="store_true",
-        help="Re-scan and re-analyze library, ignoring cached data"
+        help="Re-analyze every song, ignoring cached data"
+    )
+    parser.add_argument('--duplicates',
+        action='store_true',
+        help='List groups of files that hold the same recording (the first run fingerprints every file).'
     )
     parser.add_argument('--scenario-playlist',
-        nargs=1,
+        nargs='+',
         metavar=('SCENARIO'),
-        help="Generate a playlist for a predefined scenario (gym, exam, stroll, gaming, sleep)."
+        help="Generate playlists for one or more predefined scenarios (gym, exam, stroll, gaming, sleep, or all)."
+    )
+    parser.add_argument('--batch',
+        metavar='MANIFEST',
+        help='Build every playlist listed in a JSON manifest from a single library load.'
     )
     parser.add_argument(
         '--scenario-output',
         help="Output file path for the scenario playlist (.m3u). Default: ./scenario_playlists/<scenario>.m3u"
     )
+    parser.add_argument('--shard',
+        metavar='I/N',
+        help='Analyze only shard I of N of the library (split by path) into its own cache in --shard-dir, then exit.'
+    )
+    parser.add_argument('--shard-dir',
+        default=SHARD_DIR,
+        help=f'Directory holding the shard caches (default: {SHARD_DIR}).'
+    )
+    parser.add_argument('--merge-shards',
+        nargs='*',
+        metavar='PATH',
+        help='Merge shard caches (files, or directories of them; default: --shard-dir) into the main cache before this run.'
+    )
+    parser.add_argument('--daemon',
+        action='store_true',
+        help='Keep running: serve playlist requests on a local port and rescan the library in the background.'
+    )
+    parser.add_argument('--connect',
+        action='store_true',
+        help='Send the playlist request to a running --daemon instead of scanning the library here.'
+    )
+    parser.add_argument('--port',
+        type=int,
+        default=DEFAULT_PORT,
+        help=f'Local port used by --daemon and --connect (default: {DEFAULT_PORT}).'
+    )
+    parser.add_argument('--poll-interval',
+        type=float,
+        default=60.0,
+        help='Seconds between library rescans in --daemon mode (default: 60).'
+    )
+    parser.add_argument('--report',
+        metavar='FILE',
+        help='Write one row per song to FILE (JSON Lines, or CSV when FILE ends in .csv) instead of printing the library.'
+    )
+    parser.add_argument('--report-summary',
+        metavar='FILE',
+        help='Write the library statistics (feature percentiles, mood/genre counts, per-artist and per-album breakdowns) to a JSON file.'
+    )
+    parser.add_argument('--histograms',
+        metavar='FILE',
+        help='Draw the tempo, energy, mood and per-genre charts into one image (.png, .svg, ...) or write their data to a .json file.'
+    )
+    parser.add_argument('--metrics-json',
+        metavar='FILE',
+        help='Write per-stage timings (totals, percentiles), counters, the slowest tracks and peak memory to a JSON file.'
+    )
+    parser.add_argument('--profile',
+        metavar='FILE',
+        help='Run under cProfile and save the stats to FILE (open with pstats or snakeviz), also prints stage timings.'
+    )
 
 
     args = parser.parse_args()
@@ -90,27 +264,230 @@ if __name__ == '__main__':
         print(f"Error: The provided path '{args.path}' is not a valid directory.")
         exit(1)
 
-    songs_list = [] if args.force_refresh else load_cache()
+    if args.jobs < 1:
+        print("Error: --jobs must be at least 1.")
+        exit(1)
+
+    if args.io_threads < 1 or args.decode_threads < 1 or args.prefetch < 0:
+        print("Error: --io-threads and --decode-threads must be at least 1 and --prefetch can't be negative.")
+        exit(1)
+    pipeline = PipelineConfig(io_threads=args.io_threads, decode_threads=args.decode_threads, prefetch=args.prefetch)
+    decode = DecodeConfig(backend=args.decoder, resample_quality=args.resample_quality)
+
+    if args.preview_windows < 1 or args.preview_seconds <= 0 or args.preview_sample_rate <= 0:
+        print("Error: preview windows, seconds and sample rate must be positive.")
+        exit(1)
+
+    if args.poll_interval <= 0:
+        print("Error: --poll-interval must be positive.")
+        exit(1)
+
+    if args.scan_threads is not None and args.scan_threads < 1:
+        print("Error: --scan-threads must be at least 1.")
+        exit(1)
 
-    if not songs_list:
+    # Several playlists in one run (a manifest and/or repeated playlist flags) go through create_playlists
+    scenarios = []
+    for name in args.scenario_playlist or []:
+        scenarios += list(SCENARIO_DEFS) if name.lower() == "all" else [name.lower()]
+    genres = args.playlist_genre or []
+    batch_specs = []
+    if args.batch:
+        batch_specs = load_manifest(args.batch)
+        if batch_specs is None:
+            exit(1)
+    if args.batch or len(genres) + len(scenarios) > 1:
+        batch_specs += [{"genre": genre} for genre in genres]
+        batch_specs += [{"scenario": name, "max_songs": args.max_songs} for name in scenarios]
+        if len(scenarios) == 1 and args.scenario_output:
+            batch_specs[-1]["output"] = args.scenario_output
+
+    # Written at exit so runs that stop early (no songs, Ctrl-C) still report what they measured
+    if args.metrics_json or args.profile:
+        metrics.enable()
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+        def _save_profile():
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            metrics.print_summary()
+            print(f"Profile written to {args.profile}")
+        atexit.register(_save_profile)
+        profiler.enable()
+    if args.metrics_json:
+        atexit.register(metrics.write_metrics, args.metrics_json)
+
+    if args.connect:
+        # Paths are resolved here, the daemon may be running from another directory
+        payload = {
+            "library": os.path.abspath(args.path),
+            "output": os.path.abspath(args.output),
+            "max_songs": args.max_songs,
+        }
+        if batch_specs:
+            for spec in batch_specs:
+                if playlist_output(spec):
+                    spec["output"] = os.path.abspath(playlist_output(spec))
+            payload.update(mode="batch", playlists=batch_specs)
+        elif genres:
+            payload.update(mode="genre", genre=genres[0])
+        elif args.mood_transition:
+            payload.update(mode="mood_transition", start=args.mood_transition[0], end=args.mood_transition[1])
+        elif args.query:
+            payload.update(mode="query", query=args.query)
+            payload.pop("max_songs")
+        elif args.similar_to:
+            payload.update(mode="similar", title=args.similar_to, radius=args.similarity_radius)
+        elif scenarios:
+            scenario_name = scenarios[0]
+            output_file = args.scenario_output or os.path.join("scenario_playlists", f"{scenario_name}.m3u")
+            payload.update(mode="scenario", scenario=scenario_name, output=os.path.abspath(output_file))
+        else:
+            print("Error: --connect needs a playlist option (--playlist-genre, --mood-transition, --query, --similar-to or --scenario-playlist).")
+            exit(1)
+
+        response = request_playlist(payload, port=args.port)
+        if response is None:
+            exit(1)
+        for path in response.get("paths", [response.get("path")]):
+            print(f"Playlist created successfully at: {path}" if path else "Playlist generation failed.")
+        exit(0)
+
+    if args.daemon:
+        served = LibraryDaemon(
+            args.path, CACHE_FILE, STORE_DIR, SCAN_INDEX_FILE,
+            jobs=args.jobs, interval=args.poll_interval, scan_threads=args.scan_threads, pipeline=pipeline,
+            decode=decode
+        ).serve(args.port)
+        exit(0 if served else 1)
+
+    preview = None
+    if args.analysis_tier == 'preview' and not args.upgrade_preview:
+        preview = PreviewConfig(
+            windows=args.preview_windows,
+            window_seconds=args.preview_seconds,
+            sample_rate=args.preview_sample_rate
+        )
+
+    if args.shard:
+        shard = parse_shard(args.shard)
+        if shard is None:
+            exit(1)
+        done = run_shard(args.path, shard, args.shard_dir, jobs=args.jobs, scan_threads=args.scan_threads,
+                         pipeline=pipeline, preview=preview, decode=decode, force_refresh=args.force_refresh)
+        exit(0 if done else 130)
+
+    if args.merge_shards is not None:
+        # The merged cache is picked up by the rest of this run, which rebuilds the feature store
+        if args.query_only:
+            print("--merge-shards updates the cache and can't be combined with --query-only.")
+            exit(1)
+        if merge_shards(find_shard_files(args.merge_shards or [args.shard_dir]), CACHE_FILE, args.path) is None:
+            exit(1)
+
+    if args.query_only:
+        library = open_store(STORE_DIR)
+        if library is None:
+            print(f"No feature store found in {STORE_DIR}. Run once without --query-only to build it.")
+            exit(1)
+        print(f"Using feature store with {len(library)} songs.")
+    else:
+        # The library is always rescanned so new, changed and deleted files are picked up,
+        # only the songs whose files changed since the last run get analyzed again
         print(f"Scanning music library at '{args.path}'...")
-        songs_list = scan_library(args.path)
-        
+        full_scan = args.full_scan or args.force_refresh
+        songs_list = scan_library(
+            args.path,
+            index_file=None if full_scan else SCAN_INDEX_FILE,
+            threads=args.scan_threads
+        )
+
         if not songs_list:
             print("No supported music files found.")
             exit(0)
 
-        print(f"Analyzing {len(songs_list)} songs...")
-        analyze_songs(songs_list)
-
-        save_cache(songs_list)
-    else:
-        print(f"Using cached analysis for {len(songs_list)} songs.")
-
+        cached_tracks = {} if args.force_refresh else load_cache(CACHE_FILE)
+        stale_songs, deleted, relinked = apply_cache(songs_list, cached_tracks, threads=args.scan_threads)
+        stale_ids = {id(song) for song in stale_songs}
+        cached_songs = [s for s in songs_list if id(s) not in stale_ids]
+        if args.upgrade_preview:
+            # Preview results stay in the cache until their full analysis replaces them
+            upgrades = [s for s in cached_songs if s.tier == PREVIEW_TIER]
+            if upgrades:
+                print(f"Upgrading {len(upgrades)} preview-tier songs to full analysis.")
+            stale_songs += upgrades
+        reused = len(songs_list) - len(stale_songs)
+
+        if reused:
+            print(f"Using cached analysis for {reused} songs.")
+        if relinked:
+            print(f"Reusing the analysis of {relinked} moved, renamed, retagged or duplicate files.")
+        if deleted:
+            print(f"Dropping {deleted} cached songs that are no longer in the library.")
+
+        checkpoint = CacheCheckpoint(
+            CACHE_FILE,
+            cached_songs,
+            dirty=deleted > 0 or relinked > 0
+        )
 
-    if args.playlist_genre:
-        print(f"Generating playlist for genre '{args.playlist_genre}'...")
-        playlist_path = create_genre_playlist(songs_list, args.playlist_genre, args.output)
+        if stale_songs:
+            print(f"Analyzing {len(stale_songs)} new or modified songs...")
+            try:
+                analyze_songs(stale_songs, jobs=args.jobs, on_result=checkpoint.record, preview=preview,
+                              pipeline=pipeline, decode=decode)
+            except KeyboardInterrupt:
+                checkpoint.close()
+                print("\nAnalysis interrupted. Finished songs were cached, run the same command again to resume.")
+                exit(130)
+
+        analyzed = checkpoint.recorded
+
+        if args.duplicates:
+            # Songs cached before fingerprints existed get one now, and it is cached for next time
+            unprinted = [s for s in songs_list if s.fingerprint is None and s.size is not None]
+            if unprinted:
+                print(f"Fingerprinting {len(unprinted)} songs...")
+                fingerprint_songs(unprinted, threads=args.scan_threads)
+                for song in unprinted:
+                    checkpoint.record(song)
+            print_duplicate_report(songs_list)
+
+        checkpoint.close()
+
+        # Tracks that failed to analyze stay stale on every run, they alone don't make the store outdated
+        if analyzed or deleted or relinked or open_store(STORE_DIR) is None:
+            try:
+                write_store(songs_list, STORE_DIR)
+                load_or_build_index(open_store(STORE_DIR), STORE_DIR)
+                load_or_build_histograms(open_store(STORE_DIR), STORE_DIR)
+                load_or_build_lookup(open_store(STORE_DIR), STORE_DIR)
+            except Exception as e:
+                print(f"Could not write feature store: {e}")
+
+        library = songs_list
+        # The similarity index is tied to the store's row order, so similarity and transition queries read from the store
+        if args.similar_to or args.mood_transition or batch_specs or args.report or args.histograms:
+            library = open_store(STORE_DIR) or songs_list
+
+
+    if batch_specs:
+        print(f"Generating {len(batch_specs)} playlists...")
+        index, lookup = None, None
+        if isinstance(library, LibraryTable) and any("similar_to" in s or "mood_transition" in s for s in batch_specs):
+            index = load_or_build_index(library, STORE_DIR)
+            lookup = load_or_build_lookup(library, STORE_DIR)
+        playlist_paths = create_playlists(library, batch_specs, index=index, lookup=lookup)
+        for playlist_path in playlist_paths:
+            if playlist_path:
+                print(f"Playlist created successfully at: {playlist_path}")
+        print(f"{sum(1 for p in playlist_paths if p)} of {len(batch_specs)} playlists created.")
+
+    elif genres:
+        print(f"Generating playlist for genre '{genres[0]}'...")
+        playlist_path = create_genre_playlist(library, genres[0], args.output)
         if playlist_path:
             print(f"Playlist created successfully at: {playlist_path}")
         else:
@@ -120,37 +497,57 @@ if __name__ == '__main__':
 
     elif args.mood_transition:
         start_title, end_title = args.mood_transition
-        start_song = next((s for s in songs_list if s.title.lower() == start_title.lower()), None)
-        end_song = next((s for s in songs_list if s.title.lower() == end_title.lower()), None)
-
-
+        table, lookup, index = library_indexes(library)
+        start_song, start_row = find_song(table, lookup, start_title)
+        end_song, end_row = find_song(table, lookup, end_title)
 
         if not start_song or not end_song:
             print("Could not find one or both songs for mood transition.")
             exit(1)
-        for song in songs_list:
-            if song.mood is None:
-                song.mood = get_mood(song.path)
-            if song.tempo is None:
-                song.tempo = get_tempo(song.path)
 
         print(f"Generating mood transition playlist from '{start_title}' to '{end_title}'...")
         playlist_path = create_mood_transition_playlist(
-            songs_list, start_song, end_song, args.output, max_songs=args.max_songs
+            library, start_song, end_song, args.output, max_songs=args.max_songs, index=index,
+            start_row=start_row, end_row=end_row
         )
         if playlist_path:
             print(f"Mood transition playlist created successfully at: {playlist_path}")
         else:
             print("Mood transition playlist generation failed.")
     
-    elif args.scenario_playlist:
-        scenario_name = args.scenario_playlist[0].lower()
+    elif args.query:
+        print(f"Generating playlist for query '{args.query}'...")
+        playlist_path = create_query_playlist(library, args.query, args.output)
+        if playlist_path:
+            print(f"Query playlist created successfully at: {playlist_path}")
+        else:
+            print("Query playlist generation failed.")
+
+    elif args.similar_to:
+        table, lookup, index = library_indexes(library)
+        seed_song, seed_row = find_song(table, lookup, args.similar_to)
+        if not seed_song:
+            print(f"Could not find the song '{args.similar_to}'.")
+            exit(1)
+
+        print(f"Generating playlist of songs similar to '{args.similar_to}'...")
+        playlist_path = create_similarity_playlist(
+            table, seed_song, args.output, max_songs=args.max_songs,
+            radius=args.similarity_radius, index=index, row=seed_row
+        )
+        if playlist_path:
+            print(f"Similarity playlist created successfully at: {playlist_path}")
+        else:
+            print("Similarity playlist generation failed.")
+
+    elif scenarios:
+        scenario_name = scenarios[0]
         output_file = args.scenario_output if args.scenario_output else None
 
         
 
         playlist_path = create_scenario_playlist(
-            songs=songs_list,
+            songs=library,
             scenario=scenario_name,
             output_file=output_file,
             max_songs=args.max_songs
@@ -162,38 +559,43 @@ if __name__ == '__main__':
             print("Scenario playlist generation failed.")
     
     else:
-        tempos = [s.tempo for s in songs_list if s.tempo is not None]
-        energies = [s.energy for s in songs_list if s.energy is not None]
-        
-
-
-        print("\n--- Analysis Results ---")
-        for song in songs_list:
-            print(f"Title: {song.title}")
-            print(f"  Artist: {song.artist}")
-            print(f"  Album: {song.album}")
-            print(f"  Genre: {song.genre}" if song.genre is not None else "  Genre: N/A")
-            if song.tempo is not None:
-                print(f"  Tempo: {float(song.tempo):.2f} BPM")
-            else:
-                print("  Tempo: N/A")
-            if song.energy is not None:
-                print(f"  Energy: {float(song.energy):.2f}")
-            else:
-                print("  Energy: N/A")
-            print(f"  Mood: {song.mood}" if song.mood is not None else "  Mood: N/A")
-            print(f"  Mood Score: {float(song.score):.2f} " if song.score is not None else " Mood Score: N/A")
-
-            if tempos:
-                print(f"\nAverage Tempo: {np.mean(tempos):.2f} BPM")
-            if energies:
-                print(f"Average Energy: {np.mean(energies):.2f}")
-            print("-" * 20)
-
-        ch = input("Would you like a histogram-based summary of your songs to be generated in a file within this current directory? (Y/N): ")
-
-        if ch.lower() == "y":
-            output_dir = "./analysis_histograms"
-            generate_analysis_histograms(songs_list, output_dir=output_dir)
-            print(f"\n✅ Histogram summary saved in {output_dir}/")
+        # Rows and statistics are streamed a batch at a time, only the first few songs are printed
+        summary = write_report(library, args.report)
+        if summary is None:
+            exit(1)
+        if args.report:
+            print(f"Wrote {summary['tracks']} songs to {args.report}")
+        else:
+            print("\n--- Analysis Results ---")
+            shown = library.songs(range(min(len(library), REPORT_PRINT_LIMIT))) if isinstance(library, LibraryTable) \
+                else library[:REPORT_PRINT_LIMIT]
+            for song in shown:
+                print(f"Title: {song.title}")
+                print(f"  Artist: {song.artist}")
+                print(f"  Album: {song.album}")
+                print(f"  Genre: {song.genre}" if song.genre is not None else "  Genre: N/A")
+                print(f"  Tempo: {float(song.tempo):.2f} BPM" if song.tempo is not None else "  Tempo: N/A")
+                print(f"  Energy: {float(song.energy):.2f}" if song.energy is not None else "  Energy: N/A")
+                print(f"  Mood: {song.mood}" if song.mood is not None else "  Mood: N/A")
+                print(f"  Mood Score: {float(song.score):.2f}" if song.score is not None else "  Mood Score: N/A")
+                print("-" * 20)
+            if len(library) > len(shown):
+                print(f"... and {len(library) - len(shown)} more songs, use --report FILE to export all of them.")
+        if args.report_summary and write_summary(summary, args.report_summary):
+            print(f"Library statistics written to {args.report_summary}")
+        print_summary(summary)
+
+        histograms_file = args.histograms
+        # Only ask when someone is there to answer, report runs (cron) never wait on input
+        if not histograms_file and not args.report and not args.report_summary and sys.stdin.isatty():
+            ch = input("Would you like a histogram-based summary of your songs to be generated in a file within this current directory? (Y/N): ")
+            if ch.lower() == "y":
+                histograms_file = HISTOGRAMS_IMAGE
+
+        if histograms_file:
+            # Drawn from the histograms saved with the feature store, the tracks aren't read again
+            table = library if isinstance(library, LibraryTable) else LibraryTable.from_songs(library)
+            histograms = load_or_build_histograms(table, STORE_DIR if isinstance(library, LibraryTable) else None)
+            if write_histograms(histograms, histograms_file):
+                print(f"\n✅ Histogram summary saved in {histograms_file}")
 
@@ -1,31 +1,58 @@
+import importlib.util
+import io
 import os
 import re
+import time
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Callable, List, Optional
 import numpy as np
+from . import metrics
+from .decode import (DecodeConfig, audio_duration, audio_format, decode_audio, downmix, drain_decode_stats,
+                     merge_decode_stats, print_decode_report, record_decode)
+from .pipeline import PipelineConfig, StagedPipeline
 from .scanner import Song
 
 
 
-import matplotlib.pyplot as plt
-from collections import Counter
 
 ## Using Librosa
-try:
-    import librosa
-    import librosa.display
-    librosa_available = True
-except ImportError:
-    librosa_available = False
+# librosa (with numba) takes seconds to import, so it is only imported inside
+# the functions that decode audio. Playlist runs from the cache never load them.
+librosa_available = importlib.util.find_spec("librosa") is not None
+
+
+# Bump this whenever feature extraction changes so cached results get recomputed
+ANALYZER_VERSION = 2
+
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+# Tracks at least this long (DJ mixes, live sets, audiobooks) are analyzed block by block
+# so a worker's memory stays flat no matter how long the file is
+STREAM_MIN_DURATION = 600.0
+STREAM_BLOCK_SECONDS = 10.0
+
+# Which analysis produced a track's features, preview tracks can be upgraded by a later full pass
+FULL_TIER = "full"
+PREVIEW_TIER = "preview"
+
+
+# The preview tier only decodes a few evenly spaced windows of each track, optionally at a lower sample rate
+@dataclass
+class PreviewConfig:
+    windows: int = 3
+    window_seconds: float = 15.0
+    sample_rate: int = SAMPLE_RATE
 
 
 #First Loading
-def _load_audio(filepath: str):
+def _load_audio(filepath, decode: Optional[DecodeConfig] = None):
     if not librosa_available:
         print("Librosa is not installed. Cannot analyze audio features.")
         return None, None
     try:
-        y, sr = librosa.load(filepath, sr=22050)
+        # Decoding and resampling are timed apart inside decode_audio
+        y, sr = decode_audio(filepath, SAMPLE_RATE, config=decode)
 
         if y is None or y.size == 0:
             return None, None
@@ -34,62 +61,361 @@ def _load_audio(filepath: str):
     except Exception as e:
         return None, None
 
-#The functions written after this are for recording tempo energy and mood all important to analysing the music more
-def get_tempo(filepath: str) -> Optional[float]:
-    y, sr = _load_audio(filepath)
-    if y is None or sr is None:
-        return None
+# A single record of everything we pull out of one decode of a track
+@dataclass
+class TrackFeatures:
+    tempo: Optional[float]
+    energy: Optional[float]
+    rms_mean: float
+    chroma_mean: float
+    centroid_mean: float
+    mood: Optional[str]
+    tier: str = FULL_TIER
+
+
+# Mood rules, checked in this order, the first one that matches wins
+MOOD_LABELS = ("Energetic", "Happy", "Sad", "Calm", "Neutral")
+MOOD_THRESHOLDS = {
+    "energetic_min_tempo": 120,
+    "energetic_min_centroid": 2500,
+    "energetic_min_rms": 0.05,
+    "happy_min_chroma": 0.6,
+    "happy_min_centroid": 2000,
+    "sad_max_chroma": 0.4,
+    "sad_max_centroid": 1500,
+    "sad_max_rms": 0.03,
+    "calm_max_tempo": 80,
+    "calm_max_rms": 0.04,
+}
+
+
+def _classify_mood(tempo_val: float, chroma_mean: float, centroid_mean: float, rms_mean: float,
+                   thresholds: dict = MOOD_THRESHOLDS) -> str:
+    t = thresholds
+    if tempo_val > t["energetic_min_tempo"] and centroid_mean > t["energetic_min_centroid"] and rms_mean > t["energetic_min_rms"]:
+        return "Energetic"
+    elif chroma_mean > t["happy_min_chroma"] and centroid_mean > t["happy_min_centroid"]:
+        return "Happy"
+    elif chroma_mean < t["sad_max_chroma"] and centroid_mean < t["sad_max_centroid"] and rms_mean < t["sad_max_rms"]:
+        return "Sad"
+    elif tempo_val < t["calm_max_tempo"] and rms_mean < t["calm_max_rms"]:
+        return "Calm"
+    else:
+        return "Neutral"
+
+
+def _features_from_signal(y, sr) -> TrackFeatures:
+    # One STFT feeds chroma, centroid and the onset envelope, and the beat tracker
+    # runs on that envelope instead of recomputing it from the waveform
+    import librosa
+    with metrics.timer("stft"):
+        S = np.abs(librosa.stft(y))
+        power = S ** 2
+    with metrics.timer("onset"):
+        mel = librosa.feature.melspectrogram(S=power, sr=sr)
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr)
+
+    with metrics.timer("beat_track"):
+        tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+    tempo_val = float(np.atleast_1d(tempo)[0])
+
+    with metrics.timer("rms"):
+        rms_mean = float(np.mean(librosa.feature.rms(y=y)))
+    with metrics.timer("chroma_stft"):
+        chroma_mean = float(np.mean(librosa.feature.chroma_stft(S=power, sr=sr)))
+    with metrics.timer("centroid"):
+        centroid_mean = float(np.mean(librosa.feature.spectral_centroid(S=S, sr=sr)))
+
+    return TrackFeatures(
+        tempo=tempo_val,
+        energy=float(np.clip(rms_mean * 10, 0, 1)),
+        rms_mean=rms_mean,
+        chroma_mean=chroma_mean,
+        centroid_mean=centroid_mean,
+        mood=_classify_mood(tempo_val, chroma_mean, centroid_mean, rms_mean),
+    )
+
+
+# Tempo is the mean tempogram column run through librosa's tempo prior, which is also what beat_track reports.
+# The tempogram is built a chunk of onset frames at a time (with the same linear ramp padding librosa uses at
+# both ends) and only its column sum is kept, so a long track never holds a full-length tempogram.
+class _StreamingTempo:
+    def __init__(self, sr: int, chunk_frames: int = 4096):
+        import librosa
+
+        self.sr = sr
+        self.win_length = int(librosa.time_to_frames(8.0, sr=sr, hop_length=HOP_LENGTH))
+        self.window = librosa.filters.get_window('hann', self.win_length, fftbins=True)
+        self.chunk_frames = chunk_frames
+        self.buffer = np.zeros(self.win_length // 2, dtype=np.float64)  # ramp from 0 up to the first value (always 0)
+        self.last_value = 0.0
+        self.columns = 0
+        self.tg_sum = np.zeros(self.win_length)
+        self.any_onset = False
+
+    def feed(self, onset: np.ndarray, final: bool = False):
+        if onset.size:
+            self.any_onset = self.any_onset or bool(onset.any())
+            self.last_value = float(onset[-1])
+            self.buffer = np.concatenate([self.buffer, onset])
+        if final:
+            ramp = np.linspace(self.last_value, 0.0, self.win_length // 2 + 1)[1:]
+            self.buffer = np.concatenate([self.buffer, ramp])
+        available = len(self.buffer) - self.win_length + 1
+        while available >= (1 if final else self.chunk_frames):
+            n = available if final else self.chunk_frames
+            self._add_columns(self.buffer[:n + self.win_length - 1])
+            self.buffer = self.buffer[n:]
+            available -= n
+
+    def _add_columns(self, segment: np.ndarray):
+        import librosa
+
+        frames = librosa.util.frame(segment, frame_length=self.win_length, hop_length=1)
+        tg = librosa.util.normalize(librosa.autocorrelate(frames * self.window[:, None], axis=0), norm=np.inf, axis=0)
+        self.tg_sum += tg.sum(axis=1)
+        self.columns += tg.shape[1]
+
+    def close(self):
+        self.feed(np.zeros(0), final=True)
+
+
+# Several pieces of audio (e.g. preview windows) are combined by averaging all of their tempogram columns
+def _merged_tempo(parts: List[_StreamingTempo]) -> float:
+    import librosa
+
+    columns = sum(part.columns for part in parts)
+    if columns == 0 or not any(part.any_onset for part in parts):
+        return 0.0
+    tg = (sum(part.tg_sum for part in parts) / columns)[:, None]
+    return float(librosa.feature.tempo(tg=tg, sr=parts[0].sr, hop_length=HOP_LENGTH, aggregate=None)[0])
+
+
+# Accumulates the same statistics as _features_from_signal from consecutive blocks of audio.
+# Blocks are cut into the exact frames librosa would use on the whole signal (center=True with zero padding),
+# so only running sums, one frame of leftover samples and a chunk of onset envelope are held at any time.
+# Two things are approximated: chroma tuning is estimated on the first block only, and the
+# 80 dB floor of power_to_db is taken per block instead of over the whole track.
+class _StreamingFeatures:
+    def __init__(self, sr: int = SAMPLE_RATE):
+        self.sr = sr
+        self.buffer = np.zeros(N_FFT // 2, dtype=np.float32)
+        self.frames = 0
+        self.rms_sum = 0.0
+        self.chroma_sum = 0.0
+        self.centroid_sum = 0.0
+        self.tuning = None
+        self.last_db = None
+        self.tempo = _StreamingTempo(sr)
+        # onset_strength pads the envelope with a few leading zeros and then trims it back to the
+        # number of frames, so the newest few values are held back until we know they survive the trim
+        self.onset_pad = 1 + N_FFT // (2 * HOP_LENGTH)
+        self.onset_pending = np.zeros(self.onset_pad, dtype=np.float64)
+
+    def feed(self, y: np.ndarray):
+        self.buffer = np.concatenate([self.buffer, y.astype(np.float32, copy=False)])
+        if len(self.buffer) < N_FFT:
+            return
+        n_frames = 1 + (len(self.buffer) - N_FFT) // HOP_LENGTH
+        self._process(self.buffer[:(n_frames - 1) * HOP_LENGTH + N_FFT])
+        self.buffer = self.buffer[n_frames * HOP_LENGTH:]
+
+    def _process(self, segment: np.ndarray):
+        import librosa
+
+        frames = librosa.util.frame(segment, frame_length=N_FFT, hop_length=HOP_LENGTH)
+        self.rms_sum += float(np.sum(np.sqrt(np.mean(frames ** 2, axis=0))))
+
+        S = np.abs(librosa.stft(segment, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        power = S ** 2
+        if self.tuning is None:
+            self.tuning = librosa.estimate_tuning(S=power, sr=self.sr, bins_per_octave=12)
+        self.chroma_sum += float(np.sum(np.mean(librosa.feature.chroma_stft(S=power, sr=self.sr, tuning=self.tuning), axis=0)))
+        self.centroid_sum += float(np.sum(librosa.feature.spectral_centroid(S=S, sr=self.sr)))
+
+        db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=self.sr))
+        if self.last_db is not None:
+            db = np.concatenate([self.last_db, db], axis=1)
+        onset = np.mean(np.maximum(0.0, np.diff(db, axis=1)), axis=0)
+        self.last_db = db[:, -1:]
+        self.frames += S.shape[1]
+
+        self.onset_pending = np.concatenate([self.onset_pending, onset])
+        keep = self.onset_pad - 1
+        self.tempo.feed(self.onset_pending[:-keep])
+        self.onset_pending = self.onset_pending[-keep:]
+
+    def close(self):
+        self.feed(np.zeros(N_FFT // 2, dtype=np.float32))
+        self.tempo.close()
+
+    def finish(self) -> TrackFeatures:
+        self.close()
+        return _merged_features([self])
+
+
+def _merged_features(parts: List[_StreamingFeatures], tier: str = FULL_TIER) -> TrackFeatures:
+    frames = sum(part.frames for part in parts)
+    if frames == 0:
+        raise ValueError("no audio decoded")
+
+    tempo_val = _merged_tempo([part.tempo for part in parts])
+    rms_mean = sum(part.rms_sum for part in parts) / frames
+    chroma_mean = sum(part.chroma_sum for part in parts) / frames
+    centroid_mean = sum(part.centroid_sum for part in parts) / frames
+
+    return TrackFeatures(
+        tempo=tempo_val,
+        energy=float(np.clip(rms_mean * 10, 0, 1)),
+        rms_mean=rms_mean,
+        chroma_mean=chroma_mean,
+        centroid_mean=centroid_mean,
+        mood=_classify_mood(tempo_val, chroma_mean, centroid_mean, rms_mean),
+        tier=tier,
+    )
+
+
+# Only formats soundfile can read block by block can be streamed, everything else goes through librosa.load
+def _stream_info(filepath: str):
     try:
-        
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        return tempo
-    except Exception as e:
-        print(f"Error extracting tempo from {filepath}: {e}")
+        import soundfile
+        return soundfile.info(filepath)
+    except Exception:
         return None
 
-def get_energy(filepath: str) -> Optional[float]:
-    y, sr = _load_audio(filepath)
+
+def _stream_features(filepath: str, info, decode: Optional[DecodeConfig] = None) -> TrackFeatures:
+    import soundfile
+    import soxr
+
+    # soxr's stream resampler carries its state across blocks, so there are no seams at block edges
+    resampler = None
+    if info.samplerate != SAMPLE_RATE:
+        quality = (decode or DecodeConfig()).resample_quality
+        resampler = soxr.ResampleStream(info.samplerate, SAMPLE_RATE, 1, dtype='float32', quality=quality)
+
+    accumulator = _StreamingFeatures(SAMPLE_RATE)
+    blocksize = int(STREAM_BLOCK_SECONDS * info.samplerate)
+    decode_seconds = resample_seconds = 0.0
+    blocks = soundfile.blocks(filepath, blocksize=blocksize, dtype='float32', always_2d=True)
+    while True:
+        start = time.perf_counter()
+        block = next(blocks, None)
+        decoded = time.perf_counter()
+        decode_seconds += decoded - start
+        if block is None:
+            break
+        y = downmix(block)
+        if resampler:
+            y = resampler.resample_chunk(y)
+            resample_seconds += time.perf_counter() - decoded
+        accumulator.feed(y)
+    if resampler:
+        accumulator.feed(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+    record_decode(audio_format(filepath), info.duration, decode_seconds, resample_seconds, os.path.getsize(filepath))
+    return accumulator.finish()
+
+
+# Start offsets of the preview windows, spread evenly over the track so intros and outros don't dominate.
+# Returns None when the windows would cover the whole track anyway.
+def _preview_offsets(duration: float, config: PreviewConfig) -> Optional[List[float]]:
+    if duration <= config.windows * config.window_seconds:
+        return None
+    latest = duration - config.window_seconds
+    return [
+        min(max((i + 1) * duration / (config.windows + 1) - config.window_seconds / 2, 0.0), latest)
+        for i in range(config.windows)
+    ]
+
+
+def _preview_features(filepath: str, config: PreviewConfig,
+                      decode: Optional[DecodeConfig] = None) -> Optional[TrackFeatures]:
+    offsets = _preview_offsets(audio_duration(filepath), config)
+    if offsets is None:
+        if config.sample_rate == SAMPLE_RATE:
+            return _extract_features(filepath, decode=decode)
+        offsets, window = [0.0], None
+    else:
+        window = config.window_seconds
+
+    # Each window is analyzed on its own (no seams between them) and the statistics are pooled at the end
+    parts = []
+    for offset in offsets:
+        y, sr = decode_audio(filepath, config.sample_rate, offset=offset, duration=window, config=decode)
+        part = _StreamingFeatures(sr)
+        part.feed(y)
+        part.close()
+        parts.append(part)
+    return _merged_features(parts, tier=PREVIEW_TIER)
+
+
+# Main entry point for analysis: decodes the file once and derives every feature from it.
+# stream=None streams tracks longer than STREAM_MIN_DURATION, True/False forces either path.
+# With a PreviewConfig only a few windows are decoded and the result is marked as the preview tier.
+def extract_features(filepath: str, stream: Optional[bool] = None,
+                     preview: Optional[PreviewConfig] = None,
+                     decode: Optional[DecodeConfig] = None) -> Optional[TrackFeatures]:
+    with metrics.track(filepath), metrics.timer("extract_features"):
+        return _extract_features(filepath, stream, preview, decode)
+
+
+def _extract_features(filepath: str, stream: Optional[bool] = None,
+                      preview: Optional[PreviewConfig] = None,
+                      decode: Optional[DecodeConfig] = None) -> Optional[TrackFeatures]:
+    if preview is not None and librosa_available:
+        try:
+            with metrics.timer("preview_features"):
+                return _preview_features(filepath, preview, decode)
+        except Exception as e:
+            print(f"Error extracting preview features from {filepath}: {e}")
+            return None
+
+    if stream is not False and librosa_available:
+        info = _stream_info(filepath)
+        if info is not None and (stream or info.duration >= STREAM_MIN_DURATION):
+            try:
+                with metrics.timer("stream_features"):
+                    return _stream_features(filepath, info, decode)
+            except Exception as e:
+                print(f"Error extracting features from {filepath}: {e}")
+                return None
+
+    y, sr = _load_audio(filepath, decode)
     if y is None or sr is None:
         return None
     try:
-        rms = librosa.feature.rms(y=y)
-        energy = np.mean(rms)
-        return float(np.clip(energy * 10, 0, 1))
+        return _features_from_signal(y, sr)
     except Exception as e:
-        print(f"Error extracting energy from {filepath}: {e}")
+        print(f"Error extracting features from {filepath}: {e}")
         return None
 
-def get_mood(filepath: str) -> Optional[str]:
-    try:
-        y, sr = librosa.load(filepath)
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
 
-        rms = librosa.feature.rms(y=y)[0]
+#The functions written after this are for recording tempo energy and mood all important to analysing the music more
+# They are kept for callers that only need one value; anything that needs more than one should use extract_features
+def get_tempo(filepath: str) -> Optional[float]:
+    features = extract_features(filepath)
+    return features.tempo if features else None
 
+def get_energy(filepath: str) -> Optional[float]:
+    features = extract_features(filepath)
+    return features.energy if features else None
 
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        
+def get_mood(filepath: str) -> Optional[str]:
+    features = extract_features(filepath)
+    return features.mood if features else None
 
-        chroma_mean = np.mean(chroma)
-        centroid_mean = np.mean(centroid)
-        rms_mean = np.mean(rms)
-        tempo_val = tempo
 
-        
+# weightings the ratios which I used
+MOOD_SCORE_WEIGHTS = {"tempo": 0.4, "energy": 0.4, "mood": 0.2}
 
-        if tempo_val > 120 and centroid_mean > 2500 and rms_mean > 0.05:
-            return "Energetic"
-        elif chroma_mean > 0.6 and centroid_mean > 2000:
-            return "Happy"
-        elif chroma_mean < 0.4 and centroid_mean < 1500 and rms_mean < 0.03:
-            return "Sad"
-        elif tempo_val < 80 and rms_mean < 0.04:
-            return "Calm"
-        else:
-            return "Neutral"
-    except Exception as e:
-        return None
+# numeric mapping for mood categories
+MOOD_VALUES = {
+    "Energetic": 1.0,
+    "Happy": 0.8,
+    "Neutral": 0.5,
+    "Calm": 0.3,
+    "Sad": 0.1
+}
 
 
 # Mood Score: A score I designed to simulate Spotify's tempo system, this helps me add a gradual flow for playlists using these scores
@@ -98,98 +424,229 @@ def get_mood_score(song: Song) -> float:
     if song.tempo is None or song.energy is None:
         return 0.5  # default neutral score
 
-    # weightings the ratios which I used
-    tempo_weight = 0.4
-    energy_weight = 0.4
-    mood_weight = 0.2
-
-    # numeric mapping for mood categories
-    mood_map = {
-        "Energetic": 1.0,
-        "Happy": 0.8,
-        "Neutral": 0.5,
-        "Calm": 0.3,
-        "Sad": 0.1
-    }
-    mood_score = mood_map.get(song.mood, 0.5)
-
-    score = (song.tempo / 200 * tempo_weight) + (song.energy * energy_weight) + (mood_score * mood_weight)
+    w = MOOD_SCORE_WEIGHTS
+    mood_score = MOOD_VALUES.get(song.mood, 0.5)
+
+    score = (song.tempo / 200 * w["tempo"]) + (song.energy * w["energy"]) + (mood_score * w["mood"])
     return score
 
 
-def analyze_songs(songs: List[Song]):
+# Turns mood labels into their MOOD_VALUES. `codes` index into `labels` and -1 (no mood) maps to 0.5,
+# so this works directly on a dictionary encoded mood column.
+def mood_values(codes, labels=MOOD_LABELS, values: Optional[dict] = None) -> np.ndarray:
+    values = {**MOOD_VALUES, **(values or {})}
+    lookup = np.array([values.get(label, 0.5) for label in labels] + [0.5])
+    return lookup[np.asarray(codes)]
+
+
+# Batch version of get_mood_score: one score per track from tempo, energy and mood value arrays.
+# Tracks without tempo or energy get the neutral 0.5, like get_mood_score.
+def mood_scores(tempo, energy, moods, weights: Optional[dict] = None) -> np.ndarray:
+    w = {**MOOD_SCORE_WEIGHTS, **(weights or {})}
+    tempo = np.asarray(tempo, dtype=np.float64)
+    energy = np.asarray(energy, dtype=np.float64)
+    scores = tempo / 200 * w["tempo"] + energy * w["energy"] + np.asarray(moods, dtype=np.float64) * w["mood"]
+    scores[np.isnan(tempo) | np.isnan(energy)] = 0.5
+    return scores
+
+
+def apply_features(song: Song, features: Optional[TrackFeatures]):
+    if features is not None:
+        song.tempo = features.tempo
+        song.energy = features.energy
+        song.mood = features.mood
+        song.tier = features.tier
+        song.chroma = features.chroma_mean
+        song.centroid = features.centroid_mean
+    song.score = get_mood_score(song)
+
+
+# Fills in every feature of a song from a single decode
+def analyze_song(song: Song):
+    apply_features(song, extract_features(song.path))
+
+
+# Keeps track of how far along analysis is without printing a line per song
+class _AnalysisProgress:
+    def __init__(self, total: int, interval: float = 2.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def update(self, ok: bool = True):
+        self.done += 1
+        metrics.count("tracks_analyzed" if ok else "tracks_failed")
+        if not ok:
+            self.failed += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            print(f"Analyzed {self.done}/{self.total} tracks ({self.rate():.1f} tracks/sec)")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"Finished analyzing {self.done} tracks in {elapsed:.1f}s ({self.rate():.1f} tracks/sec)")
+        if self.failed:
+            print(f"{self.failed} tracks could not be analyzed.")
+
+
+# What a worker process gets for one track: either audio the decode stage already decoded,
+# or just the path when the worker should read and decode the file itself
+@dataclass
+class _AnalysisTask:
+    path: str
+    preview: Optional[PreviewConfig] = None
+    decode: Optional[DecodeConfig] = None
+    signal: Optional[np.ndarray] = None
+    sr: Optional[int] = None
+    metrics: bool = False
+
+
+# Read stage: pulls the whole file into memory ahead of the decoders, this is what hides slow disks and
+# network shares behind the feature math. Preview analysis only decodes a few windows and big files
+# (long mixes) are streamed block by block, so both are left to the worker.
+def _read_track(song: Song, preview: Optional[PreviewConfig], max_bytes: float) -> Optional[bytes]:
+    if preview is not None or os.path.getsize(song.path) > max_bytes:
+        return None
+    with metrics.track(song.path), metrics.timer("read_file"):
+        with open(song.path, 'rb') as f:
+            return f.read()
+
+
+# Decodes a file held in memory the same way _load_audio decodes it from disk. Returns (None, None) for
+# anything that should go through extract_features instead: formats soundfile can't read from memory
+# (these go through audioread), tracks long enough to be streamed and files that fail to decode.
+def _decode_buffer(data: bytes, decode: Optional[DecodeConfig] = None):
+    try:
+        import soundfile
+        info = soundfile.info(io.BytesIO(data))
+    except Exception:
+        return None, None
+    if info.duration >= STREAM_MIN_DURATION:
+        return None, None
+    return _load_audio(io.BytesIO(data), decode)
+
+
+# Decode stage, runs on threads in the main process
+def _decode_track(song: Song, data: Optional[bytes], preview: Optional[PreviewConfig],
+                  decode: Optional[DecodeConfig], with_metrics: bool) -> _AnalysisTask:
+    task = _AnalysisTask(song.path, preview=preview, decode=decode, metrics=with_metrics)
+    if data is not None:
+        with metrics.track(song.path), metrics.timer("decode_file"):
+            task.signal, task.sr = _decode_buffer(data, decode)
+    return task
+
+
+# Feature stage, runs in a worker process. Returns (features, metric samples or None, decode stats):
+# the worker's decode stats, and with metrics on its samples, go back with the result
+# (forked workers start with a copy of the parent's, those are dropped first).
+def _analyze_task(task: _AnalysisTask):
+    if task.metrics:
+        metrics.enable()
+        metrics.METRICS.drain()
+    drain_decode_stats()
+    if task.signal is None:
+        features = extract_features(task.path, preview=task.preview, decode=task.decode)
+    else:
+        with metrics.track(task.path), metrics.timer("extract_features"):
+            try:
+                features = _features_from_signal(task.signal, task.sr)
+            except Exception as e:
+                print(f"Error extracting features from {task.path}: {e}")
+                features = None
+    return features, metrics.METRICS.drain() if task.metrics else None, drain_decode_stats()
+
+
+def _report_pipeline(stats: dict):
+    metrics.section("pipeline", stats)
+    stages = stats["stages"]
+    line = ", ".join(f"{name} {stage['utilization']:.0%} busy" for name, stage in stages.items())
+    queues = ", ".join(f"{name} {q['mean_depth']:.1f}/{q['capacity']}" for name, q in stats["queues"].items())
+    print(f"Pipeline: {line}" + (f"; average queue depth {queues}" if queues else ""))
+
+
+# on_result is called with each song as soon as its features are in, which is how the cache checkpoints.
+# Tracks that fail are left out, so they are analyzed again next run.
+# With more than one job, files are read and decoded by the staged pipeline while the workers do feature math.
+def analyze_songs(songs: List[Song], jobs: Optional[int] = None,
+                  on_result: Optional[Callable[[Song], None]] = None,
+                  preview: Optional[PreviewConfig] = None,
+                  pipeline: Optional[PipelineConfig] = None,
+                  decode: Optional[DecodeConfig] = None, mp_context=None):
     if not librosa_available:
         print("Librosa is not installed. Cannot analyze audio features for songs.")
         return
 
+    pending = []
     for song in songs:
         if not os.path.exists(song.path):
             print(f"File not found: {song.path}. Skipping analysis.")
             continue
-        #Assigning the fields for each song
-        print(f"Analyzing {song.title} by {song.artist}...")
-        song.tempo = get_tempo(song.path)
-        song.energy = get_energy(song.path)
-        song.mood = get_mood(song.path)
-        song.score = get_mood_score(song)
-
-
+        pending.append(song)
 
-
-def generate_analysis_histograms(songs: List[Song], output_dir: str = None):
-    # Flatten and filter values beofre we use them
-    tempos = [float(s.tempo) for s in songs if s.tempo is not None]
-    energies = [float(s.energy) for s in songs if s.energy is not None]
-    moods = [s.mood for s in songs if s.mood is not None]
-
-    if not tempos and not energies and not moods:
-        print("No analyzed data available to generate histograms.")
+    if not pending:
         return
 
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-
-    #I've generated hostograms for each of Tempo, Energy and Mood for our entire library
-    if tempos:
-        plt.figure(figsize=(8,5))
-        plt.hist(tempos, bins=10, color='skyblue', edgecolor='black')
-        plt.title("Tempo Distribution")
-        plt.xlabel("BPM")
-        plt.ylabel("Number of Songs")
-        plt.grid(axis='y', alpha=0.75)
-        if output_dir:
-            plt.savefig(os.path.join(output_dir, "tempo_histogram.png"))
-            plt.close()
-        else:
-            plt.show()
-
-    
-    if energies:
-        plt.figure(figsize=(8,5))
-        plt.hist(energies, bins=10, color='salmon', edgecolor='black')
-        plt.title("Energy Distribution")
-        plt.xlabel("Energy (0-1)")
-        plt.ylabel("Number of Songs")
-        plt.grid(axis='y', alpha=0.75)
-        if output_dir:
-            plt.savefig(os.path.join(output_dir, "energy_histogram.png"))
-            plt.close()
-        else:
-            plt.show()
-
-    
-    if moods:
-        mood_counts = Counter(moods)
-        plt.figure(figsize=(6,4))
-        plt.bar(list(mood_counts.keys()), list(mood_counts.values()), color='lightgreen', edgecolor='black')
-        plt.title("Mood Distribution")
-        plt.xlabel("Mood")
-        plt.ylabel("Number of Songs")
-        if output_dir:
-            plt.savefig(os.path.join(output_dir, "mood_histogram.png"))
-            plt.close()
-        else:
-            plt.show()
-
-    print("Histograms generated successfully." + (f" Saved in {output_dir}" if output_dir else ""))
-
+    # Copies of the same recording (same fingerprint) are analyzed once and every copy gets the result
+    copies = {}
+    unique = []
+    for song in pending:
+        if song.fingerprint is not None and song.fingerprint in copies:
+            copies[song.fingerprint].append(song)
+            continue
+        if song.fingerprint is not None:
+            copies[song.fingerprint] = []
+        unique.append(song)
+    if len(unique) < len(pending):
+        print(f"{len(pending) - len(unique)} songs are copies of other songs and share their analysis.")
+
+    jobs = jobs or os.cpu_count() or 1
+    progress = _AnalysisProgress(len(pending))
+    drain_decode_stats()
+
+    def finish(song: Song, features: Optional[TrackFeatures]):
+        for target in [song] + copies.get(song.fingerprint, []):
+            apply_features(target, features)
+            if on_result and features is not None:
+                on_result(target)
+            progress.update(features is not None)
+
+    if jobs == 1 or len(unique) == 1:
+        for song in unique:
+            finish(song, extract_features(song.path, preview=preview, decode=decode))
+    else:
+        # Results come back in completion order but each one is written onto its own Song,
+        # so the final list is the same no matter which worker finishes first
+        with_metrics = metrics.METRICS.enabled
+        config = pipeline or PipelineConfig()
+        max_bytes = config.max_prefetch_mb * 1024 * 1024
+        staged = StagedPipeline(
+            read=lambda song: _read_track(song, preview, max_bytes),
+            decode=lambda song, data: _decode_track(song, data, preview, decode, with_metrics),
+            compute=_analyze_task,
+            jobs=jobs,
+            config=config,
+            mp_context=mp_context,
+            weight=lambda task: task.signal.nbytes if task.signal is not None else 0,
+        )
+        for song, features, error in staged.run(unique):
+            if error is not None:
+                print(f"Error analyzing {song.path}: {error}")
+                features = None
+            else:
+                features, drained, decoded = features
+                if drained is not None:
+                    metrics.METRICS.merge(drained)
+                merge_decode_stats(decoded)
+            finish(song, features)
+        _report_pipeline(staged.stats)
+
+    progress.finish()
+    print_decode_report(drain_decode_stats())
@@ -0,0 +1,189 @@
+import os
+import pickle
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import metrics
+from .fingerprint import fingerprint_songs
+from .scanner import Song
+from .analyser import ANALYZER_VERSION
+
+
+FEATURE_FIELDS = ("tempo", "energy", "mood", "score", "tier", "chroma", "centroid")
+
+
+def cache_key(path: str) -> str:
+    return os.path.abspath(path)
+
+
+# Every entry remembers the size and mtime the file had when it was analyzed,
+# so a changed file simply stops matching its entry. The fingerprint lets it match the same audio elsewhere.
+def _entry_for(song: Song) -> dict:
+    entry = {"size": song.size, "mtime": song.mtime, "fingerprint": song.fingerprint}
+    for field in FEATURE_FIELDS:
+        entry[field] = getattr(song, field)
+    return entry
+
+
+# Tracks that failed to analyze have no features. They aren't cached, so the next run tries them again.
+def _analyzed(song: Song) -> bool:
+    return song.size is not None and song.tempo is not None
+
+
+def _copy_entry(song: Song, entry: dict):
+    for field in FEATURE_FIELDS:
+        setattr(song, field, entry.get(field))
+    if entry.get("fingerprint"):
+        song.fingerprint = entry["fingerprint"]
+
+
+# The whole cache file: {"analyzer_version": ..., "tracks": {path: entry}} plus whatever metadata
+# it was written with (shard caches record their shard and library root). None if it can't be read.
+def read_cache_file(cache_file: str) -> Optional[dict]:
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'rb') as f, metrics.timer("cache_load"):
+            data = pickle.load(f)
+    except Exception as e:
+        print(f"Could not load cache: {e}")
+        return None
+    return data if isinstance(data, dict) and isinstance(data.get("tracks"), dict) else None
+
+
+def load_cache(cache_file: str) -> Dict[str, dict]:
+    data = read_cache_file(cache_file)
+    if data is None:
+        return {}
+    if data.get("analyzer_version") != ANALYZER_VERSION:
+        print(f"Cache in {cache_file} was written by a different analyzer version, it will be rebuilt.")
+        return {}
+    print(f"Loaded cached analysis from {cache_file}")
+    return data["tracks"]
+
+
+# Writes to a temporary file next to the cache and renames it over the old one,
+# so a crash mid-write leaves the previous cache intact instead of a truncated file
+def _write_atomic(tracks: Dict[str, dict], cache_file: str, meta: Optional[dict] = None):
+    directory = os.path.dirname(os.path.abspath(cache_file))
+    fd, tmp_path = tempfile.mkstemp(prefix=".songs_cache.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f, metrics.timer("cache_save"):
+            pickle.dump({**(meta or {}), "analyzer_version": ANALYZER_VERSION, "tracks": tracks}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Writes cache entries as they are, e.g. after merging shard caches
+def write_tracks(tracks: Dict[str, dict], cache_file: str, meta: Optional[dict] = None):
+    _write_atomic(tracks, cache_file, meta)
+
+
+def save_cache(songs: List[Song], cache_file: str):
+    # Only the songs that are currently in the library get written, which is what drops deleted files
+    tracks = {cache_key(song.path): _entry_for(song) for song in songs if _analyzed(song)}
+    try:
+        _write_atomic(tracks, cache_file)
+        print(f"Songs analysis cached in {cache_file}")
+    except Exception as e:
+        print(f"Could not save cache: {e}")
+
+
+# Collects analysis results as they come in and commits them to the cache in small batches,
+# so an interrupted run only loses the last batch and the next run picks up where it stopped
+class CacheCheckpoint:
+    def __init__(self, cache_file: str, cached_songs: List[Song], batch_size: int = 25,
+                 interval: float = 30.0, dirty: bool = False, meta: Optional[dict] = None):
+        self.cache_file = cache_file
+        self.meta = meta
+        self.batch_size = batch_size
+        self.interval = interval
+        self.tracks = {cache_key(song.path): _entry_for(song) for song in cached_songs if _analyzed(song)}
+        self.pending = 1 if dirty else 0
+        self.recorded = 0  # results recorded by this run, tracks that failed don't count
+        self.last_commit = time.monotonic()
+
+    def record(self, song: Song):
+        if not _analyzed(song):
+            return
+        self.tracks[cache_key(song.path)] = _entry_for(song)
+        self.pending += 1
+        self.recorded += 1
+        if self.pending >= self.batch_size or time.monotonic() - self.last_commit >= self.interval:
+            self.commit()
+
+    def commit(self) -> bool:
+        if not self.pending:
+            return True
+        try:
+            _write_atomic(self.tracks, self.cache_file, self.meta)
+        except Exception as e:
+            print(f"Could not save cache checkpoint: {e}")
+            return False
+        self.pending = 0
+        self.last_commit = time.monotonic()
+        return True
+
+    def close(self):
+        had_pending = self.pending > 0
+        if self.commit() and had_pending:
+            print(f"Songs analysis cached in {self.cache_file}")
+
+
+# Copies cached features onto unchanged songs and returns
+# (songs that still need analysis, number of deleted entries, number of songs matched by content).
+# A song without an entry for its path can still be audio that was analyzed before: a moved or renamed
+# file, a copy in another folder or a file whose tags were edited. Those songs are fingerprinted and
+# take the features of any entry with the same fingerprint. Entries written before fingerprints
+# existed match a moved file by size and mtime instead, which a move keeps.
+# Fingerprinting reads a little of each unmatched file on `threads` threads.
+def apply_cache(songs: List[Song], tracks: Dict[str, dict],
+                threads: Optional[int] = None) -> Tuple[List[Song], int, int]:
+    misses = []
+    seen = set()
+    for song in songs:
+        key = cache_key(song.path)
+        seen.add(key)
+        entry = tracks.get(key)
+        # An entry without features is a track that failed in an older run, it gets another try
+        if entry is None or entry.get("tempo") is None or song.size is None or entry["size"] != song.size or entry["mtime"] != song.mtime:
+            misses.append(song)
+            continue
+        _copy_entry(song, entry)
+
+    stale, relinked = misses, 0
+    if misses:
+        fingerprint_songs(misses, threads)
+        by_fingerprint, by_stat = {}, {}
+        for key, entry in tracks.items():
+            if entry.get("tempo") is None:
+                continue
+            if entry.get("fingerprint"):
+                by_fingerprint.setdefault(entry["fingerprint"], entry)
+            elif key not in seen:
+                by_stat.setdefault((entry["size"], entry["mtime"]), entry)
+
+        stale = []
+        for song in misses:
+            entry = by_fingerprint.get(song.fingerprint)
+            if entry is None and song.size is not None:
+                entry = by_stat.get((song.size, song.mtime))
+            if entry is None:
+                stale.append(song)
+                continue
+            _copy_entry(song, entry)
+            relinked += 1
+
+    deleted = sum(1 for key in tracks if key not in seen)
+    metrics.count("cache_hits", len(songs) - len(misses))
+    metrics.count("cache_relinked", relinked)
+    metrics.count("cache_misses", len(stale))
+    return stale, deleted, relinked
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib import error, request
+
+from .analyser import analyze_songs
+from .cache import CacheCheckpoint, apply_cache, load_cache
+from .decode import DecodeConfig
+from .pipeline import PipelineConfig, thread_safe_context
+from .playlist import (create_genre_playlist, create_mood_transition_playlist, create_playlists,
+                       create_query_playlist, create_scenario_playlist, create_similarity_playlist)
+from .query import QueryError, parse_query
+from .scanner import scan_library
+from .histograms import load_or_build_histograms
+from .lookup import candidates_message, describe, load_or_build_lookup
+from .similarity import load_or_build_index
+from .store import open_store, write_store
+
+
+DEFAULT_PORT = 8765
+
+
+# What the daemon answers queries from. A refresh builds a new one and swaps it in whole,
+# so a request never sees a half updated library.
+class LibrarySnapshot:
+    def __init__(self, table, index, lookup):
+        self.table = table
+        self.index = index
+        self.lookup = lookup
+        self.loaded = time.time()
+
+    # (song, None), or (None, error body) naming the songs an ambiguous title could mean
+    # (row, None) for a match, (None, error body) otherwise
+    def find_row(self, title: str):
+        row, candidates = self.lookup.resolve(title)
+        if row is not None:
+            return row, None
+        if not candidates:
+            return None, {"error": f"Could not find the song '{title}'."}
+        names = [describe(self.table, candidate) for candidate, _ in candidates]
+        return None, {"error": f"{candidates_message(title, candidates)} {'; '.join(names)}", "candidates": names}
+
+
+# Keeps the analyzed library in memory and rescans it every `interval` seconds. Only new or changed
+# files get analyzed (the scan index makes an unchanged rescan a handful of stat calls) and the
+# feature store and similarity index are rebuilt only when something changed.
+class LibraryDaemon:
+    def __init__(self, library_path: str, cache_file: str, store_dir: str, scan_index_file: str,
+                 jobs: Optional[int] = None, interval: float = 60.0, scan_threads: Optional[int] = None,
+                 pipeline: Optional[PipelineConfig] = None, decode: Optional[DecodeConfig] = None):
+        self.library_path = os.path.abspath(library_path)
+        self.cache_file = cache_file
+        self.store_dir = store_dir
+        self.scan_index_file = scan_index_file
+        self.jobs = jobs
+        self.interval = interval
+        self.scan_threads = scan_threads
+        self.pipeline = pipeline
+        self.decode = decode
+        self.snapshot = None
+        self.tracks = None
+        # (path, size, mtime) of tracks that failed to analyze, they aren't retried until the file changes
+        self.failed = set()
+        self.refreshing = False
+        self.stopped = threading.Event()
+
+    def _load_snapshot(self) -> bool:
+        table = open_store(self.store_dir)
+        if table is None:
+            return False
+        self.snapshot = LibrarySnapshot(table, load_or_build_index(table, self.store_dir),
+                                        load_or_build_lookup(table, self.store_dir))
+        return True
+
+    def refresh(self):
+        self.refreshing = True
+        try:
+            songs = scan_library(self.library_path, index_file=self.scan_index_file, threads=self.scan_threads)
+            if self.tracks is None:
+                self.tracks = load_cache(self.cache_file)
+            stale, deleted, relinked = apply_cache(songs, self.tracks, threads=self.scan_threads)
+            stale = [song for song in stale if (song.path, song.size, song.mtime) not in self.failed]
+            if not stale and not deleted and not relinked and self.snapshot is not None:
+                return
+
+            stale_ids = {id(song) for song in stale}
+            checkpoint = CacheCheckpoint(self.cache_file, [s for s in songs if id(s) not in stale_ids],
+                                         dirty=deleted > 0 or relinked > 0)
+            if stale:
+                print(f"Analyzing {len(stale)} new or modified songs...")
+                # This runs on the watcher thread while the HTTP server's threads are serving,
+                # forking the workers from here could copy a lock one of them holds
+                analyze_songs(stale, jobs=self.jobs, on_result=checkpoint.record, pipeline=self.pipeline,
+                              decode=self.decode, mp_context=thread_safe_context())
+                self.failed.update((song.path, song.size, song.mtime) for song in stale if song.tempo is None)
+            checkpoint.close()
+            self.tracks = checkpoint.tracks
+            if not checkpoint.recorded and not deleted and not relinked and self.snapshot is not None:
+                return
+
+            write_store(songs, self.store_dir)
+            if self._load_snapshot():
+                load_or_build_histograms(self.snapshot.table, self.store_dir)
+                print(f"Library updated: {len(self.snapshot.table)} songs.")
+        except Exception as e:
+            print(f"Library refresh failed: {e}")
+        finally:
+            self.refreshing = False
+
+    def _watch(self):
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.interval)
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "library": self.library_path,
+            "songs": len(snapshot.table) if snapshot else 0,
+            "loaded": snapshot.loaded if snapshot else None,
+            "refreshing": self.refreshing,
+        }
+
+    # Runs one playlist request against the current snapshot and returns (HTTP status, response body)
+    def handle(self, payload: dict):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return 503, {"error": "The library is still being analyzed, try again shortly."}
+        if payload.get("library") and os.path.abspath(payload["library"]) != self.library_path:
+            return 409, {"error": f"This daemon serves '{self.library_path}'."}
+
+        mode = payload.get("mode")
+        output = payload.get("output")
+        max_songs = payload.get("max_songs", 10)
+        table, index = snapshot.table, snapshot.index
+
+        if mode == "batch":
+            return 200, {"paths": create_playlists(table, payload["playlists"], index=index, lookup=snapshot.lookup)}
+        if mode == "genre":
+            path = create_genre_playlist(table, payload["genre"], output)
+        elif mode == "scenario":
+            path = create_scenario_playlist(table, payload["scenario"], output, max_songs=max_songs)
+        elif mode == "query":
+            try:
+                parse_query(payload["query"])
+            except QueryError as e:
+                return 422, {"error": f"Invalid query: {e}"}
+            path = create_query_playlist(table, payload["query"], output, max_songs=payload.get("max_songs"))
+        elif mode == "mood_transition":
+            start_row, start_error = snapshot.find_row(payload["start"])
+            end_row, end_error = snapshot.find_row(payload["end"])
+            if start_row is None or end_row is None:
+                return 404, start_error or end_error
+            path = create_mood_transition_playlist(table, table.song(start_row), table.song(end_row), output,
+                                                   max_songs=max_songs, index=index,
+                                                   start_row=start_row, end_row=end_row)
+        elif mode == "similar":
+            seed_row, seed_error = snapshot.find_row(payload["title"])
+            if seed_row is None:
+                return 404, seed_error
+            path = create_similarity_playlist(table, table.song(seed_row), output, max_songs=max_songs,
+                                              radius=payload.get("radius"), index=index, row=seed_row)
+        else:
+            return 400, {"error": f"Unknown playlist mode '{mode}'."}
+
+        if path is None:
+            return 422, {"error": "Playlist generation failed."}
+        return 200, {"path": path}
+
+    # Serves on localhost only, playlist files are written with the daemon's permissions
+    def serve(self, port: int = DEFAULT_PORT) -> bool:
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self._reply(200, daemon.status())
+                else:
+                    self._reply(404, {"error": "Not found."})
+
+            def do_POST(self):
+                if self.path != "/playlist":
+                    self._reply(404, {"error": "Not found."})
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    status, body = daemon.handle(payload)
+                except (ValueError, KeyError, TypeError) as e:
+                    status, body = 400, {"error": f"Bad request: {e}"}
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+                self._reply(status, body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as e:
+            print(f"Could not listen on port {port}: {e}")
+            return False
+
+        # Answer from the last run's store straight away, the first rescan catches up in the background
+        if self._load_snapshot():
+            print(f"Loaded feature store with {len(self.snapshot.table)} songs.")
+        watcher = threading.Thread(target=self._watch, name="library-watcher", daemon=True)
+        watcher.start()
+
+        print(f"Serving playlists for '{self.library_path}' on http://127.0.0.1:{port} (Ctrl-C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping daemon.")
+        finally:
+            self.stopped.set()
+            server.server_close()
+        return True
+
+
+# Client side: sends one playlist request to a running daemon. Returns the response body or None.
+def request_playlist(payload: dict, port: int = DEFAULT_PORT, timeout: float = 30.0) -> Optional[dict]:
+    req = request.Request(
+        f"http://127.0.0.1:{port}/playlist",
+        data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
+    except error.HTTPError as e:
+        try:
+            body = json.loads(e.read())
+        except ValueError:
+            body = {}
+        print(f"Daemon error: {body.get('error', e.reason)}")
+    except (error.URLError, OSError) as e:
+        print(f"Could not reach the daemon on port {port}: {e}. Start it with --daemon.")
+    return None
@@ -0,0 +1,198 @@
+import io
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+
+
+# Decoding and resampling for analysis. Every decoder is tried in the order of the configured backend
+# and the first one that can read the container wins: soundfile (libsndfile) reads FLAC, OGG, WAV, AIFF
+# and, with libsndfile 1.1 or newer, MP3 straight into float32; librosa (audioread/ffmpeg) handles
+# the rest (M4A, WMA, ...). Channels are averaged to mono before resampling, so the resampler only
+# does a single channel's work, and resampling is done by soxr at the configured quality.
+RESAMPLE_QUALITIES = ("VHQ", "HQ", "MQ", "LQ", "QQ")
+BACKENDS = {
+    "auto": ("soundfile", "librosa"),
+    "librosa": ("librosa",),  # everything through librosa.load, as before the decode layer
+}
+
+
+# HQ is what librosa.load uses. MQ gives practically the same features, LQ and QQ cut the band short
+# enough to shift energy noticeably (see benchmarks/decode_benchmark.py); decoding dominates either way.
+# The quality isn't part of the cache key: rerun with --force-refresh after changing it to reanalyze.
+@dataclass
+class DecodeConfig:
+    backend: str = "auto"
+    resample_quality: str = "HQ"
+
+
+_soundfile_formats = None
+
+
+def _soundfile_extensions() -> set:
+    global _soundfile_formats
+    if _soundfile_formats is None:
+        try:
+            import soundfile
+            _soundfile_formats = {name.lower() for name in soundfile.available_formats()}
+            # Container names that don't match their file extension
+            if "aiff" in _soundfile_formats:
+                _soundfile_formats.add("aif")
+            if "ogg" in _soundfile_formats:
+                _soundfile_formats |= {"oga", "opus"}
+        except Exception:
+            _soundfile_formats = set()
+    return _soundfile_formats
+
+
+# Container of a path (its extension) or of an in-memory file (what libsndfile detects, if anything)
+def audio_format(source) -> str:
+    if isinstance(source, str):
+        return os.path.splitext(source)[1].lstrip(".").lower() or "unknown"
+    try:
+        import soundfile
+        position = source.tell()
+        try:
+            return soundfile.info(source).format.lower()
+        finally:
+            source.seek(position)
+    except Exception:
+        return "unknown"
+
+
+def _can_decode(decoder: str, fmt: str) -> bool:
+    return decoder != "soundfile" or fmt in _soundfile_extensions()
+
+
+# Decoded frames as float32, shape (frames, channels), and the native sample rate
+def _decode_soundfile(source, offset: float, duration: Optional[float]):
+    import soundfile
+    with soundfile.SoundFile(source) as f:
+        sr = f.samplerate
+        if offset:
+            f.seek(int(offset * sr))
+        frames = int(duration * sr) if duration is not None else -1
+        return f.read(frames=frames, dtype='float32', always_2d=True), sr
+
+
+def _decode_librosa(source, offset: float, duration: Optional[float]):
+    import librosa
+    y, sr = librosa.load(source, sr=None, mono=False, offset=offset, duration=duration)
+    return np.atleast_2d(y).T, sr
+
+
+DECODERS = {
+    "soundfile": _decode_soundfile,
+    "librosa": _decode_librosa,
+}
+
+
+def downmix(frames: np.ndarray) -> np.ndarray:
+    return frames[:, 0] if frames.shape[1] == 1 else frames.mean(axis=1)
+
+
+def resample(y: np.ndarray, orig_sr: int, target_sr: int, quality: str = "HQ") -> np.ndarray:
+    if orig_sr == target_sr:
+        return y
+    import soxr
+    return soxr.resample(y, orig_sr, target_sr, quality=quality)
+
+
+# Per container: files, seconds of audio, bytes read and seconds spent decoding and resampling.
+# Kept per process, workers send theirs back with every result (see drain_decode_stats).
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_decode(fmt: str, audio_seconds: float, decode_seconds: float, resample_seconds: float, size: int):
+    with _stats_lock:
+        entry = _stats.setdefault(fmt, {"files": 0, "audio_seconds": 0.0, "decode_seconds": 0.0,
+                                        "resample_seconds": 0.0, "bytes": 0})
+        entry["files"] += 1
+        entry["audio_seconds"] += audio_seconds
+        entry["decode_seconds"] += decode_seconds
+        entry["resample_seconds"] += resample_seconds
+        entry["bytes"] += size
+
+
+def drain_decode_stats() -> dict:
+    global _stats
+    with _stats_lock:
+        stats, _stats = _stats, {}
+    return stats
+
+
+def merge_decode_stats(stats: dict):
+    for fmt, entry in stats.items():
+        with _stats_lock:
+            current = _stats.setdefault(fmt, dict.fromkeys(entry, 0))
+            for key, value in entry.items():
+                current[key] += value
+
+
+def _source_size(source) -> int:
+    if isinstance(source, io.BytesIO):
+        return len(source.getbuffer())
+    try:
+        return os.path.getsize(source)
+    except (OSError, TypeError):
+        return 0
+
+
+# Mono float32 audio at sr (the native rate when sr is None) from a path or an in-memory file,
+# optionally only `duration` seconds starting at `offset`. Raises when no decoder can read it.
+def decode_audio(source, sr: Optional[int], offset: float = 0.0, duration: Optional[float] = None,
+                 config: Optional[DecodeConfig] = None) -> Tuple[np.ndarray, int]:
+    config = config or DecodeConfig()
+    fmt = audio_format(source)
+    error = None
+    for decoder in BACKENDS.get(config.backend, BACKENDS["auto"]):
+        if not _can_decode(decoder, fmt):
+            continue
+        start = time.perf_counter()
+        try:
+            with metrics.timer("decode"):
+                frames, native_sr = DECODERS[decoder](source, offset, duration)
+        except Exception as e:
+            error = e
+            if isinstance(source, io.BytesIO):
+                source.seek(0)
+            continue
+        decoded = time.perf_counter()
+        y = downmix(frames)
+        if sr is not None and native_sr != sr:
+            with metrics.timer("resample"):
+                y = resample(y, native_sr, sr, config.resample_quality)
+        record_decode(fmt, len(frames) / native_sr, decoded - start, time.perf_counter() - decoded, _source_size(source))
+        return y, sr or native_sr
+    raise error or ValueError(f"No decoder for {fmt} files")
+
+
+# Length in seconds without decoding, from the header when libsndfile can read it
+def audio_duration(path: str) -> float:
+    if audio_format(path) in _soundfile_extensions():
+        try:
+            import soundfile
+            return soundfile.info(path).duration
+        except Exception:
+            pass
+    import librosa
+    return librosa.get_duration(path=path)
+
+
+def print_decode_report(stats: dict):
+    if not stats:
+        return
+    metrics.section("decode", stats)
+    parts = []
+    for fmt, entry in sorted(stats.items(), key=lambda item: -item[1]["files"]):
+        busy = entry["decode_seconds"] + entry["resample_seconds"]
+        speed = f"{entry['audio_seconds'] / busy:.0f}x realtime" if busy > 0 else "n/a"
+        share = f", {entry['resample_seconds'] / busy:.0%} resampling" if busy > 0 else ""
+        parts.append(f"{fmt} {entry['files']} files {speed}{share}")
+    print("Decode: " + "; ".join(parts))
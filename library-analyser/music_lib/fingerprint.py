@@ -0,0 +1,113 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from . import metrics
+from .scanner import Song
+
+
+# A content fingerprint tells when two files hold the same audio, e.g. one recording sitting in an
+# album folder and a compilation folder, or a file that was moved or renamed. Only the audio payload
+# is hashed, tags are skipped where that is cheap to do (ID3v2/ID3v1 around MP3s, the tag, picture
+# and padding blocks at the start of a FLAC), so retagging a copy doesn't make it look different.
+# In other formats the tags count as payload, so a retagged copy gets a new fingerprint (unless the
+# edit leaves the length and both end chunks alone).
+#
+# Reading whole files would cost as much as decoding them, so only the payload length and a chunk
+# at each end of the payload go into the hash. Two different encodes don't share those. A FLAC's other
+# metadata blocks are hashed as well, STREAMINFO above all: it holds the sample count and the MD5 of
+# the decoded audio, the strongest sign of two files holding the same recording.
+CHUNK_SIZE = 64 * 1024
+# FLAC metadata blocks that retagging rewrites: PADDING, VORBIS_COMMENT and PICTURE
+FLAC_SKIPPED_BLOCKS = {1, 4, 6}
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] & 0x7f) << 21 | (data[1] & 0x7f) << 14 | (data[2] & 0x7f) << 7 | (data[3] & 0x7f)
+
+
+# (start, end) byte offsets of the audio inside the file, and the FLAC metadata blocks that describe it
+def _payload_range(f, size: int):
+    start, end = 0, size
+    blocks = []
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        start = 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)  # the flag means a footer follows
+
+    f.seek(start)
+    if f.read(4) == b"fLaC":
+        # Metadata blocks: a byte with the last-block flag and type, then a 24 bit length
+        pos = start + 4
+        while pos < size:
+            f.seek(pos)
+            block = f.read(4)
+            if len(block) < 4:
+                break
+            length = int.from_bytes(block[1:4], 'big')
+            if block[0] & 0x7f not in FLAC_SKIPPED_BLOCKS:
+                blocks.append(block[:1] + f.read(length))
+            pos += 4 + length
+            if block[0] & 0x80:
+                break
+        start = pos
+
+    if end - start > 128:
+        f.seek(end - 128)
+        if f.read(3) == b"TAG":
+            end -= 128
+    return min(start, end), end, b"".join(blocks)
+
+
+def audio_fingerprint(path: str) -> Optional[str]:
+    with metrics.timer("fingerprint", path):
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                start, end, metadata = _payload_range(f, size)
+                digest = hashlib.blake2b(digest_size=16)
+                digest.update((end - start).to_bytes(8, 'little'))
+                digest.update(metadata)
+                f.seek(start)
+                if end - start <= 2 * CHUNK_SIZE:
+                    digest.update(f.read(end - start))
+                else:
+                    digest.update(f.read(CHUNK_SIZE))
+                    f.seek(end - CHUNK_SIZE)
+                    digest.update(f.read(CHUNK_SIZE))
+                return digest.hexdigest()
+        except OSError:
+            return None
+
+
+# Fills in song.fingerprint, reading on a thread pool like the tag reads in scan_library
+def fingerprint_songs(songs: List[Song], threads: Optional[int] = None):
+    if not songs:
+        return
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for song, fingerprint in zip(songs, executor.map(audio_fingerprint, [s.path for s in songs])):
+            song.fingerprint = fingerprint
+
+
+# Songs that share a fingerprint, biggest groups first. Songs without one are left out.
+def duplicate_groups(songs: List[Song]) -> List[List[Song]]:
+    groups = defaultdict(list)
+    for song in songs:
+        if song.fingerprint is not None:
+            groups[song.fingerprint].append(song)
+    duplicates = [sorted(group, key=lambda s: s.path) for group in groups.values() if len(group) > 1]
+    return sorted(duplicates, key=lambda group: (-len(group), group[0].path))
+
+
+def print_duplicate_report(songs: List[Song]):
+    groups = duplicate_groups(songs)
+    if not groups:
+        print("No duplicate recordings found.")
+        return
+    copies = sum(len(group) - 1 for group in groups)
+    print(f"\n--- Duplicate recordings: {len(groups)} groups, {copies} extra copies ---")
+    for group in groups:
+        print(f"[{group[0].fingerprint[:12]}] {group[0].artist} - {group[0].title} ({len(group)} copies)")
+        for song in group:
+            print(f"    {song.path}")
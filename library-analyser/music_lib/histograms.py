@@ -0,0 +1,179 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from . import metrics
+from .analyser import MOOD_LABELS
+from .store import LibraryTable
+
+
+# Distribution data for the library charts: tempo and energy histograms, mood counts, and the same
+# broken down per genre. Bin edges are fixed, so the histograms are computed once from the store's
+# columns (a few bincounts, no per-track Python) and saved next to it. Charts and summaries are
+# drawn from the saved counts without touching the tracks again.
+HISTOGRAMS_FILE = "histograms.json"
+HISTOGRAM_BINS = {
+    "tempo": np.arange(0.0, 255.0, 5.0),  # 0-250 BPM, faster tracks land in the last bin
+    "energy": np.linspace(0.0, 1.0, 21),
+}
+
+
+def _bin_codes(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+# Counts per (group, bin) in one bincount, rows where the value or the group is missing are left out
+def _grouped_counts(groups: np.ndarray, group_count: int, codes: np.ndarray, code_count: int) -> np.ndarray:
+    keep = (groups >= 0) & (codes >= 0)
+    flat = groups[keep].astype(np.int64) * code_count + codes[keep]
+    return np.bincount(flat, minlength=group_count * code_count).reshape(group_count, code_count)
+
+
+@metrics.timed("histograms_build")
+def build_histograms(table: LibraryTable) -> dict:
+    count = len(table)
+    # Library-wide counts put every track in one group, the per-genre ones group by genre code
+    genres = table.labels("genre")
+    genre_codes = np.asarray(table.column("genre"), dtype=np.int64)
+    groups = {"library": np.zeros(count, dtype=np.int64), "genre": genre_codes}
+
+    binned = {}
+    for name, edges in HISTOGRAM_BINS.items():
+        values = np.asarray(table.column(name), dtype=np.float64)
+        codes = np.where(np.isnan(values), -1, _bin_codes(values, edges))
+        binned[name] = (codes, len(edges) - 1)
+
+    # Moods are counted in MOOD_LABELS order, whatever order the store's labels are in
+    mood_labels = table.labels("mood")
+    labels = list(MOOD_LABELS) + [label for label in mood_labels if label not in MOOD_LABELS]
+    to_label = np.array([labels.index(label) for label in mood_labels] + [-1], dtype=np.int64)
+    binned["moods"] = (to_label[np.asarray(table.column("mood"), dtype=np.int64)], len(labels))  # -1 picks the last entry
+
+    counts = {}
+    for key, group_codes in groups.items():
+        group_count = 1 if key == "library" else len(genres)
+        counts[key] = {name: _grouped_counts(group_codes, group_count, codes, code_count)
+                       for name, (codes, code_count) in binned.items()}
+    genre_tracks = np.bincount(genre_codes[genre_codes >= 0], minlength=len(genres))
+
+    def mood_counts(row: np.ndarray) -> dict:
+        return {label: int(n) for label, n in zip(labels, row.tolist()) if n}
+
+    histograms = {
+        "tracks": count,
+        "analyzed": int(counts["library"]["tempo"].sum()),
+        "edges": {name: edges.tolist() for name, edges in HISTOGRAM_BINS.items()},
+        "tempo": counts["library"]["tempo"][0].tolist(),
+        "energy": counts["library"]["energy"][0].tolist(),
+        "moods": mood_counts(counts["library"]["moods"][0]),
+        "genres": {},
+    }
+    for code in np.argsort(-genre_tracks, kind='stable').tolist():
+        if genre_tracks[code]:
+            histograms["genres"][genres[code]] = {
+                "tracks": int(genre_tracks[code]),
+                "tempo": counts["genre"]["tempo"][code].tolist(),
+                "energy": counts["genre"]["energy"][code].tolist(),
+                "moods": mood_counts(counts["genre"]["moods"][code]),
+            }
+    return histograms
+
+
+def _histograms_match(histograms: dict, table: LibraryTable) -> bool:
+    edges = histograms.get("edges", {})
+    return histograms.get("tracks") == len(table) and all(
+        edges.get(name) == bins.tolist() for name, bins in HISTOGRAM_BINS.items())
+
+
+# Loads the histograms saved in a store directory, or builds (and saves) them when they are missing
+# or don't belong to the table, the same way as the similarity index
+def load_or_build_histograms(table: LibraryTable, store_dir: Optional[str] = None) -> dict:
+    path = os.path.join(store_dir, HISTOGRAMS_FILE) if store_dir else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                histograms = json.load(f)
+            if _histograms_match(histograms, table):
+                return histograms
+        except (OSError, ValueError):
+            pass
+
+    histograms = build_histograms(table)
+    if path and os.path.isdir(store_dir):
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(histograms, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save histograms: {e}")
+    return histograms
+
+
+# Draws every chart into one image (the format follows the file extension, e.g. .png or .svg).
+# The figure is rendered with the Agg canvas directly, so no GUI backend is ever loaded and
+# nothing waits on a window, whatever matplotlib backend is configured.
+@metrics.timed("histograms_render")
+def render_histograms(histograms: dict, output_file: str, top_genres: int = 12) -> bool:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    if not histograms["analyzed"] and not histograms["moods"]:
+        print("No analyzed data available to generate histograms.")
+        return False
+
+    fig = Figure(figsize=(14, 9))
+    FigureCanvasAgg(fig)
+    (tempo_ax, energy_ax), (mood_ax, genre_ax) = fig.subplots(2, 2)
+    fig.suptitle(f"Library of {histograms['tracks']} songs ({histograms['analyzed']} analyzed)")
+
+    for ax, name, color, label in ((tempo_ax, "tempo", "skyblue", "BPM"), (energy_ax, "energy", "salmon", "Energy (0-1)")):
+        edges = np.array(histograms["edges"][name])
+        ax.stairs(histograms[name], edges, fill=True, color=color)  # one patch instead of a bar per bin
+        ax.stairs(histograms[name], edges, color='black', linewidth=0.5)
+        ax.set_title(f"{name.capitalize()} Distribution")
+        ax.set_xlabel(label)
+        ax.set_ylabel("Number of Songs")
+        ax.grid(axis='y', alpha=0.75)
+
+    moods = histograms["moods"]
+    mood_ax.bar(list(moods), list(moods.values()), color='lightgreen', edgecolor='black')
+    mood_ax.set_title("Mood Distribution")
+    mood_ax.set_xlabel("Mood")
+    mood_ax.set_ylabel("Number of Songs")
+
+    # Moods of the biggest genres as stacked horizontal bars
+    genres = list(histograms["genres"].items())[:top_genres][::-1]
+    left = np.zeros(len(genres))
+    for mood in moods:
+        widths = np.array([genre["moods"].get(mood, 0) for _, genre in genres])
+        genre_ax.barh([name for name, _ in genres], widths, left=left, label=mood)
+        left += widths
+    genre_ax.set_title(f"Moods of the Top {len(genres)} Genres")
+    genre_ax.set_xlabel("Number of Songs")
+    if genres:
+        genre_ax.legend(loc="lower right", fontsize="small")
+
+    fig.subplots_adjust(left=0.07, right=0.97, bottom=0.07, top=0.92, hspace=0.3, wspace=0.2)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        fig.savefig(output_file, dpi=100)
+    except (OSError, ValueError) as e:
+        print(f"Could not save histograms to '{output_file}': {e}")
+        return False
+    return True
+
+
+# A .json name gets the histogram data itself (counts and bin edges), anything else is drawn as an image
+def write_histograms(histograms: dict, output_file: str) -> bool:
+    if not output_file.lower().endswith(".json"):
+        return render_histograms(histograms, output_file)
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(histograms, f, indent=2, ensure_ascii=False)
+        return True
+    except OSError as e:
+        print(f"Could not write histograms to '{output_file}': {e}")
+        return False
@@ -0,0 +1,276 @@
+import hashlib
+import os
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+from .store import LibraryTable
+
+
+# Song lookup by title for --mood-transition, --similar-to, batch playlists and the daemon.
+# Titles are normalized (case, accents and punctuation dropped) and indexed two ways: a sorted
+# array of title hashes for exact matches, and a trigram inverted index for near matches, so a typo
+# still finds the song. "Artist - Title" picks between songs that share a title. Both are plain
+# arrays saved next to the store, so a lookup is a few binary searches and one bincount.
+LOOKUP_FILE = "lookup.npz"
+LOOKUP_VERSION = 1
+ARTIST_SEPARATOR = " - "
+# A near match is used without asking when it scores at least MATCH_SCORE and beats the runner-up
+# by MATCH_MARGIN, candidates below MIN_SCORE aren't offered at all (trigram Dice scores, 0-1)
+MATCH_SCORE = 0.6
+MATCH_MARGIN = 0.15
+MIN_SCORE = 0.3
+
+_WORD = re.compile(r"\w+")
+_NO_ROWS = np.empty(0, dtype=np.int64)
+
+
+def normalize(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+    return " ".join(_WORD.findall(text)) or text.strip()
+
+
+def _hash(text: str) -> int:
+    # Signed, so the hashes fit an int64 array; hash() is salted per process and can't be saved
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8', 'surrogateescape'), digest_size=8).digest(),
+                          'little', signed=True)
+
+
+# Three code points packed into one integer, 21 bits each. Texts are padded with a space
+# on both sides so the first and last letters get trigrams of their own.
+def _trigrams(codes: np.ndarray) -> np.ndarray:
+    codes = codes.astype(np.int64)
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+
+def _text_trigrams(text: str) -> np.ndarray:
+    codes = np.frombuffer(f" {text} ".encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    return np.unique(_trigrams(codes))
+
+
+class TrackLookup:
+    def __init__(self, table: LibraryTable, hashes: np.ndarray, hash_rows: np.ndarray, grams: np.ndarray,
+                 gram_offsets: np.ndarray, postings: np.ndarray, gram_counts: np.ndarray):
+        self.table = table
+        self.hashes = hashes  # normalized title hashes, sorted, with the row of each in hash_rows
+        self.hash_rows = hash_rows
+        self.grams = grams  # distinct trigrams, sorted; postings[gram_offsets[i]:gram_offsets[i + 1]] hold them
+        self.gram_offsets = gram_offsets
+        self.postings = postings
+        self.gram_counts = gram_counts  # distinct trigrams per title
+        self._artists = {}
+
+    @classmethod
+    def build(cls, table: LibraryTable) -> "TrackLookup":
+        count = len(table)
+        titles = [normalize(title) for start in range(0, count, 50_000)
+                  for title in table.strings("title", start, min(start + 50_000, count))]
+
+        hashes = np.array([_hash(title) for title in titles], dtype=np.int64)
+        hash_rows = np.argsort(hashes, kind='stable')
+
+        # Every title's trigrams in one pass over all the titles' code points, with a 0 between
+        # titles so no trigram spans two of them
+        codes = np.frombuffer("\0".join(f" {title} " for title in titles).encode('utf-32-le', 'surrogatepass'),
+                              dtype=np.uint32)
+        grams = _trigrams(codes)
+        valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+        rows = np.repeat(np.arange(count, dtype=np.int64), [len(title) + 3 for title in titles])[:len(grams)]
+        grams, rows = grams[valid], rows[valid]
+
+        distinct, gram_ids = np.unique(grams, return_inverse=True)
+        # Each (trigram, row) once; sorted by hand, np.unique hashes here and is much slower
+        pairs = np.sort(gram_ids.astype(np.int64) * max(count, 1) + rows)
+        first = np.ones(len(pairs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        pairs = pairs[first]
+        gram_ids, rows = pairs // max(count, 1), pairs % max(count, 1)
+        gram_offsets = np.zeros(len(distinct) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(distinct)), out=gram_offsets[1:])
+        gram_counts = np.bincount(rows, minlength=count).astype(np.int32)
+        return cls(table, hashes[hash_rows], hash_rows.astype(np.int32), distinct, gram_offsets,
+                   rows.astype(np.int32), gram_counts)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, hashes=self.hashes, hash_rows=self.hash_rows, grams=self.grams,
+                 gram_offsets=self.gram_offsets, postings=self.postings, gram_counts=self.gram_counts,
+                 version=np.array(LOOKUP_VERSION))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, table: LibraryTable) -> Optional["TrackLookup"]:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != LOOKUP_VERSION:
+                    return None
+                return cls(table, data["hashes"], data["hash_rows"], data["grams"], data["gram_offsets"],
+                           data["postings"], data["gram_counts"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def __len__(self) -> int:
+        return len(self.gram_counts)
+
+    # (normalized artist, its trigrams) of a row, worked out once per artist
+    def _artist(self, row: int) -> Tuple[str, np.ndarray]:
+        code = int(self.table.column("artist")[row])
+        if code not in self._artists:
+            name = normalize(self.table.category("artist", row))
+            self._artists[code] = (name, _text_trigrams(name))
+        return self._artists[code]
+
+    # Rows whose normalized title is exactly `title`, in library order
+    def exact(self, title: str) -> np.ndarray:
+        title = normalize(title)
+        h = _hash(title)
+        rows = np.sort(self.hash_rows[np.searchsorted(self.hashes, h, 'left'):np.searchsorted(self.hashes, h, 'right')])
+        # A hash collision must not pass for a match
+        return np.array([row for row in rows.tolist() if normalize(self.table.string("title", row)) == title],
+                        dtype=np.int64)
+
+    # Up to `limit` rows whose titles share the most trigrams with `title` (relative to their length),
+    # as (rows, shared trigram counts, trigrams in the title)
+    def _near_titles(self, title: str, limit: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        query = _text_trigrams(normalize(title))
+        found = np.searchsorted(self.grams, query)
+        if len(self.grams):
+            found = found[(found < len(self.grams)) & (self.grams[np.minimum(found, len(self.grams) - 1)] == query)]
+        if len(found) == 0 or len(self.grams) == 0:
+            return _NO_ROWS, _NO_ROWS, len(query)
+        rows = np.concatenate([self.postings[self.gram_offsets[i]:self.gram_offsets[i + 1]] for i in found.tolist()])
+        shared = np.bincount(rows, minlength=len(self))
+        rows = np.flatnonzero(shared)
+        shared = shared[rows]
+        if len(rows) > limit:
+            top = np.argpartition(-shared / (len(query) + self.gram_counts[rows]), limit)[:limit]
+            rows, shared = rows[top], shared[top]
+        return rows, shared, len(query)
+
+    # How `query` can be read: the whole text as a title, or "Artist - Title" split at any separator
+    @staticmethod
+    def _readings(query: str) -> List[Tuple[Optional[str], str]]:
+        readings = [(None, query)]
+        parts = query.split(ARTIST_SEPARATOR)
+        for i in range(1, len(parts)):
+            readings.append((ARTIST_SEPARATOR.join(parts[:i]), ARTIST_SEPARATOR.join(parts[i:])))
+        return readings
+
+    # Best matching rows for `query`, best first, as (row, score). Copies of a song (same title and
+    # artist) are listed once.
+    @metrics.timed("lookup_search")
+    def search(self, query: str, limit: int = 5) -> List[Tuple[int, float]]:
+        best = {}
+        for artist, title in self._readings(query):
+            rows, shared, total = self._near_titles(title, max(limit * 20, 100))
+            total = total + self.gram_counts[rows]
+            if artist is not None:
+                # One Dice score over the trigrams of both fields
+                artist_grams = _text_trigrams(normalize(artist))
+                row_grams = [self._artist(row)[1] for row in rows.tolist()]
+                shared = shared + np.array([len(np.intersect1d(artist_grams, grams, assume_unique=True))
+                                            for grams in row_grams], dtype=np.int64)
+                total = total + len(artist_grams) + np.array([len(grams) for grams in row_grams], dtype=np.int64)
+            for row, score in zip(rows.tolist(), (2.0 * shared / np.maximum(total, 1)).tolist()):
+                if score > best.get(row, 0.0):
+                    best[row] = score
+
+        ranked, seen = [], set()
+        for row, score in sorted(best.items(), key=lambda item: (-item[1], item[0])):
+            key = (normalize(self.table.string("title", row)), self._artist(row)[0])
+            if key not in seen:
+                seen.add(key)
+                ranked.append((row, score))
+                if len(ranked) == limit:
+                    break
+        return ranked
+
+    # (row, candidates): the row `query` stands for, or None with the songs it could mean, best first.
+    # Exact title matches come first ("Artist - Title" narrowing them down by artist) and score 1,
+    # then near matches.
+    @metrics.timed("lookup_resolve")
+    def resolve(self, query: str, limit: int = 5) -> Tuple[Optional[int], List[Tuple[int, float]]]:
+        if not normalize(query):
+            return None, []
+        exact = {}
+        for artist, title in self._readings(query):
+            rows = self.exact(title)
+            if artist is not None:
+                rows = [row for row in rows.tolist() if self._artist(row)[0] == normalize(artist)]
+            for row in np.asarray(rows, dtype=np.int64).tolist():
+                exact.setdefault(row, artist is not None)
+        if exact:
+            # An exact "Artist - Title" beats the same text taken as a title
+            named = sorted(row for row, by_artist in exact.items() if by_artist)
+            rows = named or sorted(exact)
+            if len({self._artist(row)[0] for row in rows}) == 1:
+                return rows[0], []
+            candidates, seen = [], set()
+            for row in rows:
+                if self._artist(row)[0] not in seen:
+                    seen.add(self._artist(row)[0])
+                    candidates.append((row, 1.0))
+            return None, candidates[:limit]
+
+        candidates = [(row, score) for row, score in self.search(query, limit) if score >= MIN_SCORE]
+        if candidates and candidates[0][1] >= MATCH_SCORE and (
+                len(candidates) == 1 or candidates[0][1] - candidates[1][1] >= MATCH_MARGIN):
+            return candidates[0][0], candidates
+        return None, candidates
+
+
+def describe(table: LibraryTable, row: int) -> str:
+    artist = table.category("artist", row) or "Unknown artist"
+    album = table.category("album", row)
+    return f"{artist}{ARTIST_SEPARATOR}{table.string('title', row)}" + (f" ({album})" if album else "")
+
+
+# What to tell the user when `query` didn't pick a song, given the candidates resolve returned
+def candidates_message(query: str, candidates: List[Tuple[int, float]]) -> str:
+    if not candidates:
+        return f"No song matches '{query}'."
+    if candidates[0][1] == 1.0:
+        return f"'{query}' could be several songs, pass one as \"Artist - Title\":"
+    return f"No song is called '{query}', the closest matches are:"
+
+
+# Row for a title given on the command line. Near matches that are used say so, and when the title
+# could mean several songs they are listed instead. Returns None when no song was picked.
+def find_row(lookup: TrackLookup, query: str) -> Optional[int]:
+    row, candidates = lookup.resolve(query)
+    if row is not None:
+        if candidates:
+            print(f"'{query}' matched '{describe(lookup.table, row)}'.")
+        return row
+    if candidates:
+        print(candidates_message(query, candidates))
+        for i, (candidate, score) in enumerate(candidates, 1):
+            print(f"  {i}. {describe(lookup.table, candidate)}  ({score:.0%} match)")
+    return None
+
+
+# Loads the lookup saved in a store directory, or builds (and saves) it when it is missing or
+# doesn't belong to the table, the same way as the similarity index
+@metrics.timed("lookup_index")
+def load_or_build_lookup(table: LibraryTable, store_dir: Optional[str] = None) -> TrackLookup:
+    path = os.path.join(store_dir, LOOKUP_FILE) if store_dir else None
+    if path and os.path.exists(path):
+        lookup = TrackLookup.load(path, table)
+        if lookup is not None and len(lookup) == len(table):
+            return lookup
+
+    lookup = TrackLookup.build(table)
+    if path and os.path.isdir(store_dir):
+        try:
+            lookup.save(path)
+        except OSError as e:
+            print(f"Could not save lookup index: {e}")
+    return lookup
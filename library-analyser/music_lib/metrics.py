@@ -0,0 +1,186 @@
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+TRACK_TOTAL_STAGES = ("tag_read", "read_file", "decode_file", "extract_features")
+
+
+# Timers and counters around the hot paths (tag reads, decoding, each feature, cache and store I/O,
+# playlists). Collection is off unless enable() is called, so the timers cost next to nothing in
+# normal runs. Samples are (stage, seconds, track path or None).
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.samples = []
+        self.counters = Counter()
+        self.sections = {}  # whole reports from other parts, e.g. the analysis pipeline's stage stats
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, item: Optional[str] = None):
+        if item is None:
+            item = getattr(self._local, "item", None)
+        with self._lock:
+            self.samples.append((stage, seconds, item))
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    @contextlib.contextmanager
+    def _timer(self, stage: str, item: Optional[str]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, item)
+
+    def timer(self, stage: str, item: Optional[str] = None):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timer(stage, item)
+
+    # Stages timed inside this block are charged to the track unless they name one themselves
+    @contextlib.contextmanager
+    def track(self, item: str):
+        previous = getattr(self._local, "item", None)
+        self._local.item = item
+        try:
+            yield
+        finally:
+            self._local.item = previous
+
+    # Hands over everything collected so far, worker processes send this back with their results
+    def drain(self):
+        with self._lock:
+            samples, counters = self.samples, dict(self.counters)
+            self.samples, self.counters = [], Counter()
+        return samples, counters
+
+    def merge(self, drained):
+        samples, counters = drained
+        with self._lock:
+            self.samples.extend(samples)
+            self.counters.update(counters)
+
+    def report(self, slowest: int = 10) -> dict:
+        by_stage = defaultdict(list)
+        by_track = defaultdict(lambda: defaultdict(float))
+        for stage, seconds, item in self.samples:
+            by_stage[stage].append(seconds)
+            if item is not None:
+                by_track[item][stage] += seconds
+
+        stages = {}
+        for stage, values in sorted(by_stage.items()):
+            values = np.asarray(values)
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            stages[stage] = {
+                "count": len(values),
+                "total": float(values.sum()),
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(values.max()),
+            }
+
+        # Only the outermost per-track stages add up to a track's total, the rest are timed inside them
+        totals = sorted(
+            ((sum(s.get(stage, 0.0) for stage in TRACK_TOTAL_STAGES), item, s) for item, s in by_track.items()),
+            reverse=True
+        )
+        return {
+            "stages": stages,
+            "counters": dict(self.counters),
+            "slowest_tracks": [
+                {"path": item, "total": total, "stages": dict(s)} for total, item, s in totals[:slowest]
+            ],
+            "peak_rss_mb": peak_rss_mb(),
+            **self.sections,
+        }
+
+
+# Peak resident memory of this process and of the biggest worker process, in MB
+def peak_rss_mb() -> Optional[dict]:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+
+METRICS = Metrics()
+
+
+def enable():
+    METRICS.enabled = True
+
+
+def timer(stage: str, item: Optional[str] = None):
+    return METRICS.timer(stage, item)
+
+
+# For stages whose code doesn't fit in a with block
+def record(stage: str, seconds: float, item: Optional[str] = None):
+    if METRICS.enabled:
+        METRICS.add(stage, seconds, item)
+
+
+# Decorator form of timer() for whole functions
+def timed(stage: str):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: int = 1):
+    METRICS.count(name, n)
+
+
+def section(name: str, value: dict):
+    if METRICS.enabled:
+        METRICS.sections[name] = value
+
+
+def track(item: str):
+    return METRICS.track(item) if METRICS.enabled else contextlib.nullcontext()
+
+
+def write_metrics(path: str, slowest: int = 10):
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(METRICS.report(slowest), f, indent=2)
+        print(f"Metrics written to {path}")
+    except OSError as e:
+        print(f"Could not write metrics to '{path}': {e}")
+
+
+# Short per-stage summary for the end of a --profile run
+def print_summary():
+    report = METRICS.report()
+    print("\n--- Stage timings ---")
+    for stage, values in report["stages"].items():
+        print(f"{stage:<20} {values['count']:>7} x  total {values['total']:8.2f}s  "
+              f"p50 {values['p50'] * 1000:8.1f} ms  max {values['max'] * 1000:8.1f} ms")
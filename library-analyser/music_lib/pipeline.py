@@ -0,0 +1,453 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+
+# How the analysis pipeline is sized. Reading and decoding run on threads in the main process
+# (file reads and libsndfile/soxr release the GIL), feature math runs on `jobs` worker processes.
+# prefetch=0 turns the read and decode stages off and every worker opens its own file.
+@dataclass
+class PipelineConfig:
+    io_threads: int = 2
+    decode_threads: int = 2
+    prefetch: int = 8  # files read ahead of the decoders
+    max_prefetch_mb: float = 64.0  # bigger files (long mixes) are streamed by the worker instead
+    max_decoded_mb: float = 128.0  # decoded audio waiting for or being sent to the workers
+
+
+_DONE = object()
+_RECOVER = object()
+
+
+# A bounded queue that remembers how full it was every time something went in or out
+class _DepthQueue(queue.Queue):
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.samples = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+
+    def _sample(self):
+        depth = self._qsize()
+        self.samples += 1
+        self.depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def _put(self, item):
+        super()._put(item)
+        self._sample()
+
+    def _get(self):
+        item = super()._get()
+        self._sample()
+        return item
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.maxsize,
+            "mean_depth": self.depth_sum / self.samples if self.samples else 0.0,
+            "max_depth": self.max_depth,
+        }
+
+
+# Busy time of one stage, plus the time its workers sat waiting for input (starved)
+# or waiting for room downstream (backpressure)
+class _StageStats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float = 0.0, starved: float = 0.0, blocked: float = 0.0, items: int = 0):
+        with self._lock:
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.items += items
+
+    def stats(self, elapsed: float) -> dict:
+        capacity = elapsed * self.workers
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy": self.busy,
+            "utilization": self.busy / capacity if capacity > 0 else 0.0,
+            "starved": self.starved,
+            "blocked": self.blocked,
+        }
+
+
+# Caps the bytes held between two stages. A single item bigger than the whole budget still gets
+# through once nothing else is held, so one long track can't stall the pipeline.
+class _ByteBudget:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int, stopped: threading.Event) -> bool:
+        with self._cond:
+            while self.used and self.used + size > self.limit:
+                if stopped.is_set():
+                    return False
+                self._cond.wait(0.1)
+            self.used += size
+            return True
+
+    def release(self, size: int):
+        if size:
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+
+
+# Runs in the worker processes, the busy time comes back with the result
+def _timed_call(fn: Callable, task):
+    start = time.perf_counter()
+    result = fn(task)
+    return result, time.perf_counter() - start
+
+
+# A read -> decode -> compute producer/consumer pipeline. Every stage has its own workers and hands
+# work on through a bounded queue, so a slow disk keeps a few files buffered ahead of the decoders,
+# and a stage that gets ahead blocks until the next one catches up instead of filling memory.
+#
+#   read(item) -> raw data, or None to leave the item to the compute stage untouched
+#   decode(item, data) -> picklable task for compute (data is None when read passed on it)
+#   compute(task) -> result, called in a worker process so it has to be a module level function
+#   weight(task) -> bytes the task holds, decoded tasks in flight are capped at config.max_decoded_mb
+#
+# Yields (item, result, error) in completion order, error is the exception raised by any stage.
+# After the last item `stats` holds each stage's utilization and each queue's depth.
+class StagedPipeline:
+    def __init__(self, read: Callable, decode: Callable, compute: Callable, jobs: int,
+                 config: Optional[PipelineConfig] = None, mp_context=None, weight: Optional[Callable] = None):
+        self.read = read
+        self.decode = decode
+        self.compute = compute
+        self.weight = weight or (lambda task: 0)
+        self.jobs = jobs
+        self.config = config or PipelineConfig()
+        self.mp_context = mp_context
+        self.stats = None
+
+    def run(self, items: Iterable) -> Iterator[Tuple[object, object, Optional[BaseException]]]:
+        config = self.config
+        items = list(items)
+        prefetching = config.prefetch > 0
+        io_threads = max(1, config.io_threads) if prefetching else 0
+        decode_threads = max(1, config.decode_threads) if prefetching else 0
+
+        todo = iter(items)
+        todo_lock = threading.Lock()
+        fetched = _DepthQueue(max(1, config.prefetch))
+        # Decoded audio is the big thing to hold, keep just enough to hand every worker its next track.
+        # A count alone doesn't bound it (a long track is tens of MB), so the bytes from decode until
+        # the worker is done with the task are capped as well.
+        decoded = _DepthQueue(max(1, self.jobs) if prefetching else 0)
+        budget = _ByteBudget(config.max_decoded_mb * 1024 * 1024)
+        results = queue.Queue()
+        stopped = threading.Event()
+        stages = {
+            "read": _StageStats(io_threads),
+            "decode": _StageStats(decode_threads),
+            "compute": _StageStats(self.jobs),
+        }
+
+        def put(q, value, stage):
+            start = time.perf_counter()
+            while not stopped.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            stages[stage].add(blocked=time.perf_counter() - start)
+
+        def get(q, stage):
+            start = time.perf_counter()
+            while not stopped.is_set():
+                try:
+                    value = q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    pass
+            else:
+                value = _DONE
+            stages[stage].add(starved=time.perf_counter() - start)
+            return value
+
+        def reader():
+            while not stopped.is_set():
+                with todo_lock:
+                    item = next(todo, _DONE)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    value = (item, self.read(item), None)
+                except Exception as e:
+                    value = (item, None, e)
+                stages["read"].add(busy=time.perf_counter() - start, items=1)
+                put(fetched, value, "read")
+            # The last reader to finish tells every decoder to stop
+            if readers_left.decrement() == 0:
+                for _ in range(decode_threads):
+                    put(fetched, _DONE, "read")
+
+        def decoder():
+            while not stopped.is_set():
+                value = get(fetched, "decode")
+                if value is _DONE:
+                    break
+                item, data, error = value
+                if error is None:
+                    start = time.perf_counter()
+                    try:
+                        value = (item, self.decode(item, data), None)
+                    except Exception as e:
+                        value = (item, None, e)
+                    stages["decode"].add(busy=time.perf_counter() - start, items=1)
+                    del data  # the file's bytes aren't needed while this waits for room
+                    if value[1] is not None:
+                        start = time.perf_counter()
+                        if not budget.acquire(self.weight(value[1]), stopped):
+                            break
+                        stages["decode"].add(blocked=time.perf_counter() - start)
+                put(decoded, value, "decode")
+            put(decoded, _DONE, "decode")
+
+        threads = []
+        if prefetching:
+            readers_left = _Countdown(io_threads)
+            threads += [threading.Thread(target=reader, name=f"pipeline-read-{i}", daemon=True)
+                        for i in range(io_threads)]
+            threads += [threading.Thread(target=decoder, name=f"pipeline-decode-{i}", daemon=True)
+                        for i in range(decode_threads)]
+        else:
+            # Without prefetching every item goes straight to the workers
+            for item in items:
+                try:
+                    decoded.put((item, self.decode(item, None), None))
+                except Exception as e:
+                    decoded.put((item, None, e))
+            decoded.put(_DONE)
+            decode_threads = 1
+
+        # Two tasks per worker in flight: one running and one waiting, so no worker sits idle
+        # while the next task is pickled over to it
+        slots = threading.Semaphore(2 * self.jobs)
+        remaining = len(items)
+        finished_decoders = 0
+        pool = _WorkerPool(self.jobs, self.mp_context)
+        started = time.perf_counter()
+        try:
+            # The workers are forked on the first submit. That has to happen before the read and decode
+            # threads start, a child forked while one of them holds a lock (an import, metrics) hangs.
+            pool.start()
+            for thread in threads:
+                thread.start()
+
+            def dispatch():
+                nonlocal finished_decoders
+                while finished_decoders < decode_threads and not stopped.is_set():
+                    value = get(decoded, "compute")
+                    if value is _DONE:
+                        finished_decoders += 1
+                        continue
+                    item, task, error = value
+                    if error is not None:
+                        results.put((item, None, error))
+                        continue
+                    size = self.weight(task) if prefetching else 0
+                    start = time.perf_counter()
+                    while not slots.acquire(timeout=0.1):
+                        if stopped.is_set():
+                            return
+                    stages["compute"].add(blocked=time.perf_counter() - start)
+
+                    def done(size=size):
+                        slots.release()
+                        budget.release(size)
+
+                    error = pool.submit(self.compute, item, task, results, on_done=done, stopped=stopped)
+                    if error is not None:
+                        done()
+                        results.put((item, None, error))
+
+            dispatcher = threading.Thread(target=dispatch, name="pipeline-dispatch", daemon=True)
+            dispatcher.start()
+            try:
+                while remaining:
+                    value = results.get()
+                    if value is _RECOVER:
+                        pool.recover(self.compute, results)
+                        continue
+                    if len(value) == 3:
+                        remaining -= 1
+                        yield value
+                        continue
+                    item, task, future, isolated = value
+                    try:
+                        result, busy = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died (killed for memory, or a decoder crashed on a corrupt file) and took
+                        # every task in flight with it. They all run again, one at a time, and only a task
+                        # that crashes while running alone fails.
+                        pool.crashed(item, task, isolated)
+                        pool.recover(self.compute, results)
+                        if isolated:
+                            remaining -= 1
+                            yield item, None, RuntimeError(f"the worker process crashed ({e})")
+                        continue
+                    except Exception as e:
+                        result, error = None, e
+                    else:
+                        error = None
+                        stages["compute"].add(busy=busy, items=1)
+                    if isolated:
+                        pool.isolated_done()
+                        pool.recover(self.compute, results)
+                    remaining -= 1
+                    yield item, result, error
+            except BaseException:
+                # Don't sit through the rest of the queue on Ctrl-C (or when the caller stops early)
+                stopped.set()
+                pool.shutdown(wait=False)
+                raise
+            finally:
+                stopped.set()
+                dispatcher.join()
+                for thread in threads:
+                    thread.join()
+        finally:
+            pool.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - started
+        self.stats = {
+            "seconds": elapsed,
+            "stages": {name: stage.stats(elapsed) for name, stage in stages.items() if stage.workers},
+            "queues": {"read->decode": fetched.stats(), "decode->compute": decoded.stats()}
+            if prefetching else {},
+        }
+
+
+# Worker processes started once the read and decode threads are running can't be forked safely,
+# a child forked while a thread holds a lock hangs. forkserver (or spawn) starts them from a clean process.
+def thread_safe_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+# The process pool behind the compute stage. When a worker dies the pool is broken for good, so it
+# is replaced and the tasks that were in flight are run again one at a time ("isolated"): while a
+# suspect runs alone nothing else is submitted, so a crash can only be that task's.
+class _WorkerPool:
+    def __init__(self, jobs: int, mp_context=None):
+        self.jobs = jobs
+        self.mp_context = mp_context
+        self.executor = None
+        self.generation = 0
+        self.in_flight = 0  # tasks in the current shared pool without a result yet
+        self.broken = False
+        self.suspects = []
+        self.isolating = False  # no shared submits until every suspect has run alone
+        self.running_isolated = False
+        # Reentrant: a future that is already done runs its callback right inside add_done_callback
+        self._lock = threading.RLock()
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=self.mp_context)
+        self.executor.submit(int).result()
+
+    # Submits a task to the shared pool, waiting while suspects are being isolated. Results go to
+    # `results` as (item, task, future, isolated). Returns the error when the task can't be submitted.
+    def submit(self, compute: Callable, item, task, results: queue.Queue, on_done: Callable,
+               stopped: threading.Event) -> Optional[BaseException]:
+        while not stopped.is_set():
+            with self._lock:
+                if not self.isolating:
+                    try:
+                        future = self.executor.submit(_timed_call, compute, task)
+                    except BrokenProcessPool:
+                        # The pool broke (maybe an idle worker was killed), this task waits with the suspects
+                        # and the main loop is woken up to replace the pool
+                        self.broken = self.isolating = True
+                        self.suspects.append((item, task))
+                        on_done()
+                        results.put(_RECOVER)
+                        return None
+                    except RuntimeError as e:  # executor already shut down
+                        return e
+                    self.in_flight += 1
+                    generation = self.generation
+
+                    def done(f, item=item, task=task, generation=generation):
+                        with self._lock:
+                            if generation == self.generation:
+                                self.in_flight -= 1
+                        on_done()
+                        results.put((item, task, f, False))
+
+                    future.add_done_callback(done)
+                    return None
+            time.sleep(0.05)
+        return None
+
+    # A task's worker died: tasks from the shared pool become suspects, an isolated task has failed
+    def crashed(self, item, task, isolated: bool):
+        with self._lock:
+            self.broken = self.isolating = True
+            if isolated:
+                self.running_isolated = False
+            else:
+                self.suspects.append((item, task))
+
+    def isolated_done(self):
+        with self._lock:
+            self.running_isolated = False
+
+    # Once every task of a broken pool is accounted for, starts a fresh pool, then runs the next
+    # suspect alone, or goes back to normal when none are left
+    def recover(self, compute: Callable, results: queue.Queue):
+        with self._lock:
+            if self.broken:
+                if self.in_flight > 0:
+                    return  # more results from the broken pool are still on their way
+                self.executor.shutdown(wait=False)
+                # Replacement workers are started while the read and decode threads run
+                self.executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=thread_safe_context())
+                self.generation += 1
+                self.broken = False
+            if self.running_isolated:
+                return
+            if not self.suspects:
+                self.isolating = False
+                return
+            item, task = self.suspects.pop(0)
+            self.running_isolated = True
+            future = self.executor.submit(_timed_call, compute, task)
+        future.add_done_callback(lambda f: results.put((item, task, f, True)))
+
+    def shutdown(self, wait: bool):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class _Countdown:
+    def __init__(self, value: int):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def decrement(self) -> int:
+        with self._lock:
+            self.value -= 1
+            return self.value
@@ -1,9 +1,23 @@
 import os
-from typing import List, Optional
+from typing import List, Optional, Union
 from .scanner import Song
-from .analyser import get_mood, get_tempo, get_energy
+from .analyser import analyze_song
 import numpy as np
 from .analyser import get_mood_score
+from .store import LibraryTable
+from .query import Query, QueryError, parse_query, run_queries, run_query
+from . import metrics
+
+
+# Playlists can be built from a list of songs or straight from a (memory-mapped) LibraryTable,
+# either way the selection itself runs on the feature columns
+Library = Union[List[Song], LibraryTable]
+
+
+def _as_table(songs: Library) -> LibraryTable:
+    if isinstance(songs, LibraryTable):
+        return songs
+    return LibraryTable.from_songs(songs)
 
 
 def _write_playlist_file(songs: List[Song], output_file: str, playlist_name: str = "playlist") -> Optional[str]:
@@ -72,12 +86,28 @@ SCENARIO_DEFS = {
         "max_energy": 0.3
     }
 }
+# Every scenario is a query: songs of one of its genres, or songs whose tempo and energy fit its ranges,
+# best mood score first
+def _scenario_query(params: dict) -> str:
+    genres = ", ".join(f'"{g}"' for g in params["genres"])
+
+    def bounds(name):
+        low = params.get(f"min_{name}", 0)
+        if f"max_{name}" in params:
+            return f"{name} {low}..{params[f'max_{name}']}"
+        return f"{name} >= {low}"
+
+    return f"genre in ({genres}) or ({bounds('tempo')} and {bounds('energy')}) order by score desc"
+
+
+SCENARIO_QUERIES = {name: _scenario_query(params) for name, params in SCENARIO_DEFS.items()}
+
+
 # A general function to create playlists based on genre
-def create_genre_playlist(songs: List[Song], genre: str, output_file: str) -> Optional[str]:
-    matching_songs = [
-        song for song in songs
-        if song.genre and genre.lower() in song.genre.lower()
-    ]
+@metrics.timed("playlist_genre")
+def create_genre_playlist(songs: Library, genre: str, output_file: str) -> Optional[str]:
+    table = _as_table(songs)
+    matching_songs = table.songs(run_query(table, Query(where=("match", "genre", "~", genre))))
 
     if not matching_songs:
         print(f"No songs found for the genre '{genre}'.")
@@ -88,53 +118,62 @@ def create_genre_playlist(songs: List[Song], genre: str, output_file: str) -> Op
     return _write_playlist_file(matching_songs, output_file, f"genre '{genre}' playlist")
 
 # Mood Transition Playlist
+# Walks from the start song to the end song through the tracks in between, in small steps
+# through (tempo, energy, centroid, chroma, mood score) so the mood changes gradually
+@metrics.timed("playlist_mood_transition")
 def create_mood_transition_playlist(
-    songs: List[Song],
+    songs: Library,
     start_song: Song,
     end_song: Song,
     output_file: str,
-    max_songs: int = 10
+    max_songs: int = 10,
+    index=None,
+    start_row: Optional[int] = None,
+    end_row: Optional[int] = None
 ) -> Optional[str]:
+    from .similarity import SimilarityIndex, plan_transition
 
-    for song in [start_song, end_song]:
-        if song.mood is None:
-            song.mood = get_mood(song.path)
-        if song.tempo is None:
-            song.tempo = get_tempo(song.path)
-        if song.score is None:
-            song.score = get_mood_score(song)
+    # A stored table can't be re-analyzed, only songs from a plain list get their gaps filled in
+    if not isinstance(songs, LibraryTable):
+        for song in [start_song, end_song]:
+            if song.mood is None or song.tempo is None:
+                analyze_song(song)
+            if song.score is None:
+                song.score = get_mood_score(song)
 
     if start_song.mood is None or end_song.mood is None:
         print("Could not determine mood for start or end song. Cannot create playlist.")
         return None
 
-    intermediary_songs = [s for s in songs if s.path not in [start_song.path, end_song.path]]
-
-    start_mood_songs = [s for s in intermediary_songs if s.mood == start_song.mood ]
-    end_mood_songs = [s for s in intermediary_songs if s.mood == end_song.mood ]
-
-    for s in start_mood_songs + end_mood_songs:
-        if s.tempo is None:
-            s.tempo = get_tempo(s.path)
+    table = _as_table(songs)
+    if index is None:
+        index = SimilarityIndex.build(table)
 
-    half = (max_songs - 2) // 2
-    start_mood_songs_sorted = sorted(start_mood_songs, key=lambda s: s.score, reverse=True)[:half]
-    end_mood_songs_sorted = sorted(end_mood_songs, key=lambda s: s.score)[:half]
+    # Callers that found the songs through the lookup index pass their rows along
+    if start_row is None:
+        start_row = table.find("path", start_song.path)
+    if end_row is None:
+        end_row = table.find("path", end_song.path)
+    for song, row in [(start_song, start_row), (end_song, end_row)]:
+        if row is None or not index.contains(row):
+            print(f"'{song.title}' has no analyzed features to plan a transition from. Cannot create playlist.")
+            return None
 
-    if len(start_mood_songs_sorted) < half:
-        print(f"Warning: Only {len(start_mood_songs_sorted)} songs found for start mood (needed {half}).")
-    if len(end_mood_songs_sorted) < half:
-        print(f"Warning: Only {len(end_mood_songs_sorted)} songs found for end mood (needed {half}).")
+    steps = max(max_songs - 2, 0)
+    intermediary = table.songs(plan_transition(index, start_row, end_row, steps))
+    if len(intermediary) < steps:
+        print(f"Warning: Only {len(intermediary)} songs available between start and end (needed {steps}).")
 
-    final_playlist = [start_song] + start_mood_songs_sorted + end_mood_songs_sorted + [end_song]
+    final_playlist = [start_song] + intermediary + [end_song]
 
     _print_playlist_stats(final_playlist, "mood transition playlist")
 
     return _write_playlist_file(final_playlist, output_file, "mood transition playlist")
 
 #Creating a scenario for the playlists we designed
+@metrics.timed("playlist_scenario")
 def create_scenario_playlist(
-    songs: List[Song],
+    songs: Library,
     scenario: str,
     output_file: str = None,
     max_songs: int = 10
@@ -144,37 +183,22 @@ def create_scenario_playlist(
         print(f"Scenario '{scenario}' is not defined.")
         return None
 
-    for s in songs:
-        if s.tempo is None:
-            s.tempo = get_tempo(s.path)
-        if s.energy is None:
-            s.energy = get_energy(s.path)
-        if s.mood is None:
-            s.mood = get_mood(s.path)
-        if s.score is None:
-            s.score = get_mood_score(s)
-
-    params = SCENARIO_DEFS[scenario]
-
-    filtered_songs = []
-    for s in songs:
-        #Prioritise genres which fit the scenario and then move onto metadata based filtering
-        if s.genre and any(s.genre.lower() == g.lower() for g in params["genres"]):
-            filtered_songs.append(s)
-        else:
-            min_tempo = params.get("min_tempo", 0)
-            max_tempo = params.get("max_tempo", float("inf"))
-            min_energy = params.get("min_energy", 0)
-            max_energy = params.get("max_energy", float("inf"))
-            if s.tempo is not None and s.energy is not None:
-                if min_tempo <= s.tempo <= max_tempo and min_energy <= s.energy <= max_energy:
-                    filtered_songs.append(s)
-
-    if not filtered_songs:
+    # A stored table can't be re-analyzed, only a plain list of songs gets its gaps filled in
+    if not isinstance(songs, LibraryTable):
+        for s in songs:
+            if s.tempo is None or s.energy is None or s.mood is None:
+                analyze_song(s)
+            if s.score is None:
+                s.score = get_mood_score(s)
+
+    table = _as_table(songs)
+    filtered = run_query(table, SCENARIO_QUERIES[scenario], limit=max_songs)
+
+    if filtered.size == 0:
         print(f"No songs matched the '{scenario}' scenario criteria.")
         return None
 
-    filtered_songs_sorted = sorted(filtered_songs, key=lambda x: x.score or 0, reverse=True)[:max_songs]
+    filtered_songs_sorted = table.songs(filtered)
 
     if not output_file:
         output_dir = "./scenario_playlists"
@@ -187,4 +211,171 @@ def create_scenario_playlist(
 
     _print_playlist_stats(filtered_songs_sorted, f"scenario '{scenario}' playlist")
 
-    return _write_playlist_file(filtered_songs_sorted, output_file, f"scenario '{scenario}' playlist")
\ No newline at end of file
+    return _write_playlist_file(filtered_songs_sorted, output_file, f"scenario '{scenario}' playlist")
+
+# Playlist from a query, see music_lib/query.py for the syntax. max_songs overrides the query's limit.
+@metrics.timed("playlist_query")
+def create_query_playlist(songs: Library, query: str, output_file: str,
+                          max_songs: Optional[int] = None) -> Optional[str]:
+    try:
+        parsed = parse_query(query)
+    except QueryError as e:
+        print(f"Invalid query: {e}")
+        return None
+
+    table = _as_table(songs)
+    rows = run_query(table, parsed, limit=max_songs)
+    if rows.size == 0:
+        print(f"No songs matched the query '{query}'.")
+        return None
+
+    matching_songs = table.songs(rows)
+
+    _print_playlist_stats(matching_songs, "query playlist")
+
+    return _write_playlist_file(matching_songs, output_file, "query playlist")
+
+# Tracks that sound most like the seed song: nearest neighbours in (tempo, energy, centroid, chroma, mood score)
+@metrics.timed("playlist_similarity")
+def create_similarity_playlist(
+    songs: Library,
+    seed_song: Song,
+    output_file: str,
+    max_songs: int = 10,
+    radius: Optional[float] = None,
+    index=None,
+    row: Optional[int] = None
+) -> Optional[str]:
+    from .similarity import SimilarityIndex
+
+    table = _as_table(songs)
+    if index is None:
+        index = SimilarityIndex.build(table)
+
+    if row is None:
+        row = table.find("path", seed_song.path)
+    if row is None or not index.contains(row):
+        print(f"'{seed_song.title}' has no analyzed features to compare against.")
+        return None
+
+    if radius is None:
+        rows, _ = index.knn(row, max_songs - 1)
+    else:
+        rows, _ = index.within(row, radius)
+        rows = rows[:max_songs - 1]
+
+    if rows.size == 0:
+        print(f"No similar songs found for '{seed_song.title}'.")
+        return None
+
+    final_playlist = [seed_song] + table.songs(rows)
+
+    _print_playlist_stats(final_playlist, "similarity playlist")
+
+    return _write_playlist_file(final_playlist, output_file, "similarity playlist")
+
+
+PLAYLIST_KINDS = ("genre", "scenario", "query", "similar_to", "mood_transition")
+
+
+# Where a batch playlist goes when its spec has no "output": scenarios keep their usual folder,
+# genres get one next to it. Query, similarity and transition playlists need an explicit output.
+def playlist_output(spec: dict) -> Optional[str]:
+    if spec.get("output"):
+        return spec["output"]
+    if "scenario" in spec:
+        return os.path.join("scenario_playlists", f"{str(spec['scenario']).lower()}.m3u")
+    if "genre" in spec:
+        return os.path.join("genre_playlists", f"{spec['genre']}.m3u")
+    return None
+
+
+# Builds many playlists from one library load. Every spec is a dict with one of PLAYLIST_KINDS
+# ({"scenario": "gym"}, {"genre": "Rock"}, {"query": "..."}, {"similar_to": "Title"},
+# {"mood_transition": ["Start", "End"]}) plus optional "output", "max_songs" and "radius".
+# All the filter playlists are answered by one run_queries pass that shares conditions and sort
+# orders, similarity and transition playlists share one index (and one title lookup), and the files
+# are written at the end.
+# Returns the written path (or None) for every spec, in order.
+@metrics.timed("playlist_batch")
+def create_playlists(songs: Library, specs: List[dict], index=None, lookup=None) -> List[Optional[str]]:
+    from .lookup import TrackLookup, find_row
+    from .similarity import SimilarityIndex, plan_transition
+
+    table = _as_table(songs)
+    planned = [None] * len(specs)  # (songs, output file, playlist name) per spec
+    queries, query_positions = [], []
+
+    for position, spec in enumerate(specs):
+        kinds = [kind for kind in PLAYLIST_KINDS if kind in spec]
+        if len(kinds) != 1:
+            print(f"Playlist #{position + 1} needs exactly one of: {', '.join(PLAYLIST_KINDS)}.")
+            continue
+        kind = kinds[0]
+        output = playlist_output(spec)
+        if output is None:
+            print(f"Playlist #{position + 1} ({kind}) needs an \"output\" file.")
+            continue
+        max_songs = spec.get("max_songs")
+
+        if kind == "genre":
+            queries.append((Query(where=("match", "genre", "~", spec["genre"])), None))
+            query_positions.append((position, output, f"genre '{spec['genre']}' playlist"))
+        elif kind == "scenario":
+            scenario = str(spec["scenario"]).lower()
+            if scenario not in SCENARIO_QUERIES:
+                print(f"Scenario '{scenario}' is not defined.")
+                continue
+            queries.append((parse_query(SCENARIO_QUERIES[scenario]), max_songs or 10))
+            query_positions.append((position, output, f"scenario '{scenario}' playlist"))
+        elif kind == "query":
+            try:
+                queries.append((parse_query(spec["query"]), max_songs))
+            except QueryError as e:
+                print(f"Invalid query '{spec['query']}': {e}")
+                continue
+            query_positions.append((position, output, "query playlist"))
+        else:
+            if index is None:
+                index = SimilarityIndex.build(table)
+            if lookup is None:
+                lookup = TrackLookup.build(table)
+            titles = [spec[kind]] if kind == "similar_to" else list(spec[kind])
+            if kind == "mood_transition" and len(titles) != 2:
+                print("A mood transition needs a start and an end song.")
+                continue
+            rows = [find_row(lookup, title) for title in titles]
+            missing = [t for t, row in zip(titles, rows) if row is None or not index.contains(row)]
+            if missing:
+                print(f"Could not find analyzed songs for: {', '.join(missing)}.")
+                continue
+            max_songs = max_songs or 10
+            if kind == "similar_to":
+                if spec.get("radius") is None:
+                    similar, _ = index.knn(rows[0], max_songs - 1)
+                else:
+                    similar, _ = index.within(rows[0], spec["radius"])
+                    similar = similar[:max_songs - 1]
+                planned[position] = (table.songs([rows[0]] + similar.tolist()), output, "similarity playlist")
+            else:
+                path = plan_transition(index, rows[0], rows[1], max(max_songs - 2, 0))
+                planned[position] = (table.songs([rows[0]] + path.tolist() + [rows[1]]), output,
+                                     "mood transition playlist")
+
+    results = run_queries(table, [q for q, _ in queries], [limit for _, limit in queries])
+    for (position, output, name), rows in zip(query_positions, results):
+        planned[position] = (table.songs(rows), output, name)
+
+    paths = []
+    for plan in planned:
+        if plan is None:
+            paths.append(None)
+            continue
+        playlist_songs, output, name = plan
+        if not playlist_songs:
+            print(f"No songs matched the {name}.")
+            paths.append(None)
+            continue
+        _print_playlist_stats(playlist_songs, name)
+        paths.append(_write_playlist_file(playlist_songs, output, name))
+    return paths
@@ -0,0 +1,301 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import numpy as np
+
+from .store import CATEGORICAL_COLUMNS, SORTED_COLUMNS, LibraryTable
+
+
+# A small filter language for playlists, e.g.
+#   tempo 110..140 and energy > 0.5 and genre in (Rock, Pop) order by score desc limit 30
+#
+# Numeric fields (tempo, energy, score, chroma, centroid, track_no) take `a..b` (inclusive), <, <=, >, >=, = and !=.
+# Text fields (genre, mood, artist, album, tier) take =, != and `in (...)`, all case-insensitive, and `~` for
+# "contains". Values with spaces go in quotes. Conditions combine with and, or, not and parentheses.
+# Numeric conditions are answered from the sorted column indexes and text conditions from the inverted
+# indexes of the store (see LibraryTable.sorted_index/postings), never by looking at every song.
+
+
+class QueryError(ValueError):
+    pass
+
+
+@dataclass
+class Query:
+    where: Optional[tuple] = None  # condition tree, None matches every song
+    order_by: Optional[str] = None
+    descending: bool = False
+    limit: Optional[int] = None
+
+
+KEYWORDS = {"and", "or", "not", "in", "order", "by", "asc", "desc", "limit"}
+NUMERIC_OPS = {"<", "<=", ">", ">=", "=", "!="}
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?)(?![\w])
+      | (?P<op>\.\.|<=|>=|!=|=|<|>|~|\(|\)|,)
+      | "(?P<dq>[^"]*)" | '(?P<sq>[^']*)'
+      | (?P<word>[^\s(),<>=!~"']+)
+    )''', re.VERBOSE)
+
+
+def _tokenize(text: str) -> List[tuple]:
+    tokens, pos = [], 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f"Unexpected character at position {pos}: '{text[pos:pos + 10]}'")
+        pos = match.end()
+        if match.group("number") is not None:
+            tokens.append(("number", float(match.group("number"))))
+        elif match.group("op") is not None:
+            tokens.append(("op", match.group("op")))
+        elif match.group("dq") is not None or match.group("sq") is not None:
+            tokens.append(("string", match.group("dq") if match.group("dq") is not None else match.group("sq")))
+        else:
+            word = match.group("word")
+            tokens.append(("keyword", word.lower()) if word.lower() in KEYWORDS else ("string", word))
+    return tokens
+
+
+# Recursive descent over: or_expr := and_expr (or and_expr)*, and_expr := unary (and unary)*,
+# unary := not unary | ( or_expr ) | condition
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self, kind=None, value=None) -> bool:
+        if self.pos >= len(self.tokens):
+            return False
+        token = self.tokens[self.pos]
+        return (kind is None or token[0] == kind) and (value is None or token[1] == value)
+
+    def take(self, kind=None, value=None):
+        if not self.peek(kind, value):
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else "end of query"
+            raise QueryError(f"Expected {value or kind}, found '{found}'")
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def parse(self) -> Query:
+        query = Query()
+        if self.pos < len(self.tokens) and not self.peek("keyword", "order") and not self.peek("keyword", "limit"):
+            query.where = self.or_expr()
+        if self.peek("keyword", "order"):
+            self.take("keyword", "order")
+            self.take("keyword", "by")
+            query.order_by = self.field()
+            if query.order_by not in SORTED_COLUMNS:
+                raise QueryError(f"Can only order by {', '.join(SORTED_COLUMNS)}")
+            if self.peek("keyword", "desc") or self.peek("keyword", "asc"):
+                query.descending = self.take() == "desc"
+        if self.peek("keyword", "limit"):
+            self.take("keyword", "limit")
+            limit = self.take("number")
+            if limit < 0 or limit != int(limit):
+                raise QueryError("limit must be a whole number")
+            query.limit = int(limit)
+        if self.pos < len(self.tokens):
+            raise QueryError(f"Unexpected '{self.tokens[self.pos][1]}'")
+        return query
+
+    def or_expr(self):
+        node = self.and_expr()
+        while self.peek("keyword", "or"):
+            self.take()
+            node = ("or", node, self.and_expr())
+        return node
+
+    def and_expr(self):
+        node = self.unary()
+        while self.peek("keyword", "and"):
+            self.take()
+            node = ("and", node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek("keyword", "not"):
+            self.take()
+            return ("not", self.unary())
+        if self.peek("op", "("):
+            self.take()
+            node = self.or_expr()
+            self.take("op", ")")
+            return node
+        return self.condition()
+
+    def field(self) -> str:
+        name = self.take("string").lower()
+        if name not in SORTED_COLUMNS and name not in CATEGORICAL_COLUMNS:
+            raise QueryError(f"Unknown field '{name}'")
+        return name
+
+    def value(self) -> str:
+        kind = "number" if self.peek("number") else "string"
+        value = self.take(kind)
+        return f"{value:g}" if kind == "number" else value
+
+    def condition(self):
+        name = self.field()
+        if name in SORTED_COLUMNS:
+            low = self.take("number") if self.peek("number") else None
+            if low is not None:
+                self.take("op", "..")
+                return ("range", name, low, self.take("number"))
+            op = self.take("op")
+            if op not in NUMERIC_OPS:
+                raise QueryError(f"'{op}' doesn't work on {name}")
+            return ("compare", name, op, self.take("number"))
+
+        if self.peek("keyword", "in"):
+            self.take()
+            self.take("op", "(")
+            values = [self.value()]
+            while self.peek("op", ","):
+                self.take()
+                values.append(self.value())
+            self.take("op", ")")
+            return ("in", name, tuple(values))
+        op = self.take("op")
+        if op not in ("=", "!=", "~"):
+            raise QueryError(f"'{op}' doesn't work on {name}")
+        return ("match", name, op, self.value())
+
+
+def parse_query(text: str) -> Query:
+    return _Parser(text).parse()
+
+
+def _rows_to_mask(count: int, rows: np.ndarray) -> np.ndarray:
+    mask = np.zeros(count, dtype=bool)
+    mask[rows] = True
+    return mask
+
+
+# Rows whose value lies in [low, high] (either side may be open) straight from the sorted index
+def _range_mask(table: LibraryTable, name: str, low=None, high=None, low_inclusive=True, high_inclusive=True):
+    order, values = table.sorted_index(name)
+    # Compare floats in the column's own type, the same way a NumPy comparison against the column would
+    cast = values.dtype.type if np.issubdtype(values.dtype, np.floating) else float
+    start = 0 if low is None else np.searchsorted(values, cast(low), side='left' if low_inclusive else 'right')
+    end = len(values) if high is None else np.searchsorted(values, cast(high), side='right' if high_inclusive else 'left')
+    return _rows_to_mask(len(table), order[start:max(start, end)])
+
+
+def _compare_mask(table: LibraryTable, name: str, op: str, value: float) -> np.ndarray:
+    if op == "<":
+        return _range_mask(table, name, high=value, high_inclusive=False)
+    if op == "<=":
+        return _range_mask(table, name, high=value)
+    if op == ">":
+        return _range_mask(table, name, low=value, low_inclusive=False)
+    if op == ">=":
+        return _range_mask(table, name, low=value)
+    equal = _range_mask(table, name, low=value, high=value)
+    if op == "=":
+        return equal
+    return _range_mask(table, name) & ~equal
+
+
+def _labels_mask(table: LibraryTable, name: str, predicate) -> np.ndarray:
+    rows, offsets = table.postings(name)
+    codes = table.label_codes(name, predicate)
+    if codes.size == 0:
+        return np.zeros(len(table), dtype=bool)
+    return _rows_to_mask(len(table), np.concatenate([rows[offsets[c]:offsets[c + 1]] for c in codes]))
+
+
+# memo maps condition (sub)trees to their masks, so queries run together share common conditions
+def _evaluate(table: LibraryTable, node, memo: Optional[dict] = None) -> np.ndarray:
+    if memo is None:
+        return _evaluate_node(table, node, None)
+    if node not in memo:
+        memo[node] = _evaluate_node(table, node, memo)
+    return memo[node]
+
+
+def _evaluate_node(table: LibraryTable, node, memo: Optional[dict]) -> np.ndarray:
+    kind = node[0]
+    if kind == "and":
+        return _evaluate(table, node[1], memo) & _evaluate(table, node[2], memo)
+    if kind == "or":
+        return _evaluate(table, node[1], memo) | _evaluate(table, node[2], memo)
+    if kind == "not":
+        return ~_evaluate(table, node[1], memo)
+    if kind == "range":
+        return _range_mask(table, node[1], low=node[2], high=node[3])
+    if kind == "compare":
+        return _compare_mask(table, *node[1:])
+    if kind == "in":
+        wanted = {value.lower() for value in node[2]}
+        return _labels_mask(table, node[1], lambda label: label.lower() in wanted)
+
+    _, name, op, value = node
+    value = value.lower()
+    if op == "~":
+        return _labels_mask(table, name, lambda label: value in label.lower())
+    equal = _labels_mask(table, name, lambda label: label.lower() == value)
+    if op == "=":
+        return equal
+    return _labels_mask(table, name, lambda label: True) & ~equal
+
+
+def query_mask(table: LibraryTable, query: Union[str, Query]) -> np.ndarray:
+    if isinstance(query, str):
+        query = parse_query(query)
+    if query.where is None:
+        return np.ones(len(table), dtype=bool)
+    return _evaluate(table, query.where)
+
+
+# Orders rows by a column with a stable sort, missing values count as 0 like missing mood scores always have.
+# With a limit only the rows that can make the cut get sorted, ties still keep their row order.
+def order_rows(table: LibraryTable, rows: np.ndarray, name: str, descending: bool = False,
+               limit: Optional[int] = None) -> np.ndarray:
+    keys = np.nan_to_num(np.asarray(table.column(name)[rows], dtype=np.float64), nan=0.0)
+    if descending:
+        keys = -keys
+    if limit is not None and limit < len(rows):
+        if limit == 0:
+            return rows[:0]
+        cutoff = np.partition(keys, limit - 1)[limit - 1]
+        contenders = keys <= cutoff
+        rows, keys = rows[contenders], keys[contenders]
+    ordered = rows[np.argsort(keys, kind='stable')]
+    return ordered if limit is None else ordered[:limit]
+
+
+# Runs a query and returns the matching row indices in playlist order.
+# `limit` overrides the query's own limit (e.g. --max-songs).
+def run_query(table: LibraryTable, query: Union[str, Query], limit: Optional[int] = None) -> np.ndarray:
+    return run_queries(table, [query], [limit])[0]
+
+
+# Runs several queries in one pass: conditions that appear in more than one query are evaluated once,
+# and when several queries sort by the same column the whole table is sorted once and each
+# result is read off that order (a stable sort of a subset keeps the same order as the full sort).
+def run_queries(table: LibraryTable, queries: List[Union[str, Query]],
+                limits: Optional[List[Optional[int]]] = None) -> List[np.ndarray]:
+    queries = [parse_query(q) if isinstance(q, str) else q for q in queries]
+    limits = limits or [None] * len(queries)
+    sort_keys = Counter((q.order_by, q.descending) for q in queries if q.order_by)
+    memo, orderings, results = {}, {}, []
+
+    for query, limit in zip(queries, limits):
+        limit = query.limit if limit is None else limit
+        mask = np.ones(len(table), dtype=bool) if query.where is None else _evaluate(table, query.where, memo)
+        key = (query.order_by, query.descending)
+        if query.order_by and sort_keys[key] > 1:
+            if key not in orderings:
+                orderings[key] = order_rows(table, np.arange(len(table)), *key)
+            rows = orderings[key][mask[orderings[key]]]
+        elif query.order_by:
+            rows = order_rows(table, np.flatnonzero(mask), query.order_by, query.descending, limit)
+        else:
+            rows = np.flatnonzero(mask)
+        results.append(rows if limit is None else rows[:limit])
+    return results
@@ -0,0 +1,259 @@
+import csv
+import json
+from json.encoder import encode_basestring
+import math
+from collections import Counter
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+
+from .scanner import Song
+from .store import LibraryTable
+
+
+# Library report: one row per track streamed to a JSON Lines or CSV file, plus library-wide statistics.
+# Tracks are handled a batch at a time and the statistics are running totals, so memory stays flat
+# however big the library is (only the per-artist and per-album totals grow, with the number of artists
+# and albums). Percentiles come from fixed-width histograms and are exact to within one bin.
+REPORT_FIELDS = ("path", "artist", "album", "track_no", "title", "genre", "tempo", "energy", "mood",
+                 "score", "chroma", "centroid", "tier")
+# (low, high, bin width) of each feature's histogram, values outside the range land in the end bins
+FEATURE_RANGES = {
+    "tempo": (0.0, 300.0, 0.1),
+    "energy": (0.0, 1.0, 0.001),
+    "score": (0.0, 1.0, 0.001),
+    "chroma": (0.0, 1.0, 0.001),
+    "centroid": (0.0, 11025.0, 1.0),
+}
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+GROUP_FEATURES = ("tempo", "energy", "score")
+BATCH_SIZE = 10_000
+
+
+class FeatureStats:
+    def __init__(self, low: float, high: float, width: float):
+        self.low = low
+        self.width = width
+        self.counts = np.zeros(int(round((high - low) / width)), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        bins = np.clip(((values - self.low) / self.width).astype(np.int64), 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    # Linear interpolation inside the bin that holds the q-th percentile, clamped to the values seen
+    def percentile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        cumulative = np.cumsum(self.counts)
+        b = min(int(np.searchsorted(cumulative, rank, side='left')), len(self.counts) - 1)
+        before = cumulative[b - 1] if b else 0
+        fraction = (rank - before) / self.counts[b] if self.counts[b] else 0.0
+        value = self.low + (b + fraction) * self.width
+        return min(max(value, self.min), self.max)
+
+    def summary(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        summary = {"count": self.count, "mean": self.total / self.count, "min": self.min, "max": self.max}
+        for q in PERCENTILES:
+            summary[f"p{q}"] = self.percentile(q)
+        return summary
+
+
+# Running per-group totals for the artist and album breakdowns: a row per group holding
+# the track count, then the sum and count of every feature in GROUP_FEATURES
+class _GroupStats:
+    def __init__(self):
+        self.rows = {}
+        self.totals = np.zeros((1024, 1 + 2 * len(GROUP_FEATURES)))
+
+    def add(self, keys: np.ndarray, batch: dict):
+        groups, inverse = np.unique(keys, return_inverse=True)
+        ids = np.array([self.rows.setdefault(key, len(self.rows)) for key in groups.tolist()], dtype=np.int64)
+        if len(self.rows) > len(self.totals):
+            grown = np.zeros((max(len(self.rows), 2 * len(self.totals)), self.totals.shape[1]))
+            grown[:len(self.totals)] = self.totals
+            self.totals = grown
+        block = [np.bincount(inverse, minlength=len(groups))]
+        for name in GROUP_FEATURES:
+            present = ~np.isnan(batch[name])
+            block.append(np.bincount(inverse[present], weights=batch[name][present], minlength=len(groups)))
+            block.append(np.bincount(inverse[present], minlength=len(groups)))
+        self.totals[ids] += np.column_stack(block)  # ids are unique within a batch
+
+    def summary(self) -> List[dict]:
+        rows = []
+        for key, i in self.rows.items():
+            row = {"name": key, "tracks": int(self.totals[i, 0])}
+            for f, name in enumerate(GROUP_FEATURES):
+                total, n = self.totals[i, 1 + 2 * f], self.totals[i, 2 + 2 * f]
+                row[f"{name}_mean"] = float(total / n) if n else None
+            rows.append(row)
+        return sorted(rows, key=lambda row: (-row["tracks"], row["name"]))
+
+
+class LibraryStats:
+    def __init__(self):
+        self.tracks = 0
+        self.analyzed = 0
+        self.features = {name: FeatureStats(*limits) for name, limits in FEATURE_RANGES.items()}
+        self.moods = Counter()
+        self.genres = Counter()
+        self.tiers = Counter()
+        self.artists = _GroupStats()
+        self.albums = _GroupStats()
+
+    def add(self, batch: dict):
+        self.tracks += len(batch["tempo"])
+        self.analyzed += int(np.count_nonzero(~np.isnan(batch["tempo"])))
+        for name, stats in self.features.items():
+            stats.add(batch[name])
+        for counter, name in ((self.moods, "mood"), (self.genres, "genre"), (self.tiers, "tier")):
+            counter.update(value for value in batch[name].tolist() if value is not None)
+        artists = np.array(["" if a is None else a for a in batch["artist"].tolist()], dtype=object)
+        self.artists.add(artists, batch)
+        albums = np.array([f"{a} - {b}" for a, b in zip(artists.tolist(), batch["album"].tolist())], dtype=object)
+        self.albums.add(albums, batch)
+
+    def summary(self) -> dict:
+        return {
+            "tracks": self.tracks,
+            "analyzed": self.analyzed,
+            "features": {name: stats.summary() for name, stats in self.features.items()},
+            "moods": dict(self.moods.most_common()),
+            "genres": dict(self.genres.most_common()),
+            "tiers": dict(self.tiers.most_common()),
+            "artists": self.artists.summary(),
+            "albums": self.albums.summary(),
+        }
+
+
+# Column batches of the library: float64 arrays (NaN for missing) for the features and
+# object arrays for the text. Strings that only rows need (path, title) are skipped without rows.
+def _song_batches(songs: List[Song], with_rows: bool) -> Iterator[dict]:
+    for start in range(0, len(songs), BATCH_SIZE):
+        chunk = songs[start:start + BATCH_SIZE]
+        batch = {}
+        for name in FEATURE_RANGES:
+            batch[name] = np.array([getattr(s, name) for s in chunk], dtype=np.float64)
+        for name in ("artist", "album", "genre", "mood", "tier") + (("path", "title", "track_no") if with_rows else ()):
+            batch[name] = np.array([getattr(s, name) for s in chunk] + [None], dtype=object)[:-1]
+        yield batch
+
+
+def _table_batches(table: LibraryTable, with_rows: bool) -> Iterator[dict]:
+    labels = {name: np.array(table.labels(name) + [None], dtype=object)
+              for name in ("artist", "album", "genre", "mood", "tier")}
+    for start in range(0, len(table), BATCH_SIZE):
+        rows = range(start, min(start + BATCH_SIZE, len(table)))
+        batch = {name: np.asarray(table.column(name)[start:rows.stop], dtype=np.float64) for name in FEATURE_RANGES}
+        for name, values in labels.items():
+            batch[name] = values[np.asarray(table.column(name)[start:rows.stop])]  # code -1 picks the None at the end
+        if with_rows:
+            for name in ("path", "title"):
+                batch[name] = np.array(table.strings(name, start, rows.stop) + [None], dtype=object)[:-1]
+            track_no = np.asarray(table.column("track_no")[start:rows.stop])
+            batch["track_no"] = np.array([None if t < 0 else int(t) for t in track_no.tolist()] + [None], dtype=object)[:-1]
+        yield batch
+
+
+# The batch as one Python list per report field, features rounded and missing values as None
+def _batch_columns(batch: dict) -> List[list]:
+    columns = []
+    for name in REPORT_FIELDS:
+        if name in FEATURE_RANGES:
+            columns.append([None if v != v else v for v in np.round(batch[name], 4).tolist()])
+        else:
+            columns.append(batch[name].tolist())
+    return columns
+
+
+# JSON Lines are put together from per-column JSON values rather than a json.dumps per row,
+# the strings go through the json module's C encoder
+_NUMERIC_FIELDS = set(FEATURE_RANGES) | {"track_no"}
+_JSON_ROW = "{" + ", ".join(f'"{name}": %s' for name in REPORT_FIELDS) + "}\n"
+
+
+def _json_lines(columns: List[list]) -> str:
+    encoded = []
+    for name, values in zip(REPORT_FIELDS, columns):
+        if name in _NUMERIC_FIELDS:
+            encoded.append(json.dumps(values)[1:-1].split(", "))  # numbers never hold the separator
+        else:
+            encoded.append(["null" if v is None else encode_basestring(v) for v in values])
+    return "".join(_JSON_ROW % row for row in zip(*encoded))
+
+
+def report_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+# Streams one row per track to output_file (JSON Lines, or CSV for a .csv name) while gathering the
+# library statistics, and returns the statistics. Without an output file only the statistics are gathered.
+def write_report(library: Union[List[Song], LibraryTable], output_file: Optional[str] = None) -> Optional[dict]:
+    with_rows = output_file is not None
+    batches = _table_batches(library, with_rows) if isinstance(library, LibraryTable) else _song_batches(library, with_rows)
+    stats = LibraryStats()
+    try:
+        if not with_rows:
+            for batch in batches:
+                stats.add(batch)
+            return stats.summary()
+
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            if report_format(output_file) == "csv":
+                writer = csv.writer(f)
+                writer.writerow(REPORT_FIELDS)
+                write_batch = lambda columns: writer.writerows(zip(*columns))
+            else:
+                write_batch = lambda columns: f.write(_json_lines(columns))
+            for batch in batches:
+                stats.add(batch)
+                write_batch(_batch_columns(batch))
+    except OSError as e:
+        print(f"Could not write report to '{output_file}': {e}")
+        return None
+    return stats.summary()
+
+
+def write_summary(summary: dict, output_file: str) -> bool:
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        return True
+    except OSError as e:
+        print(f"Could not write report summary to '{output_file}': {e}")
+        return False
+
+
+def print_summary(summary: dict, top: int = 10):
+    print("\n--- Library Summary ---")
+    print(f"Songs: {summary['tracks']} ({summary['analyzed']} analyzed)")
+    units = {"tempo": " BPM", "centroid": " Hz"}
+    for name, stats in summary["features"].items():
+        if stats["count"]:
+            unit = units.get(name, "")
+            print(f"{name.capitalize():<9} mean {stats['mean']:.2f}{unit}  median {stats['p50']:.2f}{unit}  "
+                  f"p10-p90 {stats['p10']:.2f}-{stats['p90']:.2f}{unit}")
+    for title, counts in (("Moods", summary["moods"]), ("Genres", summary["genres"])):
+        if counts:
+            shown = list(counts.items())[:top]
+            more = f", +{len(counts) - top} more" if len(counts) > top else ""
+            print(f"{title}: " + ", ".join(f"{name} {n}" for name, n in shown) + more)
+    if summary["artists"]:
+        print(f"Top artists ({len(summary['artists'])} in total):")
+        for row in summary["artists"][:top]:
+            tempo = f", avg tempo {row['tempo_mean']:.1f} BPM" if row["tempo_mean"] is not None else ""
+            print(f"  {row['name']}: {row['tracks']} songs{tempo}")
@@ -1,22 +1,57 @@
+import importlib.util
+import json
 import os
 import re
-from typing import List, Optional
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from typing import Callable, List, Optional
 
+from . import metrics
 
 
 
+
+# Artist, album and genre repeat across thousands of songs, interning them keeps one copy of each string
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Song:
+    # No per-song __dict__, a big library holds hundreds of thousands of these (see benchmarks/memory_benchmark.py).
+    # Features are plain Python floats, never NumPy scalars or arrays.
+    __slots__ = ("path", "artist", "album", "track_no", "title", "genre", "size", "mtime",
+                 "tempo", "energy", "mood", "score", "chroma", "centroid", "tier", "fingerprint")
+
     def __init__(self, path, artist, album, track_no, title, genre=None):
         self.path = path
-        self.artist = artist
-        self.album = album
+        self.artist = _intern(artist)
+        self.album = _intern(album)
         self.track_no = track_no
         self.title = title
-        self.genre = genre #keeping this one optional since it dpends on mutagen
+        self.genre = _intern(genre) #keeping this one optional since it dpends on mutagen
+        self.size = None
+        self.mtime = None # size and mtime are what the cache uses to tell if a file changed
         self.tempo = None
         self.energy = None
         self.mood = None
         self.score = None
+        self.chroma = None
+        self.centroid = None # mean chroma and spectral centroid, used by the similarity index
+        self.tier = None # "full" or "preview", see analyser.PreviewConfig
+        self.fingerprint = None # hash of the audio payload, see fingerprint.py
+
+    # Pickled as a tuple of values in slot order rather than a {name: value} dict per song
+    def __getstate__(self):
+        return _SONG_STATE(self)
+
+    def __setstate__(self, state):
+        for name, value in zip(Song.__slots__, state):
+            setattr(self, name, value)
+        self.artist, self.album, self.genre = _intern(self.artist), _intern(self.album), _intern(self.genre)
+
+_SONG_STATE = attrgetter(*Song.__slots__)
 
 GENRE_MAP = {
     "Альтернативная музыка": "Alternative",
@@ -33,71 +68,210 @@ def normalize_genre(genre: str) -> str:
     return GENRE_MAP.get(genre, genre)
 
 
-def scan_library(library_path: str) -> List[Song]:
-    songs = []
-    supported_exts = {'.mp3', '.flac', '.m4a', '.ogg', '.wma'}
+SUPPORTED_EXTS = {'.mp3', '.flac', '.m4a', '.ogg', '.wma'}
+TRACK_RE = re.compile(r'(\d+)\s*[-.]\s*(.+?)\..+')
+SCAN_INDEX_VERSION = 1
 
+
+def _artist_album(library_path: str, dirpath: str):
+    # to etxract the base details as per provided problem statement
     try:
-        from mutagen import File as MutagenFile
-        mutagen_available = True
-    except ImportError:
-        mutagen_available = False
+        relative_path = os.path.relpath(dirpath, library_path)
+        if relative_path == ".":
+            return os.path.basename(dirpath), "Unknown Album"
+        parts = relative_path.split(os.sep)
+        if len(parts) >= 2:
+            return parts[0], parts[1]
+        return "Unknown Artist", "Unknown Album"
+    except ValueError:
+        return "Unknown Artist", "Unknown Album"
+
 
-    for dirpath, dirnames, filenames in os.walk(library_path):# to etxract the base details as per provided problem statement
+def _parse_filename(filename: str):
+    match = TRACK_RE.match(filename)# Extracting info via regex
+    if not match:
+        return 0, os.path.splitext(filename)[0]
+    return int(match.group(1)), match.group(2)
+
+
+def _read_genre(path: str) -> Optional[str]:
+    #deriving the genre
+    with metrics.timer("tag_read", path):
         try:
-            relative_path = os.path.relpath(dirpath, library_path)
-            if relative_path == ".":
-                artist = os.path.basename(dirpath)
-                album = "Unknown Album"
+            if path.lower().endswith('.mp3'):
+                # Reading just the ID3 tag skips mutagen's scan of the MPEG stream, which is the slow part for MP3s
+                from mutagen.id3 import ID3
+                audio = ID3(path)
             else:
-                parts = relative_path.split(os.sep)
-                if len(parts) >= 2:
-                    artist = parts[0]
-                    album = parts[1]
-                else:
-                    artist = "Unknown Artist"
-                    album = "Unknown Album"
-        
-        except ValueError:
-            artist = "Unknown Artist"
-            album = "Unknown Album"
-
-        for filename in filenames:
-            file_ext = os.path.splitext(filename)[1].lower() # here I have checked the allowed extensions
-            if file_ext not in supported_exts:
+                from mutagen import File as MutagenFile
+                audio = MutagenFile(path)
+            if audio:
+                genre_list = audio.get('genre') or audio.get('TCON')
+                if genre_list:
+                    return _intern(normalize_genre(str(genre_list[0])))# Generalising genre
+        except Exception:
+            pass
+    return None
+
+
+def _song_record(song: Song) -> dict:
+    return {
+        "file": os.path.basename(song.path),
+        "track_no": song.track_no,
+        "title": song.title,
+        "genre": song.genre,
+        "size": song.size,
+        "mtime": song.mtime,
+    }
+
+
+def _load_scan_index(index_file: str, library_path: str, mutagen_available: bool) -> dict:
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if (index.get("version") != SCAN_INDEX_VERSION
+            or index.get("root") != os.path.abspath(library_path)
+            or index.get("mutagen") != mutagen_available):
+        return {}
+    return index.get("dirs", {})
+
+
+def _save_scan_index(index_file: str, library_path: str, mutagen_available: bool, dirs: dict):
+    data = {
+        "version": SCAN_INDEX_VERSION,
+        "root": os.path.abspath(library_path),
+        "mutagen": mutagen_available,
+        "dirs": dirs,
+    }
+    tmp_path = f"{index_file}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, index_file)
+    except OSError as e:
+        print(f"Could not save scan index: {e}")
+
+
+# Walks the library and returns a Song per supported file.
+# With an index_file, every directory's mtime is remembered along with what was found in it.
+# A directory whose mtime hasn't changed is not listed again, its files are only stat'ed and their
+# tags are read again only when a file's size or mtime changed (edited in place).
+# Tags are read on a thread pool because that part is I/O bound, especially on network storage.
+# With `include`, only the files whose path it accepts are stat'ed, tag-read and returned (a shard's files).
+# The index then only knows about those files, so it shouldn't be shared with scans using another filter.
+def scan_library(library_path: str, index_file: Optional[str] = None, threads: Optional[int] = None,
+                 include: Optional[Callable[[str], bool]] = None) -> List[Song]:
+    started = time.perf_counter()
+    songs = []
+
+    mutagen_available = importlib.util.find_spec("mutagen") is not None
+
+    old_dirs = _load_scan_index(index_file, library_path, mutagen_available) if index_file else {}
+    new_dirs = {}
+    fresh_songs = {}  # relative dir -> songs found in it this time
+    to_tag = []
+
+    stack = [library_path]
+    while stack:
+        dirpath = stack.pop()
+        relative_dir = os.path.relpath(dirpath, library_path)
+        try:
+            dir_mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+
+        artist, album = _artist_album(library_path, dirpath)
+        cached = old_dirs.get(relative_dir)
+
+        if cached is not None and cached["mtime"] == dir_mtime:
+            subdirs = cached["subdirs"]
+            dir_songs = []
+            for record in cached["files"]:
+                path = os.path.join(dirpath, record["file"])
+                if include is not None and not include(path):
+                    continue
+                song = Song(
+                    path=path,
+                    artist=artist,
+                    album=album,
+                    track_no=record["track_no"],
+                    title=record["title"],
+                    genre=record["genre"]
+                )
+                # The listing is reused but every file is still stat'ed: a file rewritten in place
+                # (re-encoded, re-tagged) keeps the directory mtime and only shows up here
+                try:
+                    stat = os.stat(song.path)
+                except OSError:
+                    continue
+                song.size = stat.st_size
+                song.mtime = stat.st_mtime_ns
+                if song.size != record["size"] or song.mtime != record["mtime"]:
+                    to_tag.append(song)
+                    metrics.count("files_changed_in_place")
+                songs.append(song)
+                dir_songs.append(song)
+            new_dirs[relative_dir] = {"mtime": dir_mtime, "subdirs": subdirs, "files": []}
+            fresh_songs[relative_dir] = dir_songs
+            metrics.count("dirs_reused")
+        else:
+            subdirs = []
+            dir_songs = []
+            try:
+                entries = list(os.scandir(dirpath))
+            except OSError:
                 continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                except OSError:
+                    continue
 
-            full_path = os.path.join(dirpath, filename)
-            
-            match = re.match(r'(\d+)\s*[-.]\s*(.+?)\..+', filename)# Extracting info via regex
-            if not match:
-                track_no = 0
-                title = os.path.splitext(filename)[0]
-            else:
-                track_no = int(match.group(1))
-                title = match.group(2)
-            
-            genre = None
-            
-            if mutagen_available: #deriving the genre
+                file_ext = os.path.splitext(entry.name)[1].lower() # here I have checked the allowed extensions
+                if file_ext not in SUPPORTED_EXTS:
+                    continue
+                path = os.path.join(dirpath, entry.name)
+                if include is not None and not include(path):
+                    continue
+
+                track_no, title = _parse_filename(entry.name)
+                song = Song(
+                    path=path,
+                    artist=artist,
+                    album=album,
+                    track_no=track_no,
+                    title=title
+                )
                 try:
-                    audio = MutagenFile(full_path)
-                    if audio:
-                        genre_list = audio.get('genre') or audio.get('TCON')
-                        if genre_list:
-                            genre = str(genre_list[0])
-                            genre = normalize_genre(genre)# Generalising genre
-                except Exception:
+                    stat = entry.stat()
+                    song.size = stat.st_size
+                    song.mtime = stat.st_mtime_ns
+                except OSError:
                     pass
+                songs.append(song)
+                dir_songs.append(song)
+                to_tag.append(song)
+            new_dirs[relative_dir] = {"mtime": dir_mtime, "subdirs": subdirs, "files": []}
+            fresh_songs[relative_dir] = dir_songs
+            metrics.count("dirs_listed")
 
-            song = Song(
-                path=full_path,
-                artist=artist,
-                album=album,
-                track_no=track_no,
-                title=title,
-                genre=genre
-            )
-            songs.append(song)
-    
-    return songs
\ No newline at end of file
+        # Reversed so directories come off the stack in listing order, like os.walk
+        stack.extend(os.path.join(dirpath, name) for name in reversed(subdirs))
+
+    if mutagen_available and to_tag:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for song, genre in zip(to_tag, executor.map(_read_genre, [s.path for s in to_tag])):
+                song.genre = genre
+
+    if index_file:
+        for relative_dir, dir_songs in fresh_songs.items():
+            new_dirs[relative_dir]["files"] = [_song_record(song) for song in dir_songs]
+        _save_scan_index(index_file, library_path, mutagen_available, new_dirs)
+
+    metrics.count("tags_read", len(to_tag) if mutagen_available else 0)
+    metrics.record("scan", time.perf_counter() - started)
+    return songs
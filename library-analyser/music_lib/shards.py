@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import os
+from typing import Callable, List, Optional, Tuple
+
+from .analyser import ANALYZER_VERSION, FULL_TIER, PreviewConfig, analyze_songs
+from .decode import DecodeConfig
+from .cache import CacheCheckpoint, apply_cache, cache_key, load_cache, read_cache_file, write_tracks
+from .pipeline import PipelineConfig
+from .scanner import scan_library
+
+
+# Sharded analysis: N processes (on one machine or several) each list the whole library, keep the
+# tracks whose path hashes to their shard and read tags and analyze only those, into a shard cache of their own.
+# A merge then folds the shard caches into the main cache. Tracks are assigned by their path
+# relative to the library root, so nodes that mount the library in different places agree on
+# the split, and the merge maps every shard's paths onto the local library root.
+SHARD_DIR = "./shards"
+
+
+# "i/N" with 1 <= i <= N, as (i, N)
+def parse_shard(spec: str) -> Optional[Tuple[int, int]]:
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        index, count = 0, 0
+    if count < 1 or not 1 <= index <= count:
+        print(f"Invalid shard '{spec}', expected i/N with 1 <= i <= N (e.g. 2/4).")
+        return None
+    return index, count
+
+
+def shard_file(shard_dir: str, shard: Tuple[int, int]) -> str:
+    return os.path.join(shard_dir, f"shard-{shard[0]}-of-{shard[1]}.pkl")
+
+
+def _relative_key(path: str, library_root: str) -> str:
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(library_root)).replace(os.sep, "/")
+
+
+# 1-based shard of a path, stable across machines and Python runs (unlike hash())
+def shard_of(path: str, library_root: str, count: int) -> int:
+    digest = hashlib.blake2b(_relative_key(path, library_root).encode('utf-8', 'surrogateescape'), digest_size=8)
+    return int.from_bytes(digest.digest(), 'little') % count + 1
+
+
+def in_shard(library_root: str, shard: Tuple[int, int]) -> Callable[[str], bool]:
+    index, count = shard
+    return lambda path: shard_of(path, library_root, count) == index
+
+
+# Analyzes one shard of the library into its shard cache. Like a normal run it is incremental and
+# resumable: tracks already in the shard cache are reused and results are checkpointed as they come in.
+def run_shard(library_path: str, shard: Tuple[int, int], shard_dir: str = SHARD_DIR, jobs: int = 1,
+              scan_threads: Optional[int] = None, pipeline: Optional[PipelineConfig] = None,
+              preview: Optional[PreviewConfig] = None, decode: Optional[DecodeConfig] = None,
+              force_refresh: bool = False) -> bool:
+    os.makedirs(shard_dir, exist_ok=True)
+    cache_file = shard_file(shard_dir, shard)
+    # Every shard keeps its own scan index, so processes sharing a directory don't overwrite each other's
+    index_file = None if force_refresh else os.path.join(shard_dir, f"shard-{shard[0]}-of-{shard[1]}.scan_index.json")
+
+    print(f"Scanning music library at '{library_path}' for shard {shard[0]}/{shard[1]}...")
+    # Paths are split before any file is stat'ed or tag-read, so each shard only touches its own files
+    songs = scan_library(library_path, index_file=index_file, threads=scan_threads,
+                         include=in_shard(library_path, shard))
+    print(f"Shard {shard[0]}/{shard[1]} holds {len(songs)} songs.")
+
+    tracks = {} if force_refresh else load_cache(cache_file)
+    stale, deleted, relinked = apply_cache(songs, tracks, threads=scan_threads)
+    stale_ids = {id(song) for song in stale}
+    meta = {"library_root": os.path.abspath(library_path), "shard": shard}
+    checkpoint = CacheCheckpoint(cache_file, [s for s in songs if id(s) not in stale_ids],
+                                 dirty=deleted > 0 or relinked > 0 or not os.path.exists(cache_file), meta=meta)
+    if stale:
+        print(f"Analyzing {len(stale)} new or modified songs...")
+        try:
+            analyze_songs(stale, jobs=jobs, on_result=checkpoint.record, preview=preview, pipeline=pipeline,
+                          decode=decode)
+        except KeyboardInterrupt:
+            checkpoint.close()
+            print("\nAnalysis interrupted. Finished songs were cached, run the same command again to resume.")
+            return False
+    checkpoint.close()
+    print(f"Shard {shard[0]}/{shard[1]} done: {len(songs) - len(stale)} reused, {len(stale)} analyzed, saved in {cache_file}")
+    return True
+
+
+# Shard cache files named on the command line, directories stand for every shard cache in them
+def find_shard_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "shard-*-of-*.pkl")))
+        else:
+            files.append(path)
+    return files
+
+
+# Of two entries for the same track, the one analyzed from the newer file wins, then full analysis
+# over a preview. On a tie the entry already there is kept.
+def _replaces(entry: dict, current: dict) -> bool:
+    return (entry["mtime"] or 0, entry.get("tier") == FULL_TIER) > (current["mtime"] or 0, current.get("tier") == FULL_TIER)
+
+
+# Folds shard caches into the main cache. Shards written by another analyzer version are left out,
+# their features aren't comparable with this version's (the same rule load_cache applies).
+# Returns the number of entries taken from the shards, or None if nothing could be merged.
+def merge_shards(shard_files: List[str], cache_file: str, library_path: str) -> Optional[int]:
+    tracks = load_cache(cache_file)
+    merged, kept, shards = 0, 0, set()
+    for path in shard_files:
+        data = read_cache_file(path)
+        if data is None:
+            print(f"Skipping shard cache {path}: it could not be read.")
+            continue
+        if data.get("analyzer_version") != ANALYZER_VERSION:
+            print(f"Skipping shard cache {path}: it was written by analyzer version {data.get('analyzer_version')}, "
+                  f"this is version {ANALYZER_VERSION}. Analyze that shard again.")
+            continue
+        # Paths are rebased from the root the shard was analyzed under onto this library
+        root = data.get("library_root", os.path.abspath(library_path))
+        for key, entry in data["tracks"].items():
+            local_key = cache_key(os.path.join(library_path, _relative_key(key, root)))
+            current = tracks.get(local_key)
+            if current is None or _replaces(entry, current):
+                tracks[local_key] = entry
+                merged += 1
+            else:
+                kept += 1
+        if data.get("shard"):
+            shards.add(tuple(data["shard"]))
+
+    if not shards and not merged:
+        print("No shard caches to merge.")
+        return None
+
+    counts = {count for _, count in shards}
+    for count in counts:
+        missing = [i for i in range(1, count + 1) if (i, count) not in shards]
+        if missing:
+            print(f"Shards {', '.join(f'{i}/{count}' for i in missing)} are missing, their songs still need to be analyzed.")
+    try:
+        write_tracks(tracks, cache_file)
+    except Exception as e:
+        print(f"Could not save merged cache: {e}")
+        return None
+    print(f"Merged {merged} songs from {len(shard_files)} shard caches into {cache_file}"
+          + (f" ({kept} older or identical entries ignored)." if kept else "."))
+    return merged
@@ -0,0 +1,147 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+from .store import LibraryTable
+
+
+# The features a track is compared on. Each one is z-scored over the library so BPM and
+# centroid (hundreds/thousands) don't drown out energy and mood score (0-1).
+SIMILARITY_FEATURES = ("tempo", "energy", "centroid", "chroma", "score")
+INDEX_FILE = "similarity.npz"
+
+
+# A k-d tree over the normalized feature vectors of every fully analyzed track.
+# Rows are indices into the LibraryTable the index was built from.
+class SimilarityIndex:
+    def __init__(self, vectors: np.ndarray, rows: np.ndarray, mean: np.ndarray, scale: np.ndarray, count: int):
+        # scipy is only needed once someone asks for similar tracks
+        from scipy.spatial import cKDTree
+
+        self.vectors = vectors
+        self.rows = rows
+        self.mean = mean
+        self.scale = scale
+        self.count = count
+        self.position = np.full(count, -1, dtype=np.int64)
+        self.position[rows] = np.arange(len(rows))
+        # Unbalanced trees build several times faster and answer low dimensional queries just as quickly
+        self.tree = cKDTree(vectors, balanced_tree=False, compact_nodes=False)
+
+    @classmethod
+    def build(cls, table: LibraryTable) -> "SimilarityIndex":
+        raw = np.column_stack([np.asarray(table.column(name), dtype=np.float64) for name in SIMILARITY_FEATURES])
+        if raw.size == 0:
+            raw = raw.reshape(0, len(SIMILARITY_FEATURES))
+        rows = np.flatnonzero(~np.isnan(raw).any(axis=1))
+        raw = raw[rows]
+        mean = raw.mean(axis=0) if len(rows) else np.zeros(len(SIMILARITY_FEATURES))
+        scale = raw.std(axis=0) if len(rows) else np.ones(len(SIMILARITY_FEATURES))
+        scale[scale == 0] = 1.0
+        return cls((raw - mean) / scale, rows, mean, scale, len(table))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, vectors=self.vectors, rows=self.rows, mean=self.mean, scale=self.scale,
+                 count=np.array(self.count), features=np.array(SIMILARITY_FEATURES))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SimilarityIndex"]:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if tuple(data["features"]) != SIMILARITY_FEATURES:
+                    return None
+                return cls(data["vectors"], data["rows"], data["mean"], data["scale"], int(data["count"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def contains(self, row: int) -> bool:
+        return 0 <= row < self.count and self.position[row] >= 0
+
+    def vector(self, row: int) -> np.ndarray:
+        return self.vectors[self.position[row]]
+
+    # The k nearest tracks to a row (never the row itself), nearest first, as (rows, distances)
+    def knn(self, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self.rows) - 1)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        distances, positions = self.tree.query(self.vector(row), k=k + 1)
+        keep = positions != self.position[row]
+        return self.rows[positions[keep][:k]], distances[keep][:k]
+
+    # Every track within `radius` (in normalized units) of a row, nearest first
+    def within(self, row: int, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.asarray(self.tree.query_ball_point(self.vector(row), r=radius), dtype=np.int64)
+        positions = positions[positions != self.position[row]]
+        distances = np.linalg.norm(self.vectors[positions] - self.vector(row), axis=1)
+        order = np.argsort(distances, kind='stable')
+        return self.rows[positions[order]], distances[order]
+
+
+# Loads the index persisted in a store directory, or builds (and persists) it when it is missing
+# or doesn't belong to the table. write_store replaces the whole directory, so a stale index can't survive.
+@metrics.timed("similarity_index")
+def load_or_build_index(table: LibraryTable, store_dir: Optional[str] = None) -> SimilarityIndex:
+    path = os.path.join(store_dir, INDEX_FILE) if store_dir else None
+    if path and os.path.exists(path):
+        index = SimilarityIndex.load(path)
+        if index is not None and index.count == len(table):
+            return index
+
+    index = SimilarityIndex.build(table)
+    if path and os.path.isdir(store_dir):
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"Could not save similarity index: {e}")
+    return index
+
+
+# Picks `steps` tracks that lead from one row to another in small, even steps.
+# Candidates for step i are the nearest tracks to the point i/(steps+1) of the way along the straight
+# line between the two songs, which keeps the search to a sparse layered graph instead of the whole
+# library. A beam search over those layers then minimizes the summed squared step distance
+# (squaring favours several small steps over one big jump). Tracks are never repeated; if the
+# library runs out of candidates the path is shorter than asked.
+def plan_transition(index: SimilarityIndex, start_row: int, end_row: int, steps: int,
+                    beam_width: int = 8, candidates: int = 24) -> np.ndarray:
+    start, end = index.vector(start_row), index.vector(end_row)
+    excluded = {int(index.position[start_row]), int(index.position[end_row])}
+    k = min(candidates + len(excluded), len(index))
+    if steps <= 0 or k == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Each beam entry is (cost so far, positions picked so far)
+    beam = [(0.0, [])]
+    for step in range(1, steps + 1):
+        waypoint = start + (end - start) * (step / (steps + 1))
+        _, layer = index.tree.query(waypoint, k=k)
+        layer = np.atleast_1d(layer)
+        layer_vectors = index.vectors[layer]
+
+        expanded = []
+        for cost, path in beam:
+            last = index.vectors[path[-1]] if path else start
+            step_costs = ((layer_vectors - last) ** 2).sum(axis=1)
+            used = excluded.union(path)
+            for position, step_cost in zip(layer.tolist(), step_costs.tolist()):
+                if position not in used:
+                    expanded.append((cost + step_cost, path + [position]))
+        if not expanded:
+            break
+        expanded.sort(key=lambda entry: entry[0])
+        beam = expanded[:beam_width]
+
+    def total(entry):
+        cost, path = entry
+        return cost + float(((end - index.vectors[path[-1]]) ** 2).sum()) if path else cost
+
+    _, best = min(beam, key=total)
+    return index.rows[np.asarray(best, dtype=np.int64)]
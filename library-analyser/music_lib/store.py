@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from . import metrics
+from .scanner import Song
+from .analyser import ANALYZER_VERSION, mood_scores, mood_values
+
+
+STORE_FORMAT = 5
+
+# Numeric features live in plain arrays, missing floats are NaN and missing ints are -1
+NUMERIC_COLUMNS = {
+    "tempo": np.float32,
+    "energy": np.float32,
+    "score": np.float32,
+    "chroma": np.float32,
+    "centroid": np.float32,
+    "track_no": np.int32,
+    "size": np.int64,
+    "mtime": np.int64,
+}
+# Repeated strings are dictionary encoded: one label list per column and an int32 code per track (-1 is None)
+CATEGORICAL_COLUMNS = ("mood", "genre", "artist", "album", "tier")
+# Strings that are unique per track are stored as one UTF-8 blob plus an offsets array
+STRING_COLUMNS = ("path", "title")
+# Numeric columns that queries can filter on get a sorted index: the rows ordered by value
+# (missing values left out) and the values in that order, so a range is two binary searches
+SORTED_COLUMNS = ("tempo", "energy", "score", "chroma", "centroid", "track_no")
+# String columns that exact lookups (find) go through a hash index for: the string hashes sorted,
+# with the row of each, so a lookup is a binary search instead of a scan over the blob
+HASHED_COLUMNS = ("path",)
+
+
+def _sorted_index(values: np.ndarray):
+    values = np.asarray(values)
+    present = np.flatnonzero(~np.isnan(values)) if np.issubdtype(values.dtype, np.floating) else np.flatnonzero(values >= 0)
+    order = present[np.argsort(values[present], kind='stable')].astype(np.int32)
+    return order, values[order]
+
+
+# Inverted index of a categorical column: every row grouped by code (row order kept within a code),
+# the rows of code c are rows[offsets[c]:offsets[c + 1]]
+def _postings(codes: np.ndarray, label_count: int):
+    codes = np.asarray(codes)
+    present = np.flatnonzero(codes >= 0)
+    rows = present[np.argsort(codes[present], kind='stable')].astype(np.int32)
+    offsets = np.zeros(label_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes[present], minlength=label_count), out=offsets[1:])
+    return rows, offsets
+
+
+def _string_hash(value: str) -> int:
+    # Signed, so the hashes fit an int64 array; hash() is salted per process and can't be saved
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogateescape'), digest_size=8).digest(),
+                          'little', signed=True)
+
+
+def _hash_index(values: Iterable[str]):
+    hashes = np.fromiter((_string_hash(v) for v in values), dtype=np.int64)
+    rows = np.argsort(hashes, kind='stable').astype(np.int32)
+    return rows, hashes[rows]
+
+
+def _none_if_missing(value, dtype):
+    if np.issubdtype(dtype, np.floating):
+        return None if np.isnan(value) else float(value)
+    return None if value < 0 else int(value)
+
+
+# A column oriented view of the library. It is either built in memory from Song objects
+# or memory-mapped from a store on disk, and the playlist code works the same on both.
+class LibraryTable:
+    def __init__(self, count: int, columns: Dict[str, np.ndarray], labels: Dict[str, List[str]],
+                 strings: Optional[Dict[str, tuple]] = None, songs: Optional[List[Song]] = None,
+                 indexes: Optional[Dict[tuple, tuple]] = None):
+        self._count = count
+        self._columns = columns
+        self._labels = labels
+        self._strings = strings or {}
+        self._songs = songs
+        self._indexes = indexes or {}
+
+    @classmethod
+    def from_songs(cls, songs: List[Song]) -> "LibraryTable":
+        columns = {}
+        for name, dtype in NUMERIC_COLUMNS.items():
+            if name == "score":
+                continue  # computed below
+            missing = np.nan if np.issubdtype(dtype, np.floating) else -1
+            values = [getattr(song, name) for song in songs]
+            columns[name] = np.array([missing if v is None else v for v in values], dtype=dtype)
+
+        labels = {}
+        for name in CATEGORICAL_COLUMNS:
+            lookup = {}
+            codes = np.empty(len(songs), dtype=np.int32)
+            for i, song in enumerate(songs):
+                value = getattr(song, name)
+                codes[i] = -1 if value is None else lookup.setdefault(value, len(lookup))
+            columns[name] = codes
+            labels[name] = list(lookup)
+
+        # Scores are derived in one pass over the whole library instead of taken from each song, from
+        # the songs' own (float64) features so they come out exactly as get_mood_score would give them
+        tempo, energy = (np.array([np.nan if v is None else v for v in (getattr(song, name) for song in songs)],
+                                  dtype=np.float64) for name in ("tempo", "energy"))
+        columns["score"] = mood_scores(tempo, energy, mood_values(columns["mood"], labels["mood"])).astype(np.float32)
+
+        return cls(len(songs), columns, labels, songs=list(songs))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def labels(self, name: str) -> List[str]:
+        return self._labels[name]
+
+    # Codes of every label in a categorical column that satisfies the predicate
+    def label_codes(self, name: str, predicate: Callable[[str], bool]) -> np.ndarray:
+        return np.array([code for code, label in enumerate(self._labels[name]) if predicate(label)], dtype=np.int32)
+
+    # (rows ordered by value, values in that order), read from the store or built on first use
+    def sorted_index(self, name: str):
+        key = ("sorted", name)
+        if key not in self._indexes:
+            self._indexes[key] = _sorted_index(self._columns[name])
+        return self._indexes[key]
+
+    # (rows grouped by code, offsets per code), read from the store or built on first use
+    def postings(self, name: str):
+        key = ("postings", name)
+        if key not in self._indexes:
+            self._indexes[key] = _postings(self._columns[name], len(self._labels[name]))
+        return self._indexes[key]
+
+    # (rows ordered by string hash, hashes in that order), read from the store or built on first use
+    def hash_index(self, name: str):
+        key = ("hashes", name)
+        if key not in self._indexes:
+            self._indexes[key] = _hash_index(self.strings(name, 0, self._count))
+        return self._indexes[key]
+
+    def category(self, name: str, index: int) -> Optional[str]:
+        code = int(self._columns[name][index])
+        return None if code < 0 else self._labels[name][code]
+
+    def string(self, name: str, index: int) -> str:
+        if self._songs is not None:
+            return getattr(self._songs[index], name)
+        blob, offsets = self._strings[name]
+        return bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8', 'surrogateescape')
+
+    # string(name, i) for every row in [start, stop), decoded from one slice of the blob
+    def strings(self, name: str, start: int, stop: int) -> List[str]:
+        if self._songs is not None:
+            return [getattr(song, name) for song in self._songs[start:stop]]
+        blob, offsets = self._strings[name]
+        bounds = np.asarray(offsets[start:stop + 1], dtype=np.int64)
+        raw = bytes(blob[bounds[0]:bounds[-1]])
+        bounds = (bounds - bounds[0]).tolist()
+        return [raw[a:b].decode('utf-8', 'surrogateescape') for a, b in zip(bounds, bounds[1:])]
+
+    def find(self, name: str, value: str, ignore_case: bool = False) -> Optional[int]:
+        if not ignore_case:
+            # Exact lookups are a binary search in the hash index, the candidates are checked
+            # against the string itself in case two strings share a hash
+            rows, hashes = self.hash_index(name)
+            h = _string_hash(value)
+            for i in rows[np.searchsorted(hashes, h, 'left'):np.searchsorted(hashes, h, 'right')]:
+                if self.string(name, int(i)) == value:
+                    return int(i)
+            return None
+        value = value.lower()
+        for i in range(self._count):
+            if self.string(name, i).lower() == value:
+                return i
+        return None
+
+    def song(self, index: int) -> Song:
+        if self._songs is not None:
+            return self._songs[index]
+        song = Song(
+            path=self.string("path", index),
+            artist=self.category("artist", index),
+            album=self.category("album", index),
+            track_no=_none_if_missing(self._columns["track_no"][index], np.int32),
+            title=self.string("title", index),
+            genre=self.category("genre", index)
+        )
+        for name in ("tempo", "energy", "score", "chroma", "centroid", "size", "mtime"):
+            setattr(song, name, _none_if_missing(self._columns[name][index], NUMERIC_COLUMNS[name]))
+        song.mood = self.category("mood", index)
+        song.tier = self.category("tier", index)
+        return song
+
+    def songs(self, indices: Iterable[int]) -> List[Song]:
+        return [self.song(int(i)) for i in indices]
+
+
+def _encode_strings(values: List[str]):
+    encoded = [v.encode('utf-8', 'surrogateescape') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+@metrics.timed("store_write")
+def write_store(songs: List[Song], store_dir: str):
+    table = LibraryTable.from_songs(songs)
+    meta = {
+        "format": STORE_FORMAT,
+        "analyzer_version": ANALYZER_VERSION,
+        "count": len(table),
+        "labels": {name: table.labels(name) for name in CATEGORICAL_COLUMNS},
+    }
+
+    # Everything is written into a fresh directory first and swapped in at the end,
+    # so readers never see a half written store
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".songs_store.", dir=parent)
+    try:
+        for name in list(NUMERIC_COLUMNS) + list(CATEGORICAL_COLUMNS):
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), table.column(name))
+        for name in STRING_COLUMNS:
+            blob, offsets = _encode_strings([getattr(song, name) for song in songs])
+            np.save(os.path.join(tmp_dir, f"{name}.bin.npy"), blob)
+            np.save(os.path.join(tmp_dir, f"{name}.offsets.npy"), offsets)
+        for name in SORTED_COLUMNS:
+            order, values = table.sorted_index(name)
+            np.save(os.path.join(tmp_dir, f"{name}.order.npy"), order)
+            np.save(os.path.join(tmp_dir, f"{name}.sorted.npy"), values)
+        for name in CATEGORICAL_COLUMNS:
+            rows, offsets = table.postings(name)
+            np.save(os.path.join(tmp_dir, f"{name}.postings.npy"), rows)
+            np.save(os.path.join(tmp_dir, f"{name}.postings_offsets.npy"), offsets)
+        for name in HASHED_COLUMNS:
+            rows, hashes = table.hash_index(name)
+            np.save(os.path.join(tmp_dir, f"{name}.hash_rows.npy"), rows)
+            np.save(os.path.join(tmp_dir, f"{name}.hashes.npy"), hashes)
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        old_dir = None
+        if os.path.exists(store_dir):
+            old_dir = tempfile.mkdtemp(prefix=".songs_store.old.", dir=parent)
+            os.rmdir(old_dir)
+            os.replace(store_dir, old_dir)
+        os.replace(tmp_dir, store_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+# Opens the store with every array memory-mapped, nothing is read until a query touches it.
+# Only .npy files (with pickling disabled) and JSON are read, so a store is safe to load.
+@metrics.timed("store_open")
+def open_store(store_dir: str) -> Optional[LibraryTable]:
+    meta_path = os.path.join(store_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("format") != STORE_FORMAT or meta.get("analyzer_version") != ANALYZER_VERSION:
+            print(f"Feature store in {store_dir} is from a different version, it will be rebuilt.")
+            return None
+
+        def load(filename):
+            return np.load(os.path.join(store_dir, filename), mmap_mode='r', allow_pickle=False)
+
+        columns = {name: load(f"{name}.npy") for name in list(NUMERIC_COLUMNS) + list(CATEGORICAL_COLUMNS)}
+        strings = {name: (load(f"{name}.bin.npy"), load(f"{name}.offsets.npy")) for name in STRING_COLUMNS}
+        indexes = {("sorted", name): (load(f"{name}.order.npy"), load(f"{name}.sorted.npy")) for name in SORTED_COLUMNS}
+        for name in CATEGORICAL_COLUMNS:
+            indexes[("postings", name)] = (load(f"{name}.postings.npy"), load(f"{name}.postings_offsets.npy"))
+        for name in HASHED_COLUMNS:
+            indexes[("hashes", name)] = (load(f"{name}.hash_rows.npy"), load(f"{name}.hashes.npy"))
+        return LibraryTable(meta["count"], columns, meta["labels"], strings=strings, indexes=indexes)
+    except Exception as e:
+        print(f"Could not open feature store: {e}")
+        return None